@@ -1,5 +1,5 @@
 # add_user.py
-from database import session
+from database import session_scope
 from models import User
 
 def add_user(name, role, email):
@@ -11,21 +11,21 @@ def add_user(name, role, email):
         role (str): Role of the user ('Front Desk Medical Assistant' or 'General Practitioner').
         email (str): Email address of the user.
     """
-    # Check if user already exists
-    existing_user = session.query(User).filter_by(email=email).first()
-    if existing_user:
-        print(f"User with email {email} already exists.")
-        return
-    
-    # Create a new User instance
-    new_user = User(
-        name=name,
-        role=role,
-        email=email
-    )
-    # Add and commit to the database
-    session.add(new_user)
-    session.commit()
+    with session_scope() as session:
+        # Check if user already exists
+        existing_user = session.query(User).filter_by(email=email).first()
+        if existing_user:
+            print(f"User with email {email} already exists.")
+            return
+        
+        # Create a new User instance
+        new_user = User(
+            name=name,
+            role=role,
+            email=email
+        )
+        # Add to the database, committed when the scope closes
+        session.add(new_user)
     print(f"User {name} added successfully.")
 
 if __name__ == "__main__":
@@ -0,0 +1,143 @@
+# adherence_rollup.py
+"""
+Incrementally maintained follow-up adherence counts per (day, follow-up type, practitioner).
+
+Every state change to a follow-up bumps the matching rollup row in the same
+transaction, so reports read O(days x types) rows instead of re-aggregating
+all FollowUp x FollowUpAdherence rows.
+
+Usage:
+    python adherence_rollup.py rebuild
+"""
+
+import datetime
+from sqlalchemy import func, case, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import AdherenceRollup, Appointment, FollowUp, FollowUpAdherence
+import archive
+
+COUNTERS = ('due', 'completed', 'on_time', 'overdue')
+
+
+def bump(session, due_date, followup_type, user_id, **deltas):
+    """
+    Adds `deltas` (e.g. due=1 or completed=1, on_time=1) to one rollup row,
+    creating it if needed. The caller commits.
+    """
+    values = {name: deltas.get(name, 0) for name in COUNTERS}
+    stmt = sqlite_insert(AdherenceRollup).values(
+        day=due_date.date(),
+        followup_type=followup_type,
+        user_id=user_id,
+        **values
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['day', 'followup_type', 'user_id'],
+        set_={name: getattr(AdherenceRollup, name) + stmt.excluded[name] for name in COUNTERS}
+    )
+    session.execute(stmt)
+
+
+def completion_deltas(due_date, completed_at, sign=1):
+    """
+    Returns the counter changes for a follow-up becoming completed (sign=1)
+    or being un-completed (sign=-1).
+    """
+    return {
+        'completed': sign,
+        'on_time': sign if completed_at is not None and completed_at <= due_date else 0,
+        'overdue': sign if completed_at is not None and completed_at > due_date else 0,
+    }
+
+
+def record_scheduled(session, followup, user_id):
+    bump(session, followup.due_date, followup.followup_type, user_id, due=1)
+
+
+def record_completion(session, followup, completed_at, sign=1):
+    user_id = session.query(Appointment.user_id).filter_by(id=followup.appointment_id).scalar()
+    bump(session, followup.due_date, followup.followup_type, user_id,
+         **completion_deltas(followup.due_date, completed_at, sign))
+
+
+def rebuild(session):
+    """
+    Recomputes the whole rollup from FollowUp and FollowUpAdherence, hot and
+    archived, e.g. to backfill after the table was added. The caller commits.
+    """
+    followups = archive.combined(FollowUp)
+    appointments = archive.combined(Appointment)
+    adherence = archive.combined(FollowUpAdherence)
+    completed = adherence.c.completed.is_(True)
+    on_time = completed & (adherence.c.completed_at <= followups.c.due_date)
+    overdue = completed & (adherence.c.completed_at > followups.c.due_date)
+    aggregate = select(
+        func.date(followups.c.due_date),
+        followups.c.followup_type,
+        appointments.c.user_id,
+        func.count(followups.c.id),
+        func.sum(case((completed, 1), else_=0)),
+        func.sum(case((on_time, 1), else_=0)),
+        func.sum(case((overdue, 1), else_=0)),
+    ).select_from(followups) \
+     .join(appointments, appointments.c.id == followups.c.appointment_id) \
+     .outerjoin(adherence, adherence.c.followup_id == followups.c.id) \
+     .group_by(func.date(followups.c.due_date), followups.c.followup_type, appointments.c.user_id)
+
+    session.query(AdherenceRollup).delete(synchronize_session=False)
+    session.execute(insert(AdherenceRollup).from_select(
+        ['day', 'followup_type', 'user_id'] + list(COUNTERS), aggregate
+    ))
+
+
+def rebuild_if_empty(session):
+    """
+    Backfills the rollup once, when it is empty but follow-ups exist.
+    """
+    if session.query(AdherenceRollup.id).first() is None and session.query(FollowUp.id).first() is not None:
+        rebuild(session)
+        session.commit()
+        print("Adherence rollup rebuilt.")
+
+
+def summary(session, start=None, end=None, today=None):
+    """
+    Reads adherence counts from the rollup, optionally for due days in [start, end].
+
+    The stored 'overdue' counter only sees completions, so it is returned as
+    completed_late; 'overdue' adds the follow-ups of past days that are still
+    open (due - completed), i.e. everything not done by its due day.
+
+    Returns:
+        list: dicts with day, followup_type, user_id, due, completed, on_time,
+        completed_late and overdue.
+    """
+    today = today or datetime.date.today()
+    still_open = case((AdherenceRollup.day < today, AdherenceRollup.due - AdherenceRollup.completed), else_=0)
+    query = session.query(
+        AdherenceRollup.day,
+        AdherenceRollup.followup_type,
+        AdherenceRollup.user_id,
+        AdherenceRollup.due,
+        AdherenceRollup.completed,
+        AdherenceRollup.on_time,
+        AdherenceRollup.overdue.label('completed_late'),
+        (AdherenceRollup.overdue + still_open).label('overdue')
+    ).order_by(AdherenceRollup.day.desc(), AdherenceRollup.followup_type)
+    if start is not None:
+        query = query.filter(AdherenceRollup.day >= start)
+    if end is not None:
+        query = query.filter(AdherenceRollup.day <= end)
+    return [dict(row._mapping) for row in query]
+
+
+if __name__ == "__main__":
+    import sys
+    from database import session_scope
+
+    if sys.argv[1:] != ['rebuild']:
+        print(__doc__)
+        sys.exit(1)
+    with session_scope() as session:
+        rebuild(session)
+    print("Adherence rollup rebuilt.")
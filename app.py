@@ -1,16 +1,20 @@
 import streamlit as st
-import pandas as pd
-from datetime import datetime
-from database import session
+from datetime import datetime, timedelta
+from database import session_scope
 from models import User, Patient, Appointment, FollowUp, FollowUpAdherence
 from follow_up import *
 from waitlist import *
-from hunterIo import verify
-from gcalender import add_app_to_cal
-from notif import send_remainder
-from follow_up import generate_adherence_report
-from scheduler import start_scheduler
-from dotenv import load_dotenv
+from reminders import schedule_reminders
+from slots import get_index as get_slot_index, booking_conflict
+from queries import cancelled_appointments, dashboard_counts, recent_appointments, page_patients, page_appointments, page_followups, page_waitlist
+from follow_up import generate_adherence_report, adherence_report_filename, complete_followup
+from adherence_rollup import summary as adherence_summary
+from outbox import status_counts as outbox_status_counts, OUTBOX_METRICS_FILE
+import metrics
+from leader import current_leader, utcnow
+import query_stats
+import archive
+import io
 import os
 
 
@@ -19,35 +23,98 @@ import os
 
 
 
+# Dashboard figures are shared by every connected screen for a few seconds
+DASHBOARD_CACHE_TTL = int(os.getenv('DASHBOARD_CACHE_TTL', 30))
+
+
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL)
+def load_dashboard():
+    with session_scope() as session:
+        return dashboard_counts(session), recent_appointments(session)
+
+
+def invalidate_dashboard():
+    """
+    Drops the cached dashboard after the app writes, so its own changes show up immediately.
+    """
+    load_dashboard.clear()
+
+
+PAGE_SIZES = [25, 50, 100, 250]
+
+
+def paged_table(key, fetch, cursor_of, empty_message, searchable=True):
+    """
+    Renders one keyset-paginated page of a listing with search and Previous/Next controls.
+
+    Only the current page is queried and rendered, so cost is bounded by the
+    page size rather than the table size.
+
+    Parameters:
+        key (str): Unique widget key prefix for this listing.
+        fetch (callable): fetch(session, after, limit, search) returning a list of dicts.
+        cursor_of (callable): Returns the sort key of a row, used as `after` for the next page.
+        empty_message (str): Shown when there are no rows.
+        searchable (bool): Whether to show the search box.
+    """
+    col1, col2 = st.columns([3, 1])
+    search = col1.text_input("Search", key=f"{key}_search") if searchable else None
+    page_size = col2.selectbox("Page size", PAGE_SIZES, key=f"{key}_page_size")
+    
+    # Stack of cursors, one per page visited; reset when the filter changes
+    state = st.session_state.setdefault(f"{key}_pages", {'filter': None, 'cursors': [None]})
+    if state['filter'] != (search, page_size):
+        state['filter'] = (search, page_size)
+        state['cursors'] = [None]
+    cursors = state['cursors']
+    
+    # One extra row tells us whether there is a next page
+    with session_scope() as session:
+        rows = fetch(session, cursors[-1], page_size + 1, search)
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+    
+    if rows:
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+    else:
+        st.info(empty_message)
+    
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    col_page.caption(f"Page {len(cursors)}")
+    if col_prev.button("Previous", key=f"{key}_prev", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    if col_next.button("Next", key=f"{key}_next", disabled=not has_next):
+        cursors.append(cursor_of(rows[-1]))
+        st.rerun()
+
+
 st.set_page_config(page_title="Medical Scheduler", layout="wide")
 
 st.title("Medical Scheduler: Comprehensive Management Dashboard")
 
 st.sidebar.title("Navigation")
-tabs = st.sidebar.radio("Go to", ["Dashboard", "Manage Patients", "Manage Appointments", "Waitlist Management", "Cancellations", "Follow-Up Management", "Reports"])
+tabs = st.sidebar.radio("Go to", ["Dashboard", "Manage Patients", "Manage Appointments", "Waitlist Management", "Cancellations", "Follow-Up Management", "Reports", "System"])
+# Slow statements and over-budget units of work are logged with the tab that ran them
+query_stats.set_label(f"tab:{tabs}")
 
 if tabs == "Dashboard":
     st.header("Dashboard Overview")
-    total_patients = session.query(Patient).count()
-    total_appointments = session.query(Appointment).count()
-    pending_cancellations = session.query(Appointment).filter_by(status="Cancelled").count()
-    waitlist_count = session.query(Waitlist).count()
-    followups_pending = session.query(FollowUp).filter_by(status="Pending").count()
+    counts, recent = load_dashboard()
     
     col1, col2, col3, col4, col5 = st.columns(5)
-    col1.metric("Total Patients", total_patients)
-    col2.metric("Total Appointments", total_appointments)
-    col3.metric("Pending Cancellations", pending_cancellations)
-    col4.metric("Waitlist Count", waitlist_count)
-    col5.metric("Pending Follow-Ups", followups_pending)
+    col1.metric("Total Patients", counts['total_patients'])
+    col2.metric("Total Appointments", counts['total_appointments'])
+    col3.metric("Pending Cancellations", counts['pending_cancellations'])
+    col4.metric("Waitlist Count", counts['waitlist_count'])
+    col5.metric("Pending Follow-Ups", counts['followups_pending'])
     
     st.markdown("---")
     
     st.subheader("Recent Activities")
-    recent_appointments = session.query(Appointment).order_by(Appointment.appointment_datetime.desc()).limit(5).all()
-    if recent_appointments:
-        for appt in recent_appointments:
-            st.write(f"**Appointment ID:** {appt.id} | **Patient:** {appt.patient.name} | **Time:** {appt.appointment_datetime.strftime('%Y-%m-%d %H:%M')} | **Status:** {appt.status}")
+    if recent:
+        for appt in recent:
+            st.write(f"**Appointment ID:** {appt['id']} | **Patient:** {appt['patient_name']} | **Time:** {appt['appointment_datetime'].strftime('%Y-%m-%d %H:%M')} | **Status:** {appt['status']}")
     else:
         st.info("No recent appointments found.")
 
@@ -63,8 +130,9 @@ elif tabs == "Manage Patients":
         if submitted:
             if patient_name and patient_email:
                 new_patient = Patient(name=patient_name, email=patient_email)
-                session.add(new_patient)
-                session.commit()
+                with session_scope() as session:
+                    session.add(new_patient)
+                invalidate_dashboard()
                 st.success(f"Patient '{patient_name}' added successfully with ID {new_patient.id}.")
             else:
                 st.error("Please fill in all the fields.")
@@ -72,12 +140,12 @@ elif tabs == "Manage Patients":
     st.markdown("---")
     
     st.subheader("Existing Patients")
-    patients = session.query(Patient).all()
-    if patients:
-        for patient in patients:
-            st.write(f"**ID:** {patient.id} | **Name:** {patient.name} | **Email:** {patient.email}")
-    else:
-        st.info("No patients found.")
+    paged_table(
+        "patients",
+        page_patients,
+        lambda row: row['id'],
+        "No patients found."
+    )
 
 elif tabs == "Manage Appointments":
     st.header("Manage Appointments")
@@ -85,7 +153,9 @@ elif tabs == "Manage Appointments":
     st.subheader("Schedule New Appointment")
     with st.form("schedule_appointment_form"):
         patient_id = st.number_input("Patient ID", min_value=1, step=1, placeholder="Enter Patient ID")
-        practitioner = st.text_input("Practitioner Name", placeholder="Enter practitioner name")
+        with session_scope() as session:
+            practitioners = session.query(User).filter_by(role="General Practitioner").order_by(User.name).all()
+        practitioner = st.selectbox("Practitioner", practitioners, format_func=lambda user: user.name)
          # Input for date
         appointment_date = st.date_input("Appointment Date")
 
@@ -97,29 +167,71 @@ elif tabs == "Manage Appointments":
         submitted = st.form_submit_button("Schedule Appointment")
         
         if submitted:
-            patient = session.query(Patient).filter_by(id=patient_id).first()
-            if patient:
-                new_appointment = Appointment(
-                    patient_id=patient_id,
-                    practitioner=practitioner,
-                    appointment_datetime=appointment_datetime,
-                    status="Scheduled"
-                )
-                session.add(new_appointment)
-                session.commit()
-                st.success(f"Appointment scheduled successfully with ID {new_appointment.id}.")
-            else:
-                st.error("Patient not found. Please enter a valid Patient ID.")
+            slot_index = get_slot_index()
+            new_appointment = None
+
+            def booked_error():
+                # Double booking: point at the practitioner's next opening instead
+                next_slot = slot_index.next_available(practitioner.id, appointment_datetime)
+                hint = f" Next available: {next_slot.strftime('%Y-%m-%d %H:%M')}." if next_slot else ""
+                st.error(f"{practitioner.name} is already booked at that time.{hint}")
+
+            with session_scope() as session:
+                patient = session.query(Patient).filter_by(id=patient_id).first()
+                if not practitioner:
+                    st.error("No practitioners found. Please add a General Practitioner first.")
+                elif not slot_index.is_free(practitioner.id, appointment_datetime):
+                    booked_error()
+                elif patient:
+                    new_appointment = Appointment(
+                        patient_id=patient_id,
+                        user_id=practitioner.id,
+                        appointment_datetime=appointment_datetime,
+                        status="Scheduled"
+                    )
+                    session.add(new_appointment)
+                    session.flush()
+                    # The index may not have seen a booking made elsewhere yet; the
+                    # database has the final say, checked under the insert's write lock
+                    if booking_conflict(session, practitioner.id, appointment_datetime, ignore=new_appointment.id):
+                        session.rollback()
+                        new_appointment = None
+                        slot_index.refresh(session)
+                        booked_error()
+                    else:
+                        # Precompute the T-24h / T-30m reminders for the new appointment
+                        schedule_reminders(session, [new_appointment])
+                        st.success(f"Appointment scheduled successfully with ID {new_appointment.id}.")
+                else:
+                    st.error("Patient not found. Please enter a valid Patient ID.")
+            if new_appointment is not None:
+                slot_index.add(new_appointment.id, practitioner.id, appointment_datetime)
+            invalidate_dashboard()
+    
+    st.subheader("Free Slots")
+    free_day = st.date_input("Day", key="free_slots_day")
+    with session_scope() as session:
+        practitioner_names = dict(session.query(User.id, User.name).filter_by(role="General Practitioner").all())
+    free = get_slot_index().free_slots(free_day)
+    rows = [
+        {'practitioner': practitioner_names.get(user_id, user_id), 'from': start.strftime('%H:%M'), 'to': end.strftime('%H:%M')}
+        for user_id, gaps in free.items() if user_id in practitioner_names
+        for start, end in gaps
+    ]
+    if rows:
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+    else:
+        st.info("No free slots on this day.")
     
     st.markdown("---")
     
     st.subheader("Scheduled Appointments")
-    appointments = session.query(Appointment).filter_by(status="Scheduled").order_by(Appointment.appointment_datetime).all()
-    if appointments:
-        for appt in appointments:
-            st.write(f"**ID:** {appt.id} | **Patient:** {appt.patient.name} | **Time:** {appt.appointment_datetime.strftime('%Y-%m-%d %H:%M')} | **Status:** {appt.status}")
-    else:
-        st.info("No scheduled appointments found.")
+    paged_table(
+        "appointments",
+        lambda session, after, limit, search: page_appointments(session, "Scheduled", after, limit, search),
+        lambda row: (row['appointment_datetime'], row['id']),
+        "No scheduled appointments found."
+    )
 
 elif tabs == "Waitlist Management":
     st.header("Waitlist Management")
@@ -132,9 +244,11 @@ elif tabs == "Waitlist Management":
         submitted = st.form_submit_button("Add to Waitlist")
         
         if submitted:
-            patient = session.query(Patient).filter_by(id=patient_id).first()
+            with session_scope() as session:
+                patient = session.query(Patient).filter_by(id=patient_id).first()
             if patient:
                 if add_to_waitlist(patient_id=patient_id, urgency=priority,requested_datetime=requested_time):
+                    invalidate_dashboard()
                     st.success(f"Patient ID {patient_id} added to the waitlist with priority {priority}.")
                 else:
                     st.error("Failed to add patient to the waitlist. They might already be on the waitlist.")
@@ -144,18 +258,19 @@ elif tabs == "Waitlist Management":
     st.markdown("---")
     
     st.subheader("Current Waitlist")
-    waitlisted_patients = session.query(Waitlist).order_by(Waitlist.priority.desc(), Waitlist.added_at).all()
-    if waitlisted_patients:
-        for waitlist in waitlisted_patients:
-            st.write(f"**Patient ID:** {waitlist.patient_id} | **Priority Score:** {waitlist.priority} | **Added At:** {waitlist.added_at.strftime('%Y-%m-%d %H:%M')}")
-    else:
-        st.info("No patients on the waitlist.")
+    paged_table(
+        "waitlist",
+        page_waitlist,
+        lambda row: (row['priority'], row['added_at'], row['id']),
+        "No patients on the waitlist."
+    )
     
     st.markdown("---")
     
     st.subheader("Prioritize Waitlist")
     if st.button("Show Next Patient"):
-        next_patient = prioritize_waitlist()
+        with session_scope() as session:
+            next_patient = prioritize_waitlist(session)
         if next_patient:
             st.success(f"Next patient to assign: Patient ID {next_patient.patient_id} with Priority Score {next_patient.priority}.")
         else:
@@ -166,21 +281,22 @@ elif tabs == "Cancellations":
     
     st.subheader("Manage Cancellations")
     
-    canceled_appointments = session.query(Appointment).filter_by(status="Cancelled").all()
+    with session_scope() as session:
+        canceled_appointments = cancelled_appointments(session)
     if canceled_appointments:
         st.write("### Canceled Appointments")
-        for appt in canceled_appointments:
+        for appt_id, patient_name, appointment_datetime in canceled_appointments:
             col1, col2 = st.columns([3, 1])
             with col1:
-                st.write(f"**ID:** {appt.id} | **Patient:** {appt.patient.name} | **Time:** {appt.appointment_datetime.strftime('%Y-%m-%d %H:%M')}")
+                st.write(f"**ID:** {appt_id} | **Patient:** {patient_name} | **Time:** {appointment_datetime.strftime('%Y-%m-%d %H:%M')}")
             with col2:
-                if st.button(f"Process Cancellation (ID {appt.id})", key=f"cancel-{appt.id}"):
-                    if process_cancellation(appt.id):
-                        st.success(f"Successfully processed cancellation for Appointment ID {appt.id}.")
-                        appt.status = "Processed"
-                        session.commit()
+                if st.button(f"Process Cancellation (ID {appt_id})", key=f"cancel-{appt_id}"):
+                    # Reassigns the slot from the waitlist or marks it 'Processed'
+                    if process_cancellation(appt_id, slot_index=get_slot_index()):
+                        invalidate_dashboard()
+                        st.success(f"Successfully processed cancellation for Appointment ID {appt_id}.")
                     else:
-                        st.error(f"Failed to process cancellation for Appointment ID {appt.id}.")
+                        st.error(f"Failed to process cancellation for Appointment ID {appt_id}.")
     else:
         st.info("No canceled appointments to process.")
     
@@ -192,13 +308,19 @@ elif tabs == "Cancellations":
         submitted = st.form_submit_button("Cancel Appointment")
         
         if submitted:
-            appt = session.query(Appointment).filter_by(id=int(appointment_id)).first()
-            if appt and appt.status == "Scheduled":
-                appt.status = "Cancelled"
-                session.commit()
-                st.success(f"Appointment ID {appointment_id} has been cancelled.")
-            else:
-                st.error("Invalid Appointment ID or Appointment is not in a cancellable state.")
+            cancelled = False
+            with session_scope() as session:
+                appt = session.query(Appointment).filter_by(id=int(appointment_id)).first()
+                if appt and appt.status == "Scheduled":
+                    appt.status = "Cancelled"
+                    cancelled = True
+                    st.success(f"Appointment ID {appointment_id} has been cancelled.")
+                else:
+                    st.error("Invalid Appointment ID or Appointment is not in a cancellable state.")
+            if cancelled:
+                # The slot is free as soon as the cancellation is committed
+                get_slot_index().remove(int(appointment_id))
+            invalidate_dashboard()
 
 elif tabs == "Follow-Up Management":
     st.header("Follow-Up Management")
@@ -211,9 +333,11 @@ elif tabs == "Follow-Up Management":
         submitted = st.form_submit_button("Schedule Follow-Up")
         
         if submitted:
-            appt = session.query(Appointment).filter_by(id=int(appointment_id)).first()
+            with session_scope() as session:
+                appt = session.query(Appointment).filter_by(id=int(appointment_id)).first()
             if appt and appt.status == "Completed":
                 if schedule_followup(appointment_id=int(appointment_id), followup_type=followup_type, days_after=int(days_after)):
+                    invalidate_dashboard()
                     st.success(f"Follow-up '{followup_type}' scheduled for Appointment ID {appointment_id} in {days_after} day(s).")
                 else:
                     st.error("Failed to schedule follow-up. It might already be scheduled.")
@@ -223,12 +347,12 @@ elif tabs == "Follow-Up Management":
     st.markdown("---")
     
     st.subheader("Scheduled Follow-Ups")
-    scheduled_followups = session.query(FollowUp).filter_by(status="Pending").all()
-    if scheduled_followups:
-        for followup in scheduled_followups:
-            st.write(f"**Follow-Up ID:** {followup.id} | **Appointment ID:** {followup.appointment_id} | **Type:** {followup.followup_type} | **Due Date:** {followup.due_date.strftime('%Y-%m-%d %H:%M')}")
-    else:
-        st.info("No scheduled follow-ups.")
+    paged_table(
+        "followups",
+        page_followups,
+        lambda row: (row['due_date'], row['id']),
+        "No scheduled follow-ups."
+    )
     
     st.markdown("---")
     
@@ -238,14 +362,9 @@ elif tabs == "Follow-Up Management":
         submitted = st.form_submit_button("Mark as Completed")
         
         if submitted:
-            followup = session.query(FollowUp).filter_by(id=int(followup_id)).first()
-            if followup and followup.status == "Pending":
-                followup.status = "Completed"
-                adherence = session.query(FollowUpAdherence).filter_by(followup_id=followup.id).first()
-                if adherence:
-                    adherence.completed = True
-                    adherence.completed_at = datetime.now()
-                session.commit()
+            # Updates the follow-up, its adherence record and the adherence rollup together
+            if complete_followup(int(followup_id)):
+                invalidate_dashboard()
                 st.success(f"Follow-Up ID {followup_id} marked as completed.")
             else:
                 st.error("Invalid Follow-Up ID or Follow-Up is already completed.")
@@ -253,20 +372,23 @@ elif tabs == "Follow-Up Management":
     st.markdown("---")
     
     st.subheader("Generate Adherence Report")
+    compress = st.checkbox("Compress (gzip)", key="followup_report_gzip")
     if st.button("Generate Adherence Report"):
         try:
-            report = generate_adherence_report()
-            if report.empty:
-                st.info("No adherence data available.")
-            else:
-                csv = report.to_csv(index=False)
-                st.download_button(
-                    label="Download Report as CSV",
-                    data=csv,
-                    file_name=f"adherence_report_{datetime.now().strftime('%Y%m%d')}.csv",
-                    mime='text/csv',
-                )
-                st.success("Adherence report generated successfully.")
+            report, rows = generate_adherence_report(compress=compress)
+            with report:
+                if not rows:
+                    st.info("No adherence data available.")
+                else:
+                    # Handed over as the spooled file, not read into a bytes copy
+                    # first; the reader wrapper is a type download_button accepts
+                    st.download_button(
+                        label="Download Report as CSV",
+                        data=io.BufferedReader(report),
+                        file_name=adherence_report_filename(compress),
+                        mime='application/gzip' if compress else 'text/csv',
+                    )
+                    st.success("Adherence report generated successfully.")
         except Exception as e:
             st.error(f"Failed to generate adherence report: {e}")
     
@@ -280,21 +402,38 @@ elif tabs == "Follow-Up Management":
 elif tabs == "Reports":
     st.header("Reports")
     
+    st.subheader("Adherence Summary")
+    col1, col2 = st.columns(2)
+    summary_start = col1.date_input("From (due date)", value=datetime.now().date() - timedelta(days=30))
+    summary_end = col2.date_input("To (due date)", value=datetime.now().date())
+    # Read from the incrementally maintained rollup, not the raw follow-up history
+    with session_scope() as session:
+        adherence_rows = adherence_summary(session, summary_start, summary_end)
+    if adherence_rows:
+        st.dataframe(adherence_rows, use_container_width=True, hide_index=True)
+    else:
+        st.info("No follow-ups due in this period.")
+    
+    st.markdown("---")
+    
     st.subheader("Download Adherence Report")
+    compress = st.checkbox("Compress (gzip)", key="reports_report_gzip")
     if st.button("Download Adherence Report"):
         try:
-            report = generate_adherence_report()
-            if report.empty:
-                st.info("No adherence data available.")
-            else:
-                csv = report.to_csv(index=False)
-                st.download_button(
-                    label="Download Report as CSV",
-                    data=csv,
-                    file_name=f"adherence_report_{datetime.now().strftime('%Y%m%d')}.csv",
-                    mime='text/csv',
-                )
-                st.success("Adherence report downloaded successfully.")
+            report, rows = generate_adherence_report(compress=compress)
+            with report:
+                if not rows:
+                    st.info("No adherence data available.")
+                else:
+                    # Handed over as the spooled file, not read into a bytes copy
+                    # first; the reader wrapper is a type download_button accepts
+                    st.download_button(
+                        label="Download Report as CSV",
+                        data=io.BufferedReader(report),
+                        file_name=adherence_report_filename(compress),
+                        mime='application/gzip' if compress else 'text/csv',
+                    )
+                    st.success("Adherence report downloaded successfully.")
         except Exception as e:
             st.error(f"Failed to generate adherence report: {e}")
     
@@ -308,6 +447,73 @@ elif tabs == "Reports":
     #     except Exception as e:
     #         st.error(f"Failed to send adherence report: {e}")
 
+elif tabs == "System":
+    st.header("System")
+    
+    def job_rows(jobs):
+        rows = []
+        for name, stats in sorted(jobs.items()):
+            last_success = stats.get('last_success_timestamp_seconds')
+            rows.append({
+                'Job': name,
+                'Runs': int(stats.get('runs_total', 0)),
+                'Failures': int(stats.get('failures_total', 0)),
+                'Misfires': int(stats.get('misfires_total', 0)),
+                'Running': bool(stats.get('running')),
+                'Last Duration (s)': round(stats.get('last_duration_seconds', 0), 3),
+                'Last Success': datetime.fromtimestamp(last_success).strftime('%Y-%m-%d %H:%M:%S') if last_success else None,
+                'Last Rows': int(stats.get('last_rows', 0)),
+                'Last Queries': int(stats.get('last_queries', 0)),
+                'Emails Queued': int(stats.get('emails_queued_total', 0)),
+                'Emails Attempted': int(stats.get('emails_attempted_total', 0)),
+                'Emails Failed': int(stats.get('emails_failed_total', 0)),
+            })
+        return rows
+    
+    # The scheduler and the outbox worker run in their own processes and export their metrics to files
+    st.subheader("Scheduler Jobs")
+    with session_scope() as session:
+        lease = current_leader(session, 'scheduler')
+    if lease is not None and lease.expires_at > utcnow():
+        st.caption(f"Leader: {lease.holder} since {lease.acquired_at.strftime('%Y-%m-%d %H:%M:%S')} UTC, "
+                   f"lease renewed {lease.renewed_at.strftime('%H:%M:%S')} UTC")
+    else:
+        st.warning("No scheduler process holds the lease; jobs are not running.")
+    scheduler_jobs = job_rows(metrics.read_textfile(metrics.METRICS_FILE))
+    if scheduler_jobs:
+        st.dataframe(scheduler_jobs, use_container_width=True, hide_index=True)
+    else:
+        st.info(f"No scheduler metrics yet; they are written to {metrics.METRICS_FILE} after each job run.")
+    
+    st.subheader("Outbox")
+    with session_scope() as session:
+        outbox_counts = outbox_status_counts(session)
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Pending", outbox_counts.get('Pending', 0))
+    col2.metric("Sending", outbox_counts.get('Sending', 0))
+    col3.metric("Sent", outbox_counts.get('Sent', 0))
+    col4.metric("Dead", outbox_counts.get('Dead', 0))
+    outbox_jobs = job_rows(metrics.read_textfile(OUTBOX_METRICS_FILE))
+    if outbox_jobs:
+        st.dataframe(outbox_jobs, use_container_width=True, hide_index=True)
+    
+    st.subheader("Archive")
+    if archive.is_ready():
+        st.caption(f"Rows moved to {archive.ARCHIVE_DB_PATH}. Reports include them.")
+        st.dataframe(
+            [{'Table': table, 'Hot': hot, 'Archived': cold} for table, (hot, cold) in archive.status().items()],
+            use_container_width=True, hide_index=True
+        )
+    else:
+        st.info("Nothing archived yet; set ARCHIVE_DB_PATH and ARCHIVE_RETENTION_DAYS, or run archive.py.")
+    
+    st.subheader("Query Statistics")
+    if query_stats.DB_QUERY_STATS:
+        st.caption(f"Statements run by this app process, by total time. Slow queries go to {query_stats.DB_SLOW_QUERY_LOG}.")
+        st.dataframe(query_stats.report(), use_container_width=True, hide_index=True)
+    else:
+        st.info("Set DB_QUERY_STATS=true to collect statement statistics.")
+
 
 # def main():
 #     # Initialize session state variables
@@ -0,0 +1,419 @@
+# archive.py
+"""
+Hot/cold split: moves old appointments and everything hanging off them into
+the archive database, so the tables the jobs and the app scan only hold the
+active window.
+
+The archive is a second SQLite file, set with ARCHIVE_DB_PATH (nothing is
+attached while it is empty), attached to every connection as 'archive',
+with the same tables minus the foreign keys.
+An appointment is archived once it is older than ARCHIVE_RETENTION_DAYS and
+has no pending follow-up or unsent email; it moves together with its
+follow-ups, adherence records, reminders, reminder schedule, calendar event
+mapping and push failures, and sent outbox messages. Old waitlist entries
+and sent emails that belong to no appointment are archived as well.
+Patients, users and the adherence rollup stay hot.
+
+Every batch is copied and committed first, then copied again and deleted
+from the hot tables in a second transaction, so a crash between the two
+files' commits can leave a row in both places but never in neither.
+The hot tables use AUTOINCREMENT, so an archived row's id is never given
+to a new row; move() refuses to overwrite one that was.
+Freed pages are returned with incremental VACUUM.
+
+Reports read across both with combined(model).
+
+Usage (with ARCHIVE_DB_PATH set):
+    python archive.py [--days 365] [--batch-size 1000]
+    python archive.py --enable-incremental-vacuum   # once; rewrites the database
+    python archive.py --status
+"""
+
+import os
+import sys
+import time
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import MetaData, Table, Column, Index, select, union_all, text, exists, and_, or_, func
+from database import engine, session_scope, ARCHIVE_DB_PATH, DB_URL, default_archive_path
+from models import (
+    Appointment, FollowUp, FollowUpAdherence, Reminder, ReminderSchedule,
+    CalendarEvent, CalendarSyncFailure, OutboxMessage, Waitlist
+)
+
+# Appointments older than this many days are archived, 0 disables the scheduled job
+ARCHIVE_RETENTION_DAYS = int(os.getenv('ARCHIVE_RETENTION_DAYS', 0))
+# Appointments moved per transaction pair
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 1000))
+# Free pages returned to the file system per run, 0 returns all of them
+ARCHIVE_VACUUM_PAGES = int(os.getenv('ARCHIVE_VACUUM_PAGES', 0))
+
+logger = logging.getLogger('archive')
+
+
+class ArchiveConflict(Exception):
+    """
+    A row being archived has the primary key of a different row already in the archive.
+    """
+
+
+# Archived models, parents before children
+ARCHIVED_MODELS = [Appointment, FollowUp, FollowUpAdherence, Reminder, ReminderSchedule, CalendarEvent,
+                   CalendarSyncFailure, OutboxMessage, Waitlist]
+
+TABLE_NAMES = [model.__tablename__ for model in ARCHIVED_MODELS]
+
+archive_metadata = MetaData(schema='archive')
+
+
+def archive_table(model):
+    """
+    Returns the archive copy of a model's table: same columns and primary
+    key, no foreign keys (their parents may still be hot), one index per
+    column the moves and reports look rows up by.
+    """
+    name = model.__tablename__
+    table = archive_metadata.tables.get(f"archive.{name}")
+    if table is not None:
+        return table
+    columns = [
+        Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+        for column in model.__table__.columns
+    ]
+    table = Table(name, archive_metadata, *columns)
+    for column in ('appointment_id', 'followup_id', 'appointment_datetime'):
+        if column in table.c:
+            Index(f"ix_archive_{name}_{column}", table.c[column])
+    return table
+
+
+for model in ARCHIVED_MODELS:
+    archive_table(model)
+
+_ready = False
+
+
+def is_ready(bind=engine):
+    """
+    True once the archive is attached and its tables exist.
+    """
+    global _ready
+    if not _ready and ARCHIVE_DB_PATH:
+        with bind.connect() as conn:
+            _ready = conn.execute(text(
+                "SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = 'appointments'"
+            )).first() is not None
+    return _ready
+
+
+def create_tables(bind=engine):
+    """
+    Creates the archive tables, with incremental auto-vacuum on a new archive file.
+    """
+    if not ARCHIVE_DB_PATH:
+        raise RuntimeError(f"Set ARCHIVE_DB_PATH to enable archiving, e.g. to {default_archive_path(DB_URL)}")
+    with bind.connect() as conn:
+        if not is_ready(bind) and conn.exec_driver_sql("PRAGMA archive.auto_vacuum").scalar() != 2:
+            # The file is still empty, but attaching it in WAL mode already
+            # wrote its header, so the setting needs a VACUUM to take effect
+            conn.exec_driver_sql("PRAGMA archive.auto_vacuum = INCREMENTAL")
+            conn.exec_driver_sql("VACUUM archive")
+    archive_metadata.create_all(bind=bind)
+    reserve_archived_ids(bind)
+
+
+def reserve_archived_ids(bind=engine):
+    """
+    Moves each hot table's AUTOINCREMENT counter past its archived ids, so
+    ids of rows archived before the table used AUTOINCREMENT are not handed
+    out again.
+    """
+    with bind.begin() as conn:
+        if conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'")).first() is None:
+            return
+        for model in ARCHIVED_MODELS:
+            table = model.__table__
+            if not table.dialect_options['sqlite']['autoincrement']:
+                continue
+            archived = conn.execute(select(func.max(archive_table(model).c.id))).scalar()
+            if archived is None:
+                continue
+            params = {'name': table.name, 'seq': archived}
+            current = conn.execute(text("SELECT seq FROM sqlite_sequence WHERE name = :name"), params).first()
+            if current is None:
+                conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)"), params)
+            elif current.seq < archived:
+                conn.execute(text("UPDATE sqlite_sequence SET seq = :seq WHERE name = :name"), params)
+
+
+def combined(model, name=None):
+    """
+    Hot and archived rows of a model as one selectable with the same columns.
+
+    Falls back to the hot table while there is no archive, so callers can
+    use `.c` either way:
+
+        appointments = combined(Appointment)
+        session.query(appointments.c.id).filter(appointments.c.status == 'Completed')
+    """
+    table = model.__table__
+    if not is_ready():
+        return table
+    archived = archive_table(model)
+    columns = [column.name for column in table.columns]
+    return union_all(
+        select(*[table.c[column] for column in columns]),
+        select(*[archived.c[column] for column in columns])
+    ).subquery(name or f"all_{table.name}")
+
+
+def move(session, model, condition, replace=False):
+    """
+    Copies the rows of `model` matching `condition` (on the hot table) into
+    the archive. Returns the number of rows copied.
+
+    An archived row with the same primary key is only replaced if it has the
+    same content, i.e. it is this row's copy left by an interrupted batch,
+    or with `replace`, which the second copy of a batch uses to carry over
+    changes made since the first. Otherwise the key belongs to a different
+    row archived earlier, and ArchiveConflict is raised before anything is
+    overwritten.
+    """
+    table = model.__table__
+    archived = archive_table(model)
+    columns = [column.name for column in table.columns]
+    if not replace:
+        # Aliased, or the correlation mixes it up with the hot table of the same name
+        copy = archived.alias('archived')
+        keys = [column.name for column in table.primary_key.columns]
+        same_key = and_(*[copy.c[name] == table.c[name] for name in keys])
+        same_content = and_(*[copy.c[name].is_not_distinct_from(table.c[name]) for name in columns])
+        conflicts = session.execute(
+            select(*[table.c[name] for name in keys]).where(condition, exists().where(same_key, ~same_content)).limit(10)
+        ).all()
+        if conflicts:
+            raise ArchiveConflict(f"{table.name} rows {[tuple(row) for row in conflicts]} differ from the "
+                                  f"archived rows with the same key; resolve them before archiving again.")
+    statement = archived.insert().prefix_with('OR REPLACE').from_select(
+        columns, select(*[table.c[column] for column in columns]).where(condition)
+    )
+    return session.execute(statement).rowcount
+
+
+def hot_table(model):
+    return model.__table__
+
+
+def batch_conditions(appointment_ids, table=hot_table):
+    """
+    Rows belonging to a batch of appointments, per model, in FK order.
+
+    Parameters:
+        table (callable): Maps a model to the table the conditions apply to,
+                          hot_table (default) or archive_table.
+    """
+    followups = table(FollowUp)
+    followup_ids = select(followups.c.id).where(followups.c.appointment_id.in_(appointment_ids))
+    return [
+        (Appointment, table(Appointment).c.id.in_(appointment_ids)),
+        (FollowUp, followups.c.appointment_id.in_(appointment_ids)),
+        (FollowUpAdherence, table(FollowUpAdherence).c.followup_id.in_(followup_ids)),
+        (Reminder, table(Reminder).c.appointment_id.in_(appointment_ids)),
+        (ReminderSchedule, table(ReminderSchedule).c.appointment_id.in_(appointment_ids)),
+        (CalendarEvent, table(CalendarEvent).c.appointment_id.in_(appointment_ids)),
+        (CalendarSyncFailure, table(CalendarSyncFailure).c.appointment_id.in_(appointment_ids)),
+        (OutboxMessage, table(OutboxMessage).c.appointment_id.in_(appointment_ids)),
+    ]
+
+
+def row_conditions(model):
+    """
+    Returns a batch_conditions() counterpart for rows of `model` selected by their own id.
+    """
+    return lambda ids, table=hot_table: [(model, table(model).c.id.in_(ids))]
+
+
+def move_batch(ids, conditions, eligible):
+    """
+    Moves one batch: copy and commit, then copy again and delete the hot rows
+    (children first) in a second transaction.
+
+    Rows can change between the two, e.g. an email queued for an appointment
+    being archived, so the second transaction checks `ids` again. Those no
+    longer eligible stay hot and their copies are removed from the archive.
+
+    Parameters:
+        ids (list): Ids of the batch's top-level rows.
+        conditions (callable): conditions(ids, table) -> [(model, condition)] in FK order.
+        eligible (callable): eligible(session, ids) -> the ids that may still be archived.
+
+    Returns:
+        dict: Rows moved per table.
+    """
+    with session_scope() as session:
+        for model, condition in conditions(ids):
+            move(session, model, condition)
+    moved = {}
+    with session_scope() as session:
+        # Copied again so changes made since the first copy are not lost. This
+        # first write also opens the transaction, so the check below reads the
+        # same snapshot the deletes run against; a concurrent commit in
+        # between makes the deletes fail and roll back instead.
+        for model, condition in conditions(ids):
+            move(session, model, condition, replace=True)
+        still = set(eligible(session, ids))
+        dropped = [row_id for row_id in ids if row_id not in still]
+        if dropped:
+            logger.info(f"{len(dropped)} rows changed while being archived and stay hot.")
+            for model, condition in reversed(conditions(dropped, archive_table)):
+                session.execute(archive_table(model).delete().where(condition))
+        kept = [row_id for row_id in ids if row_id in still]
+        for model, condition in reversed(conditions(kept)):
+            moved[model.__tablename__] = session.query(model).filter(condition).delete(synchronize_session=False)
+    return moved
+
+
+def eligible_appointments(session, horizon, limit, ids=None):
+    """
+    Returns up to `limit` ids of appointments older than `horizon` with no
+    pending follow-up and no email still waiting in the outbox, optionally
+    only among `ids`.
+    """
+    pending_followup = exists().where(and_(FollowUp.appointment_id == Appointment.id, FollowUp.status == 'Pending'))
+    unsent_email = exists().where(and_(
+        OutboxMessage.appointment_id == Appointment.id,
+        OutboxMessage.status.in_(['Pending', 'Sending'])
+    ))
+    query = session.query(Appointment.id).filter(
+        Appointment.appointment_datetime < horizon,
+        ~pending_followup,
+        ~unsent_email
+    )
+    if ids is not None:
+        query = query.filter(Appointment.id.in_(ids))
+    return [row.id for row in query.order_by(Appointment.id).limit(limit)]
+
+
+def incremental_vacuum(bind=engine, pages=ARCHIVE_VACUUM_PAGES):
+    """
+    Returns free pages of the hot database to the file system, if it uses
+    incremental auto-vacuum (see enable_incremental_vacuum()).
+
+    Returns:
+        bool: Whether the database is in incremental mode.
+    """
+    with bind.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA main.auto_vacuum").scalar() != 2:
+            return False
+        # executescript() steps the pragma to the end; execute() frees one page
+        conn.connection.driver_connection.executescript(
+            f"PRAGMA main.incremental_vacuum({pages}); PRAGMA archive.incremental_vacuum({pages});"
+        )
+    return True
+
+
+def enable_incremental_vacuum(bind=engine):
+    """
+    Switches the hot database to incremental auto-vacuum. This runs a full
+    VACUUM, which rewrites the file and locks it meanwhile, so do it once
+    during a quiet period.
+    """
+    with bind.connect() as conn:
+        conn.exec_driver_sql("PRAGMA main.auto_vacuum = INCREMENTAL")
+        conn.exec_driver_sql("VACUUM main")
+
+
+def archive_old_rows(days=None, batch_size=ARCHIVE_BATCH_SIZE, now=None):
+    """
+    Moves everything older than `days` to the archive in batches.
+
+    Returns:
+        dict: Rows moved per table, plus 'batches' and 'seconds'.
+    """
+    days = days or ARCHIVE_RETENTION_DAYS
+    if days <= 0:
+        raise ValueError("Set ARCHIVE_RETENTION_DAYS or pass days")
+    horizon = (now or datetime.now()) - timedelta(days=days)
+    started = time.monotonic()
+    create_tables()
+    totals = dict.fromkeys(TABLE_NAMES, 0)
+    batches = 0
+
+    def add(moved):
+        for table, count in moved.items():
+            totals[table] += count
+
+    def appointments_still_eligible(session, ids):
+        return eligible_appointments(session, horizon, len(ids), ids)
+
+    while True:
+        with session_scope() as session:
+            appointment_ids = eligible_appointments(session, horizon, batch_size)
+        if not appointment_ids:
+            break
+        add(move_batch(appointment_ids, batch_conditions, appointments_still_eligible))
+        batches += 1
+
+    # Rows that belong to no appointment
+    for model, condition in (
+        (Waitlist, Waitlist.requested_datetime < horizon),
+        (OutboxMessage, and_(
+            OutboxMessage.appointment_id.is_(None),
+            OutboxMessage.created_at < horizon,
+            or_(OutboxMessage.status == 'Sent', OutboxMessage.status == 'Dead')
+        )),
+    ):
+        def still_eligible(session, ids, model=model, condition=condition):
+            return [row.id for row in session.query(model.id).filter(condition, model.id.in_(ids))]
+
+        while True:
+            with session_scope() as session:
+                ids = [row.id for row in session.query(model.id).filter(condition).order_by(model.id).limit(batch_size)]
+            if not ids:
+                break
+            add(move_batch(ids, row_conditions(model), still_eligible))
+            batches += 1
+
+    if batches and not incremental_vacuum():
+        logger.info("The database does not use incremental auto-vacuum; run "
+                    "'python archive.py --enable-incremental-vacuum' once to reclaim space.")
+    totals['batches'] = batches
+    totals['seconds'] = round(time.monotonic() - started, 3)
+    logger.info(f"Archived rows older than {horizon:%Y-%m-%d}: {totals}")
+    return totals
+
+
+def status(bind=engine):
+    """
+    Returns {table: (hot rows, archived rows)}.
+    """
+    counts = {}
+    ready = is_ready(bind)
+    with bind.connect() as conn:
+        for name in TABLE_NAMES:
+            hot = conn.execute(text(f"SELECT count(*) FROM main.{name}")).scalar()
+            cold = conn.execute(text(f"SELECT count(*) FROM archive.{name}")).scalar() if ready else 0
+            counts[name] = (hot, cold)
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
+    parser = argparse.ArgumentParser(description="Move old rows to the archive database.")
+    parser.add_argument('--days', type=int, default=ARCHIVE_RETENTION_DAYS or 365, help="Retention horizon in days")
+    parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument('--enable-incremental-vacuum', action='store_true')
+    parser.add_argument('--status', action='store_true')
+    args = parser.parse_args()
+
+    if args.enable_incremental_vacuum:
+        enable_incremental_vacuum()
+        print("Incremental auto-vacuum enabled.")
+    elif args.status:
+        for table, (hot, cold) in status().items():
+            print(f"{table}: {hot} hot, {cold} archived")
+    else:
+        print(archive_old_rows(args.days, args.batch_size))
+    sys.exit(0)
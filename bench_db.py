@@ -0,0 +1,112 @@
+# bench_db.py
+"""
+Compares concurrent read/write throughput of the SQLite engine profiles.
+
+Each profile runs in its own subprocess against a fresh temporary database,
+with writer threads inserting appointments (like the scheduler jobs) while
+reader threads run the dashboard-style queries.
+
+Usage:
+    python bench_db.py [--seconds 5] [--readers 4] [--writers 2]
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import threading
+import subprocess
+import time
+from datetime import datetime, timedelta
+
+PROFILES = ['default', 'performance']
+
+
+def run_profile(seconds, readers, writers):
+    # Imported here so DB_URL / DB_PROFILE from the parent process are picked up
+    from sqlalchemy import func
+    from database import engine, session_scope
+    from models import Base, User, Patient, Appointment
+
+    Base.metadata.create_all(bind=engine)
+    with session_scope() as session:
+        user = User(name="Bench Doctor", role="General Practitioner", email="bench@example.com")
+        session.add(user)
+        session.add_all(Patient(name=f"Patient {i}", email=f"p{i}@example.com") for i in range(100))
+        session.flush()
+        user_id = user.id
+
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def writer():
+        start = datetime.now()
+        while time.monotonic() < stop:
+            try:
+                with session_scope() as session:
+                    session.add(Appointment(
+                        patient_id=1,
+                        user_id=user_id,
+                        appointment_datetime=start + timedelta(minutes=counts['writes']),
+                        status='Scheduled'
+                    ))
+                key = 'writes'
+            except Exception:
+                key = 'errors'
+            with lock:
+                counts[key] += 1
+
+    def reader():
+        while time.monotonic() < stop:
+            try:
+                with session_scope() as session:
+                    session.query(func.count(Appointment.id)).filter_by(status='Scheduled').scalar()
+                    session.query(Appointment).order_by(Appointment.appointment_datetime.desc()).limit(5).all()
+                key = 'reads'
+            except Exception:
+                key = 'errors'
+            with lock:
+                counts[key] += 1
+
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    counts['reads_per_sec'] = round(counts['reads'] / seconds, 1)
+    counts['writes_per_sec'] = round(counts['writes'] / seconds, 1)
+    print(json.dumps(counts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_profile(args.seconds, args.readers, args.writers)
+        return
+
+    results = {}
+    for profile in PROFILES:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, DB_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}", DB_PROFILE=profile)
+            output = subprocess.run(
+                [sys.executable, __file__, '--worker', '--seconds', str(args.seconds),
+                 '--readers', str(args.readers), '--writers', str(args.writers)],
+                env=env, capture_output=True, text=True, check=True
+            ).stdout
+            results[profile] = json.loads(output.strip().splitlines()[-1])
+        print(f"{profile:>12}: {results[profile]}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+# benchmarks.py
+"""
+Benchmark suite for the scheduler jobs, the waitlist logic and the dashboard queries.
+
+Every scale runs in its own subprocess against a fresh temporary SQLite
+database seeded by seed_data.py, with email going to the in-memory mail
+backend, so nothing leaves the machine. Results are written as JSON so runs
+from different commits can be compared.
+
+Cold import time of the Streamlit app (first paint starts only after
+app.py's imports) is measured with `python -X importtime` in fresh
+interpreters; pass --imports to choose the modules.
+
+Usage:
+    python benchmarks.py [--scales 10k,100k,1m] [--repeat 3] [--output benchmark_results.json]
+    python benchmarks.py --scales none --imports app
+    python benchmarks.py --compare old.json new.json [--threshold 20]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+DEFAULT_SCALES = '10k'
+DEFAULT_IMPORTS = 'app'
+
+
+def parse_scale(scale):
+    multipliers = {'k': 1000, 'm': 1000000}
+    scale = scale.strip().lower()
+    if scale[-1] in multipliers:
+        return int(float(scale[:-1]) * multipliers[scale[-1]])
+    return int(scale)
+
+
+def run_scale(size, repeat, seed):
+    """
+    Seeds the database configured by DB_URL and times every benchmark.
+
+    Returns:
+        dict: size, seed_rows, seed_seconds and per-benchmark timings.
+    """
+    # Keep the jobs' log lines out of logs/scheduler.log; must run before scheduler is imported
+    import logging
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+
+    # Imported here so DB_URL and MAIL_BACKEND from the parent process are picked up
+    from sqlalchemy import text, select
+    from database import engine, session_scope
+    from models import Base, Waitlist, Appointment
+    import seed_data
+    import scheduler
+    import outbox
+    import follow_up
+    import adherence_rollup
+    from utils import prioritize_waitlist
+    from queries import dashboard_counts, recent_appointments, page_appointments
+
+    Base.metadata.create_all(bind=engine)
+    started = time.perf_counter()
+    seed_rows = seed_data.seed(engine, size, seed=seed)
+    seed_seconds = time.perf_counter() - started
+
+    results = {}
+
+    def bench(name, fn, setup=None, runs=repeat):
+        timings = []
+        outcome = None
+        for _ in range(runs):
+            if setup is not None:
+                setup()
+            started = time.perf_counter()
+            outcome = fn()
+            timings.append(time.perf_counter() - started)
+        results[name] = {
+            'runs': [round(t, 6) for t in timings],
+            'min': round(min(timings), 6),
+            'median': round(statistics.median(timings), 6),
+        }
+        if isinstance(outcome, int):
+            results[name]['rows'] = outcome
+        print(f"{size:>9} {name:<28} min {min(timings):.4f}s  median {statistics.median(timings):.4f}s", file=sys.stderr)
+
+    def reset_reminders():
+        with engine.begin() as conn:
+            conn.execute(text(
+                "UPDATE reminder_schedule SET claimed_at = NULL, claim_token = NULL, sent_at = NULL "
+                "WHERE due_at <= :now"
+            ), {'now': datetime.now()})
+            conn.execute(text("DELETE FROM outbox"))
+
+    def reset_outbox():
+        with engine.begin() as conn:
+            conn.execute(text(
+                "UPDATE outbox SET status = 'Pending', attempts = 0, next_attempt_at = :now"
+            ), {'now': datetime.now()})
+
+    def drain_all():
+        sent = 0
+        while True:
+            result = outbox.drain(batch_size=500)
+            if not sum(result.values()):
+                return sent
+            sent += result['sent']
+
+    def daily_summary():
+        scheduler.generate_daily_summary()
+
+    def adherence_report():
+        report, rows = follow_up.generate_adherence_report()
+        report.close()
+        return rows
+
+    with session_scope() as session:
+        slots = [row[0] for row in session.execute(
+            select(Waitlist.requested_datetime).distinct().limit(1000)
+        )]
+        middle = session.execute(
+            select(Appointment.appointment_datetime, Appointment.id)
+            .where(Appointment.status == 'Scheduled')
+            .order_by(Appointment.appointment_datetime, Appointment.id)
+            .offset(size // 4).limit(1)
+        ).first()
+
+    def waitlist_lookups():
+        with session_scope() as session:
+            for slot in slots:
+                prioritize_waitlist(session, slot)
+        return len(slots)
+
+    def dashboard():
+        with session_scope() as session:
+            dashboard_counts(session)
+            recent_appointments(session)
+
+    def first_page():
+        with session_scope() as session:
+            return len(page_appointments(session, 'Scheduled', None, 50))
+
+    def deep_page():
+        with session_scope() as session:
+            return len(page_appointments(session, 'Scheduled', tuple(middle) if middle else None, 50))
+
+    def rollup_summary():
+        today = datetime.now().date()
+        with session_scope() as session:
+            return len(adherence_rollup.summary(session, today - timedelta(days=30), today))
+
+    bench('send_reminders', scheduler.send_reminders, setup=reset_reminders)
+    bench('outbox_drain', drain_all, setup=reset_outbox)
+    bench('generate_daily_summary', daily_summary)
+    bench('prioritize_waitlist', waitlist_lookups)
+    bench('generate_adherence_report', adherence_report)
+    bench('dashboard', dashboard)
+    bench('page_appointments_first', first_page)
+    bench('page_appointments_deep', deep_page)
+    bench('adherence_summary', rollup_summary)
+    # Reassigns the cancelled slots, so later runs would measure an empty job
+    bench('monitor_cancellations', scheduler.monitor_cancellations, runs=1)
+
+    return {
+        'size': size,
+        'seed_rows': seed_rows,
+        'seed_seconds': round(seed_seconds, 3),
+        'benchmarks': results,
+    }
+
+
+def import_time(module, repeat):
+    """
+    Imports `module` in `repeat` fresh interpreters with -X importtime.
+
+    Returns:
+        dict: min and median cumulative import time in ms, and the ten
+        modules with the highest self time in the fastest run.
+    """
+    runs = []
+    for _ in range(repeat):
+        stderr = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stderr
+        rows = []
+        for line in stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            rows.append((name.strip(), int(self_us), int(cumulative_us)))
+        total = next(cumulative for name, _, cumulative in rows if name == module)
+        runs.append((total, rows))
+    runs.sort(key=lambda run: run[0])
+    heaviest = sorted(runs[0][1], key=lambda row: row[1], reverse=True)[:10]
+    return {
+        'min': round(runs[0][0] / 1000, 1),
+        'median': round(statistics.median(total for total, _ in runs) / 1000, 1),
+        'heaviest': [{'module': name, 'self_ms': round(self_us / 1000, 1)} for name, self_us, _ in heaviest],
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path, new_path, threshold):
+    """
+    Prints the median change per benchmark between two result files.
+
+    Returns:
+        int: Number of benchmarks that got slower by more than `threshold` percent.
+    """
+    with open(old_path) as file:
+        old = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    regressions = 0
+    for module, timing in new.get('imports', {}).items():
+        baseline = old.get('imports', {}).get(module)
+        if not baseline or not baseline['median']:
+            continue
+        change = (timing['median'] / baseline['median'] - 1) * 100
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f"{'import':>6} {module:<28} {baseline['median']:.1f}ms -> {timing['median']:.1f}ms ({change:+.0f}%){flag}")
+    for scale, result in new['scales'].items():
+        baseline = old['scales'].get(scale, {}).get('benchmarks', {})
+        for name, timing in result['benchmarks'].items():
+            if name not in baseline or not baseline[name]['median']:
+                continue
+            change = (timing['median'] / baseline[name]['median'] - 1) * 100
+            flag = ''
+            if change > threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            print(f"{scale:>6} {name:<28} {baseline[name]['median']:.4f}s -> {timing['median']:.4f}s ({change:+.0f}%){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default=DEFAULT_SCALES, help="Comma separated sizes, e.g. 10k,100k,1m, or 'none'")
+    parser.add_argument('--imports', default=DEFAULT_IMPORTS, help="Comma separated modules to time the cold import of, or 'none'")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    parser.add_argument('--threshold', type=float, default=20, help="Percent slowdown reported as a regression")
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    if args.worker:
+        print(json.dumps(run_scale(args.worker, args.repeat, args.seed)))
+        return
+
+    import sqlalchemy
+    report = {
+        'commit': git_commit(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'imports': {},
+        'scales': {},
+    }
+    for module in args.imports.split(',') if args.imports != 'none' else []:
+        report['imports'][module] = import_time(module, args.repeat)
+        print(f"{'import':>9} {module:<28} min {report['imports'][module]['min']:.1f}ms  "
+              f"median {report['imports'][module]['median']:.1f}ms", file=sys.stderr)
+    for scale in args.scales.split(',') if args.scales != 'none' else []:
+        size = parse_scale(scale)
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                DB_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                MAIL_BACKEND='memory',
+                HUNTER_BACKEND='fake'
+            )
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--worker', str(size),
+                 '--repeat', str(args.repeat), '--seed', str(args.seed)],
+                env=env, stdout=subprocess.PIPE, text=True, check=True,
+                cwd=os.path.dirname(os.path.abspath(__file__))
+            ).stdout
+        report['scales'][scale] = json.loads(output.strip().splitlines()[-1])
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+# bulk_import.py
+"""
+Bulk import of users, patients and appointments from CSV or JSON Lines.
+
+The input is streamed in chunks, so memory stays bounded no matter how big
+the file is. Each chunk is validated, deduplicated and written in one
+transaction with executemany-style bulk statements:
+
+- users and patients are matched on email: existing rows are updated,
+  new ones inserted.
+- appointments reference patient_email and practitioner_email and are
+  matched on (patient, practitioner, appointment_datetime). Their
+  reminders are scheduled like for a booking made in the app.
+
+Usage:
+    python bulk_import.py users users.csv
+    python bulk_import.py patients patients.jsonl [--verify-emails]
+    python bulk_import.py appointments appointments.csv.gz [--chunk-size 5000] [--rejects rejects.jsonl]
+
+CSV files need a header row. Files ending in .gz are decompressed on the fly.
+"""
+
+import os
+import re
+import csv
+import sys
+import gzip
+import json
+import time
+import argparse
+from itertools import islice
+from types import SimpleNamespace
+from datetime import datetime
+from sqlalchemy import select, insert, func
+from database import session_scope
+from models import User, Patient, Appointment
+from reminders import schedule_reminders
+
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', 5000))
+
+ROLES = ('Front Desk Medical Assistant', 'General Practitioner')
+STATUSES = ('Scheduled', 'Cancelled', 'Completed', 'Processed')
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+
+def open_input(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', newline='', encoding='utf-8')
+    return open(path, newline='', encoding='utf-8')
+
+
+def read_rows(path, fmt=None):
+    """
+    Yields one dict per record of a CSV or JSON Lines file.
+
+    Parameters:
+        path (str): Input file, optionally gzipped.
+        fmt (str): 'csv' or 'jsonl', guessed from the extension by default.
+    """
+    if fmt is None:
+        name = path[:-3] if path.endswith('.gz') else path
+        fmt = 'jsonl' if name.endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+    with open_input(path) as file:
+        if fmt == 'csv':
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def required(row, field):
+    value = (row.get(field) or '').strip()
+    if not value:
+        raise ValueError(f"missing {field}")
+    return value
+
+
+def clean_email(row, field='email'):
+    email = required(row, field).lower()
+    if not EMAIL_PATTERN.match(email):
+        raise ValueError(f"invalid {field} '{email}'")
+    return email
+
+
+def validate_user(row):
+    role = required(row, 'role')
+    if role not in ROLES:
+        raise ValueError(f"unknown role '{role}'")
+    return {'name': required(row, 'name'), 'role': role, 'email': clean_email(row)}
+
+
+def validate_patient(row):
+    return {
+        'name': required(row, 'name'),
+        'email': clean_email(row),
+        'phone_number': (row.get('phone_number') or '').strip() or None,
+    }
+
+
+def validate_appointment(row):
+    try:
+        appointment_datetime = datetime.fromisoformat(required(row, 'appointment_datetime'))
+    except ValueError as e:
+        raise ValueError(f"invalid appointment_datetime: {e}")
+    status = (row.get('status') or 'Scheduled').strip()
+    if status not in STATUSES:
+        raise ValueError(f"unknown status '{status}'")
+    return {
+        'patient_email': clean_email(row, 'patient_email'),
+        'practitioner_email': clean_email(row, 'practitioner_email'),
+        'appointment_datetime': appointment_datetime,
+        'status': status,
+    }
+
+
+def upsert_by_email(session, model, records, stats):
+    """
+    Updates the rows whose email already exists and inserts the rest.
+    """
+    emails = [record['email'] for record in records]
+    existing = dict(session.execute(
+        select(model.email, func.min(model.id)).where(model.email.in_(emails)).group_by(model.email)
+    ).all())
+    updates = [dict(record, id=existing[record['email']]) for record in records if record['email'] in existing]
+    inserts = [record for record in records if record['email'] not in existing]
+    if updates:
+        session.bulk_update_mappings(model, updates)
+    if inserts:
+        session.bulk_insert_mappings(model, inserts)
+    stats['updated'] += len(updates)
+    stats['inserted'] += len(inserts)
+    return []
+
+
+def write_users(session, records, stats):
+    return upsert_by_email(session, User, records, stats)
+
+
+def write_patients(session, records, stats):
+    return upsert_by_email(session, Patient, records, stats)
+
+
+def write_appointments(session, records, stats):
+    """
+    Resolves patient and practitioner emails, updates the status of
+    appointments that already exist, inserts the rest and schedules reminders.
+
+    Returns:
+        list: (record, error) pairs for rows that could not be resolved.
+    """
+    patient_ids = dict(session.execute(
+        select(Patient.email, func.min(Patient.id))
+        .where(Patient.email.in_({record['patient_email'] for record in records}))
+        .group_by(Patient.email)
+    ).all())
+    user_ids = dict(session.execute(
+        select(User.email, User.id).where(User.email.in_({record['practitioner_email'] for record in records}))
+    ).all())
+
+    rejected = []
+    resolved = []
+    for record in records:
+        if record['patient_email'] not in patient_ids:
+            rejected.append((record, f"unknown patient_email '{record['patient_email']}'"))
+        elif record['practitioner_email'] not in user_ids:
+            rejected.append((record, f"unknown practitioner_email '{record['practitioner_email']}'"))
+        else:
+            resolved.append({
+                'patient_id': patient_ids[record['patient_email']],
+                'user_id': user_ids[record['practitioner_email']],
+                'appointment_datetime': record['appointment_datetime'],
+                'status': record['status'],
+            })
+    if not resolved:
+        return rejected
+
+    existing = {
+        (row.patient_id, row.user_id, row.appointment_datetime): row
+        for row in session.execute(
+            select(Appointment.id, Appointment.patient_id, Appointment.user_id,
+                   Appointment.appointment_datetime, Appointment.status)
+            .where(
+                Appointment.patient_id.in_({row['patient_id'] for row in resolved}),
+                Appointment.appointment_datetime.in_({row['appointment_datetime'] for row in resolved})
+            )
+        )
+    }
+
+    updates = []
+    inserts = []
+    for row in resolved:
+        match = existing.get((row['patient_id'], row['user_id'], row['appointment_datetime']))
+        if match is None:
+            inserts.append(row)
+        elif match.status != row['status']:
+            updates.append({'id': match.id, 'status': row['status']})
+    stats['skipped'] += len(resolved) - len(inserts) - len(updates)
+
+    changed = []
+    if updates:
+        session.bulk_update_mappings(Appointment, updates)
+        by_id = {match.id: match for match in existing.values()}
+        changed += [
+            SimpleNamespace(id=update['id'], status=update['status'],
+                            appointment_datetime=by_id[update['id']].appointment_datetime)
+            for update in updates
+        ]
+    if inserts:
+        changed += session.execute(
+            insert(Appointment).returning(Appointment.id, Appointment.status, Appointment.appointment_datetime),
+            inserts
+        ).all()
+    schedule_reminders(session, changed)
+
+    stats['updated'] += len(updates)
+    stats['inserted'] += len(inserts)
+    return rejected
+
+
+IMPORTERS = {
+    'users': (validate_user, lambda record: record['email'], write_users),
+    'patients': (validate_patient, lambda record: record['email'], write_patients),
+    'appointments': (
+        validate_appointment,
+        lambda record: (record['patient_email'], record['practitioner_email'], record['appointment_datetime']),
+        write_appointments
+    ),
+}
+
+
+def run_import(entity, rows, chunk_size=IMPORT_CHUNK_SIZE, verify_emails=False, rejects=None, progress=True):
+    """
+    Imports an iterable of raw records.
+
+    Parameters:
+        entity (str): 'users', 'patients' or 'appointments'.
+        rows (iterable): dicts as read by read_rows().
+        chunk_size (int): Records per transaction.
+        verify_emails (bool): Check patient emails with hunterIo.verify_many.
+        rejects (file): Optional text file that receives rejected rows as JSON lines.
+        progress (bool): Print a progress line after every chunk.
+
+    Returns:
+        dict: Counts of 'read', 'inserted', 'updated', 'skipped' and 'rejected' rows,
+        plus 'seconds' and 'rows_per_second'.
+    """
+    validate, key, write = IMPORTERS[entity]
+    stats = {'read': 0, 'inserted': 0, 'updated': 0, 'skipped': 0, 'rejected': 0}
+    started = time.monotonic()
+
+    def reject(row, error):
+        stats['rejected'] += 1
+        if rejects is not None:
+            rejects.write(json.dumps({'row': row, 'error': error}, default=str) + '\n')
+
+    for chunk in chunked(rows, chunk_size):
+        stats['read'] += len(chunk)
+
+        # Validate, then keep the last occurrence of every key in the chunk
+        records = {}
+        for row in chunk:
+            try:
+                record = validate(row)
+            except ValueError as e:
+                reject(row, str(e))
+                continue
+            if key(record) in records:
+                stats['skipped'] += 1
+            records[key(record)] = record
+        records = list(records.values())
+
+        if verify_emails and entity == 'patients' and records:
+            # Imported lazily: it talks to the Hunter.io API
+            from hunterIo import verify_many
+            verified = verify_many(record['email'] for record in records)
+            for record in records:
+                record['email_verified'] = verified.get(record['email'], False)
+
+        if records:
+            with session_scope() as session:
+                for record, error in write(session, records, stats):
+                    reject(record, error)
+
+        if progress:
+            elapsed = time.monotonic() - started
+            print(f"{entity}: {stats['read']} rows read, {stats['inserted']} inserted, "
+                  f"{stats['updated']} updated, {stats['skipped']} skipped, {stats['rejected']} rejected "
+                  f"({stats['read'] / elapsed if elapsed else 0:.0f} rows/s)")
+
+    stats['seconds'] = round(time.monotonic() - started, 3)
+    stats['rows_per_second'] = round(stats['read'] / stats['seconds']) if stats['seconds'] else None
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import users, patients or appointments.")
+    parser.add_argument('entity', choices=sorted(IMPORTERS))
+    parser.add_argument('path', help="CSV or JSON Lines file, optionally .gz")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help="Override the format guessed from the extension")
+    parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help="Rows per transaction")
+    parser.add_argument('--verify-emails', action='store_true', help="Verify patient emails with Hunter.io")
+    parser.add_argument('--rejects', help="Write rejected rows and the reason to this JSON Lines file")
+    args = parser.parse_args(argv)
+
+    rejects = open(args.rejects, 'w', encoding='utf-8') if args.rejects else None
+    try:
+        stats = run_import(
+            args.entity,
+            read_rows(args.path, args.format),
+            chunk_size=args.chunk_size,
+            verify_emails=args.verify_emails,
+            rejects=rejects
+        )
+    finally:
+        if rejects is not None:
+            rejects.close()
+    print(f"Done in {stats['seconds']}s ({stats['rows_per_second']} rows/s): {json.dumps(stats)}")
+    return 0 if stats['rejected'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
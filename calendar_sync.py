@@ -0,0 +1,457 @@
+# calendar_sync.py
+"""
+Incremental two-way sync between appointments and Google Calendar.
+
+Each run only touches what changed:
+
+- push: appointments whose updated_at is past the stored watermark are
+  inserted, updated or deleted as events, in batches of up to 50 requests.
+  The calendar_events table maps every appointment to its event, and
+  calendar_sync_failures holds the ones waiting for a retry.
+- pull: events changed in the calendar since the stored syncToken are read
+  back. A moved event moves its appointment and a deleted event cancels it,
+  which lets monitor_cancellations offer the slot to the waitlist.
+
+Usage:
+    python calendar_sync.py
+"""
+
+import os
+import logging
+import itertools
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from sqlalchemy import or_, and_
+from sqlalchemy.orm import joinedload
+from database import session_scope
+from models import Appointment, CalendarEvent, CalendarSyncFailure, SyncState
+from reminders import schedule_reminders
+import gcalender
+
+PUSH_WATERMARK_KEY = 'calendar.push_watermark'
+SYNC_TOKEN_KEY = 'calendar.sync_token'
+
+# Appointments pushed per run; the rest follow on the next run
+CALENDAR_SYNC_LIMIT = int(os.getenv('CALENDAR_SYNC_LIMIT', 500))
+
+# Appointment statuses whose event is removed from the calendar
+REMOVED_STATUSES = ('Cancelled', 'Processed')
+
+# Failed pushes are retried after 5, 10, 20, ... minutes and given up on
+# after this many attempts, until the appointment changes again
+CALENDAR_MAX_ATTEMPTS = int(os.getenv('CALENDAR_MAX_ATTEMPTS', 5))
+CALENDAR_RETRY_MINUTES = int(os.getenv('CALENDAR_RETRY_MINUTES', 5))
+
+logger = logging.getLogger('calendar_sync')
+
+
+class SyncTokenExpired(Exception):
+    """
+    The stored syncToken is no longer accepted (HTTP 410) and a full sync is needed.
+    """
+
+
+class CalendarHTTPError(Exception):
+    """
+    An HTTP error from FakeCalendarAPI, with the same resp.status as googleapiclient's HttpError.
+    """
+
+    def __init__(self, status, reason=''):
+        super().__init__(f"HTTP {status} {reason}".strip())
+        self.resp = SimpleNamespace(status=status)
+
+
+def error_status(error):
+    """
+    Returns the HTTP status of a Calendar API error, or None for other errors.
+    """
+    return getattr(getattr(error, 'resp', None), 'status', None)
+
+
+class GoogleCalendarAPI:
+    """
+    The Calendar calls used by the sync, on top of gcalender.get_calendar_service().
+    """
+
+    def __init__(self, service=None, calendar_id=gcalender.CALENDAR_ID):
+        self.service = service or gcalender.get_calendar_service()
+        self.calendar_id = calendar_id
+
+    def _request(self, op):
+        events = self.service.events()
+        if op['action'] == 'insert':
+            return events.insert(calendarId=self.calendar_id, body=op['body'])
+        if op['action'] == 'update':
+            return events.update(calendarId=self.calendar_id, eventId=op['event_id'], body=op['body'])
+        return events.delete(calendarId=self.calendar_id, eventId=op['event_id'])
+
+    def apply(self, ops):
+        """
+        Runs insert/update/delete operations through batch requests.
+
+        Parameters:
+            ops (list): dicts with key, action ('insert', 'update' or 'delete'),
+                        event_id and body.
+
+        Returns:
+            dict: {key: (event or None, error or None)}.
+        """
+        results = {}
+        actions = {str(op['key']): op['action'] for op in ops}
+
+        def on_response(request_id, response, exception):
+            status = error_status(exception)
+            if exception is not None and not (actions[request_id] == 'delete' and status in (404, 410)):
+                results[request_id] = (None, exception)
+            else:
+                results[request_id] = (response, None)
+
+        for start in range(0, len(ops), gcalender.CALENDAR_BATCH_SIZE):
+            chunk = ops[start:start + gcalender.CALENDAR_BATCH_SIZE]
+            batch = self.service.new_batch_http_request(callback=on_response)
+            for op in chunk:
+                batch.add(self._request(op), request_id=str(op['key']))
+            try:
+                batch.execute()
+            except Exception as e:
+                for op in chunk:
+                    results.setdefault(str(op['key']), (None, e))
+        return {op['key']: results[str(op['key'])] for op in ops}
+
+    def list_changes(self, sync_token=None):
+        """
+        Lists events changed since `sync_token`, or every event without one.
+
+        Returns:
+            tuple: (events, next sync token).
+        """
+        events = []
+        page_token = None
+        while True:
+            params = {'calendarId': self.calendar_id, 'showDeleted': True, 'singleEvents': True}
+            if page_token:
+                params['pageToken'] = page_token
+            if sync_token:
+                params['syncToken'] = sync_token
+            try:
+                response = self.service.events().list(**params).execute()
+            except Exception as e:
+                if sync_token and error_status(e) == 410:
+                    raise SyncTokenExpired() from e
+                raise
+            events.extend(response.get('items', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return events, response.get('nextSyncToken')
+
+
+class FakeCalendarAPI:
+    """
+    In-memory stand-in for GoogleCalendarAPI used in tests and offline runs.
+
+    remote_update() and remote_cancel() simulate edits made in Google Calendar;
+    errors maps an appointment id to the HTTP status its pushes fail with.
+    """
+
+    def __init__(self):
+        self.events = {}
+        self.errors = {}
+        self.changes = []  # event ids in the order they changed
+        self.calls = 0
+        self._ids = itertools.count(1)
+
+    def _touch(self, event_id):
+        self.changes.append(event_id)
+
+    def apply(self, ops):
+        self.calls += 1
+        results = {}
+        for op in ops:
+            if op['key'] in self.errors:
+                results[op['key']] = (None, CalendarHTTPError(self.errors[op['key']]))
+                continue
+            if op['action'] == 'insert':
+                event = dict(op['body'], id=f"evt{next(self._ids)}", status='confirmed')
+            elif op['action'] == 'update':
+                if op['event_id'] not in self.events:
+                    results[op['key']] = (None, CalendarHTTPError(404, 'Not Found'))
+                    continue
+                event = dict(op['body'], id=op['event_id'], status='confirmed')
+            else:
+                self.events.pop(op['event_id'], None)
+                results[op['key']] = (None, None)
+                continue
+            self.events[event['id']] = event
+            results[op['key']] = (event, None)
+        return results
+
+    def remote_update(self, event_id, start):
+        self.events[event_id]['start'] = {'dateTime': start.isoformat(), 'timeZone': os.getenv('TIMEZONE', 'UTC')}
+        self._touch(event_id)
+
+    def remote_cancel(self, event_id):
+        self.events[event_id]['status'] = 'cancelled'
+        self._touch(event_id)
+
+    def list_changes(self, sync_token=None):
+        self.calls += 1
+        position = int(sync_token) if sync_token else 0
+        changed = list(dict.fromkeys(self.changes[position:])) if sync_token else list(self.events)
+        return [self.events[event_id] for event_id in changed], str(len(self.changes))
+
+
+def get_state(session, key):
+    state = session.get(SyncState, key)
+    return state.value if state else None
+
+
+def set_state(session, key, value):
+    session.merge(SyncState(key=key, value=value))
+
+
+def format_watermark(key):
+    updated_at, appointment_id = key
+    return f"{updated_at.isoformat()} {appointment_id}"
+
+
+def parse_watermark(value):
+    """
+    Returns the (updated_at, appointment id) of the last pushed appointment.
+
+    A bare timestamp, as stored by earlier versions, resumes from the first
+    appointment at that time; those already pushed are skipped by synced_at.
+    """
+    updated_at, _, appointment_id = value.partition(' ')
+    return datetime.fromisoformat(updated_at), int(appointment_id or 0)
+
+
+def appointments_with_events(session):
+    """
+    Appointments with their event mapping (or None), patient and practitioner.
+    """
+    return session.query(Appointment, CalendarEvent) \
+        .outerjoin(CalendarEvent, CalendarEvent.appointment_id == Appointment.id) \
+        .options(joinedload(Appointment.patient), joinedload(Appointment.user))
+
+
+def build_op(appt, mapping):
+    """
+    Returns the operation that brings an appointment's event up to date, or
+    None when there is nothing to push.
+    """
+    if mapping is not None and mapping.synced_at >= appt.updated_at:
+        # The change came from the calendar in pull_changes
+        return None
+    op = {'key': appt.id, 'event_id': mapping and mapping.event_id, 'body': None}
+    if appt.status == 'Scheduled':
+        op['action'] = 'insert' if mapping is None else 'update'
+        op['body'] = gcalender.appointment_event(appt, appt.user.email)
+    elif appt.status in REMOVED_STATUSES and mapping is not None:
+        op['action'] = 'delete'
+    else:
+        return None
+    return op
+
+
+def record_failure(session, op, error, now):
+    """
+    Counts a failed push against its appointment and schedules the retry.
+
+    Client errors other than 408 and 429 would fail the same way again, so
+    they are given up on at once, as is an appointment that used up
+    CALENDAR_MAX_ATTEMPTS; it is tried again when it changes next. An update
+    whose event was deleted in the calendar (404/410) drops the mapping, so
+    the retry inserts a new event.
+    """
+    status = error_status(error)
+    failure = session.get(CalendarSyncFailure, op['key'])
+    if failure is None:
+        failure = CalendarSyncFailure(appointment_id=op['key'], attempts=0)
+        session.add(failure)
+    elif failure.next_attempt_at is None:
+        # Given up on before, so this is a new change with its own attempts
+        failure.attempts = 0
+    failure.attempts += 1
+    failure.last_error = f"{op['action']}: {error}"
+    failure.failed_at = now
+
+    gone = op['action'] == 'update' and status in (404, 410)
+    if gone:
+        session.query(CalendarEvent).filter_by(appointment_id=op['key']).delete(synchronize_session=False)
+    permanent = status is not None and 400 <= status < 500 and status not in (408, 429) and not gone
+    if permanent or failure.attempts >= CALENDAR_MAX_ATTEMPTS:
+        failure.next_attempt_at = None
+        logger.error(f"Calendar {op['action']} for appointment {op['key']} given up after "
+                     f"{failure.attempts} attempts: {error}")
+    else:
+        failure.next_attempt_at = now + timedelta(minutes=CALENDAR_RETRY_MINUTES * 2 ** (failure.attempts - 1))
+        logger.warning(f"Calendar {op['action']} failed for appointment {op['key']} "
+                       f"(attempt {failure.attempts}): {error}")
+
+
+def push_changes(api, now=None):
+    """
+    Pushes appointments changed since the last push to the calendar.
+
+    Appointments are read in (updated_at, id) order and the watermark is
+    the key of the last one handled, so a run that stops in the middle of
+    many appointments sharing one updated_at resumes after the right one.
+    The watermark moves past failed appointments too: each failure is kept
+    in calendar_sync_failures and only those rows are retried, with backoff,
+    so one bad appointment cannot hold back the rest.
+
+    Returns:
+        dict: Number of events 'inserted', 'updated', 'deleted' and 'failed'.
+    """
+    now = now or datetime.now()
+    counts = {'inserted': 0, 'updated': 0, 'deleted': 0, 'failed': 0}
+
+    with session_scope() as session:
+        watermark = get_state(session, PUSH_WATERMARK_KEY)
+        query = appointments_with_events(session)
+        if watermark:
+            updated_at, appointment_id = parse_watermark(watermark)
+            query = query.filter(or_(
+                Appointment.updated_at > updated_at,
+                and_(Appointment.updated_at == updated_at, Appointment.id > appointment_id)
+            ))
+        else:
+            query = query.filter(Appointment.updated_at.isnot(None))
+        changed = query.order_by(Appointment.updated_at, Appointment.id).limit(CALENDAR_SYNC_LIMIT).all()
+        retries = appointments_with_events(session) \
+            .join(CalendarSyncFailure, CalendarSyncFailure.appointment_id == Appointment.id) \
+            .filter(CalendarSyncFailure.next_attempt_at <= now) \
+            .order_by(CalendarSyncFailure.next_attempt_at) \
+            .limit(CALENDAR_SYNC_LIMIT).all()
+
+        ops = {}
+        settled = []  # retried appointments with nothing left to push
+        for appt, mapping in changed + retries:
+            op = build_op(appt, mapping)
+            if op is not None:
+                ops[appt.id] = op
+            elif appt.id not in ops:
+                settled.append(appt.id)
+        ops = list(ops.values())
+        if changed:
+            last = changed[-1][0]
+            new_watermark = (last.updated_at, last.id)
+    if not changed and not retries:
+        return counts
+
+    results = api.apply(ops) if ops else {}
+
+    with session_scope() as session:
+        for op in ops:
+            event, error = results[op['key']]
+            if error is not None:
+                record_failure(session, op, error, now)
+                counts['failed'] += 1
+                continue
+            settled.append(op['key'])
+            if op['action'] == 'insert':
+                session.add(CalendarEvent(
+                    appointment_id=op['key'],
+                    calendar_id=getattr(api, 'calendar_id', gcalender.CALENDAR_ID),
+                    event_id=event['id'],
+                    synced_at=now
+                ))
+                counts['inserted'] += 1
+            elif op['action'] == 'update':
+                session.query(CalendarEvent).filter_by(appointment_id=op['key']) \
+                    .update({CalendarEvent.synced_at: now}, synchronize_session=False)
+                counts['updated'] += 1
+            else:
+                session.query(CalendarEvent).filter_by(appointment_id=op['key']) \
+                    .delete(synchronize_session=False)
+                counts['deleted'] += 1
+        for appointment_id in settled:
+            session.query(CalendarSyncFailure).filter_by(appointment_id=appointment_id) \
+                .delete(synchronize_session=False)
+        if changed:
+            set_state(session, PUSH_WATERMARK_KEY, format_watermark(new_watermark))
+    return counts
+
+
+def event_start(event):
+    """
+    Returns the event start as a naive datetime in the clinic's TIMEZONE.
+    """
+    value = event.get('start', {}).get('dateTime')
+    if not value:
+        return None
+    start = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if start.tzinfo is not None:
+        start = start.astimezone(ZoneInfo(os.getenv('TIMEZONE') or 'UTC')).replace(tzinfo=None)
+    return start
+
+
+def pull_changes(api, now=None):
+    """
+    Applies calendar edits made since the last pull to the mapped appointments.
+
+    Events we did not create are ignored. A cancelled event cancels its
+    appointment; a moved event moves it and reschedules its reminders.
+
+    Returns:
+        dict: Number of appointments 'moved' and 'cancelled'.
+    """
+    now = now or datetime.now()
+    counts = {'moved': 0, 'cancelled': 0}
+
+    with session_scope() as session:
+        sync_token = get_state(session, SYNC_TOKEN_KEY)
+    try:
+        events, next_token = api.list_changes(sync_token)
+    except SyncTokenExpired:
+        logger.warning("Calendar sync token expired, running a full sync.")
+        events, next_token = api.list_changes(None)
+
+    with session_scope() as session:
+        mappings = {}
+        if events:
+            mappings = {
+                mapping.event_id: mapping
+                for mapping in session.query(CalendarEvent).options(joinedload(CalendarEvent.appointment))
+                .filter(CalendarEvent.event_id.in_([event['id'] for event in events]))
+            }
+        for event in events:
+            mapping = mappings.get(event['id'])
+            if mapping is None:
+                continue
+            appt = mapping.appointment
+            if event.get('status') == 'cancelled':
+                if appt.status == 'Scheduled':
+                    appt.status = 'Cancelled'
+                    appt.updated_at = now
+                    schedule_reminders(session, [appt], now)
+                    counts['cancelled'] += 1
+                # The event is gone, a rebooked slot gets a new one
+                session.delete(mapping)
+                continue
+            start = event_start(event)
+            if start is not None and start != appt.appointment_datetime and appt.status == 'Scheduled':
+                appt.appointment_datetime = start
+                appt.updated_at = now
+                mapping.synced_at = now
+                schedule_reminders(session, [appt], now)
+                counts['moved'] += 1
+        if next_token:
+            set_state(session, SYNC_TOKEN_KEY, next_token)
+    return counts
+
+
+def sync(api=None):
+    """
+    Pushes local changes, then pulls remote ones.
+    """
+    api = api or GoogleCalendarAPI()
+    pushed = push_changes(api)
+    pulled = pull_changes(api)
+    logger.info(f"Calendar sync: pushed {pushed}, pulled {pulled}")
+    return pushed, pulled
+
+
+if __name__ == "__main__":
+    sync()
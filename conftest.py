@@ -0,0 +1,46 @@
+# conftest.py
+"""
+Shared pytest setup.
+
+pytest loads this before any test module, so the database settings below
+are in place before anything imports database.py and creates the engine.
+Tests always run against a throwaway SQLite file, never DB_URL from the
+environment or .env.
+"""
+
+import os
+import tempfile
+import pytest
+
+os.environ['DB_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+os.environ['ARCHIVE_DB_PATH'] = ''
+os.environ['DB_QUERY_STATS'] = 'false'
+
+
+@pytest.fixture(scope='session')
+def engine():
+    """
+    The application engine, with every table created.
+    """
+    from database import engine
+    from models import Base
+    Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def empty_db(engine):
+    """
+    Empties every table before and after the test.
+    """
+    from database import session_scope
+    from models import Base
+
+    def clear():
+        with session_scope() as session:
+            for table in reversed(Base.metadata.sorted_tables):
+                session.execute(table.delete())
+
+    clear()
+    yield engine
+    clear()
@@ -1,15 +1,123 @@
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 import os
+import random
+import logging
+import query_stats
 
 from dotenv import load_dotenv
-load_dotenv
+load_dotenv()
 
 DB_URL = os.getenv('DB_URL','sqlite:///data/medical_scheduler.db')
 
-engine = create_engine(DB_URL,echo=True)
+# Connection pool shared by the Streamlit app, the scheduler threads and the reminder workers
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))
 
-SessLocal = sessionmaker(bind=engine)
+# SQLite tuning. DB_PROFILE=performance applies the PRAGMAs below on every new
+# connection, DB_PROFILE=default leaves SQLite's own defaults (rollback journal).
+DB_PROFILE = os.getenv('DB_PROFILE', 'performance')
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('DB_JOURNAL_MODE', 'WAL'),  # readers no longer block on the scheduler's writes
+    'busy_timeout': int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000)),  # wait for a lock instead of failing
+    'synchronous': os.getenv('DB_SYNCHRONOUS', 'NORMAL'),  # safe with WAL, fsync only at checkpoints
+    'mmap_size': int(os.getenv('DB_MMAP_SIZE', 256 * 1024 * 1024)),
+    'cache_size': int(os.getenv('DB_CACHE_SIZE', -64000)),  # negative means KiB, i.e. 64 MB
+    'foreign_keys': 'ON',
+}
 
-session = SessLocal()
 
+def default_archive_path(url):
+    """
+    Returns the archive file next to a SQLite database file, e.g.
+    data/medical_scheduler_archive.db, or '' for in-memory and other databases.
+    """
+    database = make_url(url).database if url.startswith('sqlite') else None
+    if not database or database == ':memory:':
+        return ''
+    root, ext = os.path.splitext(database)
+    return f"{root}_archive{ext or '.db'}"
+
+
+# Fraction of SQL statements written to the 'database.sql' logger, 0 disables it
+DB_SQL_LOG_SAMPLE = float(os.getenv('DB_SQL_LOG_SAMPLE', 0))
+
+# Old rows moved out by archive.py live in this second SQLite file, e.g.
+# data/medical_scheduler_archive.db, attached to every connection as
+# 'archive' so reports can read hot and cold rows together. Empty (the
+# default) attaches nothing and disables archiving.
+ARCHIVE_DB_PATH = os.getenv('ARCHIVE_DB_PATH', '')
+
+# SQLite connections are handed between threads by the pool, never shared concurrently
+connect_args = {'check_same_thread': False} if DB_URL.startswith('sqlite') else {}
+
+engine = create_engine(
+    DB_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_pre_ping=True,
+    connect_args=connect_args,
+)
+
+if DB_URL.startswith('sqlite') and DB_PROFILE == 'performance':
+    @event.listens_for(engine, "connect")
+    def apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+if ARCHIVE_DB_PATH:
+    @event.listens_for(engine, "connect")
+    def attach_archive(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_PATH,))
+        if DB_PROFILE == 'performance':
+            cursor.execute(f"PRAGMA archive.journal_mode={SQLITE_PRAGMAS['journal_mode']}")
+            cursor.execute(f"PRAGMA archive.synchronous={SQLITE_PRAGMAS['synchronous']}")
+        cursor.close()
+
+if DB_SQL_LOG_SAMPLE > 0:
+    sql_logger = logging.getLogger('database.sql')
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def log_sampled_sql(conn, cursor, statement, parameters, context, executemany):
+        if random.random() < DB_SQL_LOG_SAMPLE:
+            sql_logger.info("%s %r", statement, parameters)
+
+# Statement fingerprints, slow-query log and query budget; see query_stats.py
+if query_stats.DB_QUERY_STATS:
+    query_stats.install(engine)
+
+# Objects stay usable after their unit of work commits, e.g. to show a new ID in the UI
+SessLocal = sessionmaker(bind=engine, expire_on_commit=False)
+
+
+@contextmanager
+def session_scope():
+    """
+    Provides a short-lived session for one unit of work.
+
+    Commits when the block finishes, rolls back if it raises and always
+    returns the connection to the pool. Every job, request handler and
+    dashboard action opens its own scope instead of sharing a global session:
+
+        with session_scope() as session:
+            session.add(patient)
+    """
+    session = SessLocal()
+    unit = query_stats.begin_unit() if query_stats.DB_QUERY_STATS else None
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+        if unit is not None:
+            query_stats.end_unit(unit)
@@ -1,8 +1,21 @@
 import os
+import io
+import csv
+import gzip
 import datetime
-from database import session
+import tempfile
+from database import session_scope
 from models import *
-import pandas as pd
+from outbox import enqueue_many
+import adherence_rollup
+import archive
+from partitions import in_partition
+
+REPORT_COLUMNS = ['Patient Name', 'Follow-Up Type', 'Due Date', 'Completed', 'Completed At']
+# Rows fetched from the database per round trip while streaming the report
+REPORT_BATCH_SIZE = int(os.getenv('REPORT_BATCH_SIZE', 1000))
+# Reports larger than this spill from memory to a temporary file
+REPORT_SPOOL_BYTES = int(os.getenv('REPORT_SPOOL_BYTES', 5 * 1024 * 1024))
 
 
 
@@ -16,62 +29,117 @@ def schedule_followup(appointment_id, followup_type, days_after=1):
         followup_type (str): Type of follow-up (e.g., 'Prescription Refill').
         days_after (int): Number of days after the appointment to schedule the follow-up.
     """
-    # Fetch the appointment from the database
-    appointment = session.query(Appointment).filter_by(id=appointment_id).first()
-    if not appointment:
-        print("Appointment not found.")
-        return
-    
-    # Calculate the due date for the follow-up
-    due_date = appointment.appointment_datetime + datetime.timedelta(days=days_after)
-    
-    # Create a new FollowUp entry
-    followup = FollowUp(
-        appointment_id=appointment.id,
-        followup_type=followup_type,
-        due_date=due_date,
-        status='Pending'
-    )
-    # Create a corresponding FollowUpAdherence entry
-    adherence = FollowUpAdherence(
-        followup_id=followup.id,
-        completed=False,
-        completed_at=None
-    )
-    # Establish relationship
-    followup.adherence = adherence
-    
-    # Add to session and commit to save in the database
-    session.add(followup)
-    session.commit()
+    with session_scope() as session:
+        # Fetch the appointment from the database
+        appointment = session.query(Appointment).filter_by(id=appointment_id).first()
+        if not appointment:
+            print("Appointment not found.")
+            return False
+        
+        # Calculate the due date for the follow-up
+        due_date = appointment.appointment_datetime + datetime.timedelta(days=days_after)
+        
+        # Create a new FollowUp entry
+        followup = FollowUp(
+            appointment_id=appointment.id,
+            followup_type=followup_type,
+            due_date=due_date,
+            status='Pending'
+        )
+        # Create a corresponding FollowUpAdherence entry
+        adherence = FollowUpAdherence(
+            followup_id=followup.id,
+            completed=False,
+            completed_at=None
+        )
+        # Establish relationship
+        followup.adherence = adherence
+        
+        # Add to session, committed together with the rollup when the scope closes
+        session.add(followup)
+        adherence_rollup.record_scheduled(session, followup, appointment.user_id)
     print(f"Follow-up '{followup_type}' scheduled for Appointment ID {appointment_id} on {due_date}")
+    return True
 
 
 
-def generate_adherence_report():
-    # Join FollowUp, FollowUpAdherence, Appointment, and Patient tables
+def adherence_report_query(session, include_archive=True):
+    # Join FollowUp, FollowUpAdherence, Appointment, and Patient tables,
+    # including the rows archive.py moved out of the hot tables
+    source = archive.combined if include_archive else (lambda model: model.__table__)
+    appointments, followups, adherence = source(Appointment), source(FollowUp), source(FollowUpAdherence)
 
-    report_data = session.query(
+    return session.query(
 
         Patient.name.label('Patient Name'),
 
-        FollowUp.followup_type.label('Follow-Up Type'),
+        followups.c.followup_type.label('Follow-Up Type'),
 
-        FollowUp.due_date.label('Due Date'),
+        followups.c.due_date.label('Due Date'),
 
-        FollowUpAdherence.completed.label('Completed'),
+        adherence.c.completed.label('Completed'),
 
-        FollowUpAdherence.completed_at.label('Completed At')
+        adherence.c.completed_at.label('Completed At')
 
-    ).join(FollowUp, FollowUp.appointment_id == Appointment.id) \
-     .join(FollowUpAdherence, FollowUpAdherence.followup_id == FollowUp.id) \
-     .join(Patient, Patient.id == FollowUp.appointment.patient_id) \
-     .all()
-    
-    # Convert to DataFrame
-    df = pd.DataFrame(report_data, columns=['Patient Name', 'Follow-Up Type', 'Due Date', 'Completed', 'Completed At'])
-    
-    return df
+    ).select_from(appointments) \
+     .join(followups, followups.c.appointment_id == appointments.c.id) \
+     .join(adherence, adherence.c.followup_id == followups.c.id) \
+     .join(Patient, Patient.id == appointments.c.patient_id) \
+     .order_by(followups.c.id)
+
+
+def write_adherence_report(fileobj, compress=False, batch_size=REPORT_BATCH_SIZE):
+    """
+    Streams the adherence report as CSV into a binary file object.
+
+    Rows are fetched in batches of `batch_size` with yield_per and written
+    as they arrive, so memory use does not grow with the follow-up history.
+
+    Parameters:
+        fileobj (file): Writable binary file object, left open.
+        compress (bool): Gzip the CSV.
+        batch_size (int): Rows per database round trip.
+
+    Returns:
+        int: Number of data rows written.
+    """
+    raw = gzip.GzipFile(fileobj=fileobj, mode='wb') if compress else fileobj
+    text = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+    writer = csv.writer(text, lineterminator='\n')
+    writer.writerow(REPORT_COLUMNS)
+
+    rows = 0
+    with session_scope() as session:
+        for row in adherence_report_query(session).yield_per(batch_size):
+            writer.writerow(row)
+            rows += 1
+
+    text.flush()
+    text.detach()
+    if compress:
+        # Writes the gzip trailer; the underlying fileobj stays open
+        raw.close()
+    return rows
+
+
+def generate_adherence_report(compress=False):
+    """
+    Builds the adherence report in a spooled buffer.
+
+    The buffer stays in memory up to REPORT_SPOOL_BYTES and spills to a
+    temporary file beyond that; nothing is written to the working directory.
+
+    Returns:
+        tuple: (buffer rewound to the start, number of data rows). The caller closes the buffer.
+    """
+    buffer = tempfile.SpooledTemporaryFile(max_size=REPORT_SPOOL_BYTES)
+    rows = write_adherence_report(buffer, compress=compress)
+    buffer.seek(0)
+    return buffer, rows
+
+
+def adherence_report_filename(compress=False):
+    return f"adherence_report_{datetime.datetime.now().strftime('%Y%m%d')}.csv" + (".gz" if compress else "")
 
 
     
@@ -83,14 +151,89 @@ def update_adherence(followup_id, completed=True):
         followup_id (int): ID of the follow-up task.
         completed (bool): Whether the follow-up was completed.
     """
-    followup_adherence = session.query(FollowUpAdherence).filter_by(followup_id=followup_id).first()
-    if not followup_adherence:
-        print("Follow-up adherence record not found.")
+    with session_scope() as session:
+        followup_adherence = session.query(FollowUpAdherence).filter_by(followup_id=followup_id).first()
+        if not followup_adherence:
+            print("Follow-up adherence record not found.")
 
-        return
+            return False
+        
+        set_adherence(session, followup_adherence, completed)
+    print(f"Follow-up adherence updated for FollowUp ID {followup_id}")
+    return True
+
+
+def complete_followup(followup_id):
+    """
+    Marks a pending follow-up and its adherence record as completed.
     
-    followup_adherence.completed = completed
+    Returns:
+        bool: False if the follow-up does not exist or is not pending.
+    """
+    with session_scope() as session:
+        followup = session.query(FollowUp).filter_by(id=followup_id).first()
+        if not followup or followup.status != 'Pending':
+            return False
+        
+        followup.status = 'Completed'
+        if followup.adherence:
+            set_adherence(session, followup.adherence, True)
+    return True
+
+
+def set_adherence(session, followup_adherence, completed):
+    """
+    Changes an adherence record and keeps the adherence rollup in step, in the caller's transaction.
+    """
+    if bool(followup_adherence.completed) == completed:
+        return
+    followup = followup_adherence.followup
     if completed:
-        followup_adherence.completed_at = datetime.now()
-    session.commit()
-    print(f"Follow-up adherence updated for FollowUp ID {followup_id}")
\ No newline at end of file
+        followup_adherence.completed = True
+        followup_adherence.completed_at = datetime.datetime.now()
+        adherence_rollup.record_completion(session, followup, followup_adherence.completed_at)
+    else:
+        adherence_rollup.record_completion(session, followup, followup_adherence.completed_at, sign=-1)
+        followup_adherence.completed = False
+        followup_adherence.completed_at = None
+
+
+def send_followup_reminders(partition=None):
+    """
+    Queues a reminder email for every patient whose pending follow-up task is due today.
+
+    Parameters:
+        partition (tuple): (index, count) to handle only that share of the
+                           appointments, see partitions.in_partition().
+    """
+    today = datetime.date.today()
+    start = datetime.datetime.combine(today, datetime.time.min)
+    end = start + datetime.timedelta(days=1)
+
+    with session_scope() as session:
+        due = session.query(
+            FollowUp.id,
+            FollowUp.followup_type,
+            FollowUp.due_date,
+            Patient.name,
+            Patient.email
+        ).join(Appointment, Appointment.id == FollowUp.appointment_id) \
+         .join(Patient, Patient.id == Appointment.patient_id) \
+         .filter(
+            FollowUp.status == 'Pending',
+            FollowUp.due_date >= start,
+            FollowUp.due_date < end,
+            in_partition(FollowUp.appointment_id, partition)
+        ).all()
+
+        messages = [
+            (
+                row.email,
+                f"Follow-Up Reminder: {row.followup_type}",
+                f"Dear {row.name},\n\nThis is a reminder that your {row.followup_type} follow-up is due on {row.due_date.strftime('%Y-%m-%d')}.\n\nThank you."
+            )
+            for row in due
+        ]
+        enqueue_many(session, messages)
+    print(f"Follow-up reminders queued: {len(messages)}")
+    return len(messages)
\ No newline at end of file
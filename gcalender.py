@@ -1,17 +1,29 @@
 import os
 import pickle
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+import threading
 import datetime
-from models import User
-from database import session
+from models import User, Appointment
+from database import session_scope
+from queries import appointments_with_people
+from slots import APPOINTMENT_MINUTES
 
 # Define the scope for Google Calendar API
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 
+CALENDAR_ID = os.getenv('CALENDAR_ID', 'primary')
+# The Calendar batch endpoint accepts at most 50 requests per call
+CALENDAR_BATCH_SIZE = min(int(os.getenv('CALENDAR_BATCH_SIZE', 50)), 50)
+
+# One client per process: building it unpickles the token, may refresh it
+# and loads the discovery document, so it is only done once
+_service = None
+_service_lock = threading.Lock()
+
+
+def load_credentials():
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from google.auth.transport.requests import Request
 
-def get_calendar_service():
     creds = None
 
     # Check if token.pickle file exists
@@ -27,15 +39,51 @@ def get_calendar_service():
             flow = InstalledAppFlow.from_client_secrets_file(
                 'credentials.json', SCOPES)
             creds = flow.run_local_server(port=0)
-        
+
         # Save the credentials to token.pickle
         with open('token.pickle', 'wb') as token:
             pickle.dump(creds, token)
             print("token.pickle created successfully!")
 
-    service_new = build('calendar', 'v3', credentials=creds)
+    return creds
+
 
-    return service_new
+def build_calendar_service(http=None):
+    """
+    Builds a Calendar API client.
+
+    Parameters:
+        http: Optional transport, e.g. googleapiclient.http.HttpMock in tests.
+              Without it the client uses the OAuth credentials from token.pickle.
+    """
+    # Imported here so modules that only need the event helpers or a fake
+    # client do not require the Google libraries
+    from googleapiclient.discovery import build
+
+    if http is not None:
+        return build('calendar', 'v3', http=http)
+    # The client refreshes the access token by itself when it expires
+    return build('calendar', 'v3', credentials=load_credentials())
+
+
+def get_calendar_service():
+    """
+    Returns the process-wide Calendar client, built on first use.
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = build_calendar_service()
+        return _service
+
+
+def set_calendar_service(service):
+    """
+    Replaces the process-wide Calendar client, e.g. with one built on a stub transport.
+    """
+    global _service
+    with _service_lock:
+        _service = service
 
 # Test the function
 
@@ -43,30 +91,27 @@ def get_calendar_service():
 
 #######################################
 
-def add_app_to_cal(appointment):
-    service = get_calendar_service()
-    
-    user = session.query(User).filter_by(id=appointment.user_id).first()
-    if not user:
-        print("Doctor not found for appointment")
-        return False
-    
-    event = {
-        'Summary':f"Appointment with {appointment.patient.name}",
-        "Description": f"Patient ID: {appointment.patient.id}",
+def appointment_event(appointment, practitioner_email):
+    """
+    Builds the Calendar event body for an appointment with its patient loaded.
+    """
+    time_zone = os.getenv('TIMEZONE','UTC')
+    return {
+        'summary':f"Appointment with {appointment.patient.name}",
+        "description": f"Patient ID: {appointment.patient.id}",
         "start":{
             'dateTime':appointment.appointment_datetime.isoformat(),
-            'timeZone': os.getenv('TIMEZONE','UTC')
+            'timeZone': time_zone
         },
         'end':{
-            'dateTime':(appointment.appointment_datetime + datetime.timedelta(minutes=60)).isoformat(),
-            'timeZone': os.getenv('TIMEZONE','UTC')
+            'dateTime':(appointment.appointment_datetime + datetime.timedelta(minutes=APPOINTMENT_MINUTES)).isoformat(),
+            'timeZone': time_zone
         },
-        'attendess':[
-            {'Doctor email':user.email},
-            {'Patient Email': appointment.patient.email},
+        'attendees':[
+            {'email':practitioner_email},
+            {'email': appointment.patient.email},
         ],
-        'remainders':{
+        'reminders':{
             'useDefault':False,
             'overrides':[
                 {'method':'email','minutes':24 * 60},
@@ -76,12 +121,84 @@ def add_app_to_cal(appointment):
         },
     }
 
-    try:
-        event = service.events().insert(calendarId='primary',body=event).execute()
-        print(f"Event Created:{event.get('htmlLink')}")
+
+def sync_appointments(appointments, service=None, calendar_id=CALENDAR_ID):
+    """
+    Creates Calendar events for many appointments using batch requests.
+
+    Up to CALENDAR_BATCH_SIZE inserts travel in one HTTP call, so a whole
+    clinic day takes a handful of round trips.
+
+    Parameters:
+        appointments (list): Appointment objects with their patient loaded.
+        service: Calendar client, defaults to get_calendar_service().
+        calendar_id (str): Calendar to insert into.
+
+    Returns:
+        dict: {appointment_id: event id}, None for appointments that failed.
+    """
+    if not appointments:
+        return {}
+    service = service or get_calendar_service()
+
+    # Practitioner emails for the whole batch in one query
+    user_ids = {appt.user_id for appt in appointments}
+    with session_scope() as session:
+        emails = dict(session.query(User.id, User.email).filter(User.id.in_(user_ids)).all())
+
+    results = {}
+
+    def on_response(request_id, response, exception):
+        if exception is not None:
+            print(f"Erroor Creating Calendar Event for appointment {request_id}: {exception}")
+            results[int(request_id)] = None
+        else:
+            results[int(request_id)] = response.get('id')
+
+    for start in range(0, len(appointments), CALENDAR_BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=on_response)
+        for appt in appointments[start:start + CALENDAR_BATCH_SIZE]:
+            if appt.user_id not in emails:
+                print(f"Doctor not found for appointment {appt.id}")
+                results[appt.id] = None
+                continue
+            body = appointment_event(appt, emails[appt.user_id])
+            batch.add(service.events().insert(calendarId=calendar_id, body=body), request_id=str(appt.id))
+        try:
+            batch.execute()
+        except Exception as e:
+            print(f"Erroor Creating Calendar Events: {e}")
+            for appt in appointments[start:start + CALENDAR_BATCH_SIZE]:
+                results.setdefault(appt.id, None)
+    return results
+
+
+def sync_day(day, service=None):
+    """
+    Pushes every scheduled appointment on `day` to the calendar.
+    """
+    start = datetime.datetime.combine(day, datetime.time.min)
+    with session_scope() as session:
+        appointments = appointments_with_people(session).filter(
+            Appointment.status == 'Scheduled',
+            Appointment.appointment_datetime >= start,
+            Appointment.appointment_datetime < start + datetime.timedelta(days=1)
+        ).order_by(Appointment.appointment_datetime).all()
+    results = sync_appointments(appointments, service=service)
+    created = sum(1 for event_id in results.values() if event_id)
+    print(f"Calendar events created: {created} of {len(appointments)}")
+    return results
+
+
+def add_app_to_cal(appointment):
+    event_id = sync_appointments([appointment]).get(appointment.id)
+    if event_id:
+        print(f"Event Created:{event_id}")
         return True
-    except Exception as q:
-        print(f"Erroor Creating Calendar Event: {q}")
-        
+    return False
 
 
+if __name__ == "__main__":
+    import sys
+    day = datetime.date.fromisoformat(sys.argv[1]) if len(sys.argv) > 1 else datetime.date.today()
+    sync_day(day)
@@ -1,25 +1,210 @@
 import os
-from pyhunter import PyHunter
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-import requests
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from database import session_scope
+from models import EmailVerification
 
 load_dotenv()
 
 HUNT_IO_KEY = os.getenv('HUNTERIO_API_KEY')
+HUNTER_URL = 'https://api.hunter.io/v2/email-verifier'
+
+# An address is valid when Hunter's confidence score is above this
+HUNTER_MIN_SCORE = int(os.getenv('HUNTER_MIN_SCORE', 60))
+HUNTER_TIMEOUT = float(os.getenv('HUNTER_TIMEOUT', 10))
+# Concurrent API calls made by verify_many
+HUNTER_WORKERS = int(os.getenv('HUNTER_WORKERS', 4))
+# How long results are trusted; invalid addresses are re-checked sooner
+HUNTER_CACHE_DAYS = float(os.getenv('HUNTER_CACHE_DAYS', 30))
+HUNTER_NEGATIVE_CACHE_DAYS = float(os.getenv('HUNTER_NEGATIVE_CACHE_DAYS', 1))
+# 'api' calls Hunter.io, 'fake' accepts every address without network access
+HUNTER_BACKEND = os.getenv('HUNTER_BACKEND', 'api')
+# Addresses per cache lookup and upsert statement; 200 rows x 4 columns stays
+# under the 999 bound variables older SQLite builds allow
+HUNTER_DB_CHUNK = 200
+
+
+class HunterBackend:
+    """
+    Calls the Hunter.io email verifier over one shared keep-alive session.
+    """
+
+    def __init__(self, api_key=HUNT_IO_KEY, timeout=HUNTER_TIMEOUT, pool_size=HUNTER_WORKERS):
+        self.api_key = api_key
+        self.timeout = timeout
+        # Imported here so importing this module stays cheap for code that only reads the cache
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.http.mount('https://', adapter)
+
+    def score(self, email):
+        """
+        Returns Hunter's confidence score for the address.
+
+        Addresses the API rejects as malformed score 0. Any other failure
+        (network, quota, auth) raises, so it is not cached as a result.
+        """
+        response = self.http.get(
+            HUNTER_URL,
+            params={'email': email, 'api_key': self.api_key},
+            timeout=self.timeout
+        )
+        if response.status_code in (400, 422):
+            return 0
+        response.raise_for_status()
+        return response.json()['data']['score'] or 0
+
+
+class FakeBackend:
+    """
+    Local stand-in for HunterBackend used in tests and offline runs.
+
+    Parameters:
+        scores (dict): Score per address, anything else gets `default_score`.
+        default_score (int): Score for addresses not in `scores`.
+    """
+
+    def __init__(self, scores=None, default_score=100):
+        self.scores = scores or {}
+        self.default_score = default_score
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def score(self, email):
+        with self._lock:
+            self.calls.append(email)
+        return self.scores.get(email, self.default_score)
+
+
+BACKENDS = {
+    'api': HunterBackend,
+    'fake': FakeBackend,
+}
+
+
+class VerificationService:
+    """
+    Email verification with a persistent cache in the email_verifications table.
+
+    Valid results are reused for HUNTER_CACHE_DAYS and invalid ones for
+    HUNTER_NEGATIVE_CACHE_DAYS. Only addresses missing from the cache reach
+    the backend, each at most once per batch.
+    """
+
+    def __init__(self, backend=None, workers=HUNTER_WORKERS,
+                 cache_days=HUNTER_CACHE_DAYS, negative_cache_days=HUNTER_NEGATIVE_CACHE_DAYS):
+        self.backend = backend or BACKENDS[HUNTER_BACKEND]()
+        self.workers = workers
+        self.cache_ttl = timedelta(days=cache_days)
+        self.negative_cache_ttl = timedelta(days=negative_cache_days)
+
+    def cached(self, session, emails, now):
+        """
+        Returns {email: valid} for the addresses with a fresh cached result.
+        """
+        rows = []
+        for start in range(0, len(emails), HUNTER_DB_CHUNK):
+            rows += session.query(
+                EmailVerification.email,
+                EmailVerification.valid,
+                EmailVerification.checked_at
+            ).filter(EmailVerification.email.in_(emails[start:start + HUNTER_DB_CHUNK])).all()
+        results = {}
+        for row in rows:
+            ttl = self.cache_ttl if row.valid else self.negative_cache_ttl
+            if row.checked_at + ttl > now:
+                results[row.email] = row.valid
+        return results
+
+    def lookup(self, email):
+        try:
+            return self.backend.score(email)
+        except Exception as e:
+            print(f"Error verifying email: {e}")
+            return None
+
+    def verify_many(self, emails):
+        """
+        Verifies a batch of addresses.
+
+        Parameters:
+            emails (iterable): Addresses to check, duplicates are checked once.
+
+        Returns:
+            dict: {email: bool} keyed by the lower-cased address. Addresses
+            whose check failed are False and are not cached.
+        """
+        now = datetime.now()
+        emails = sorted({email.strip().lower() for email in emails if email})
+        if not emails:
+            return {}
+
+        with session_scope() as session:
+            results = self.cached(session, emails, now)
+        missing = [email for email in emails if email not in results]
+        if not missing:
+            return results
+
+        workers = max(1, min(self.workers, len(missing)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            scores = list(executor.map(self.lookup, missing))
+
+        checked = []
+        for email, score in zip(missing, scores):
+            valid = score is not None and score > HUNTER_MIN_SCORE
+            results[email] = valid
+            if score is not None:
+                checked.append({'email': email, 'valid': valid, 'score': score, 'checked_at': now})
+
+        if checked:
+            with session_scope() as session:
+                for start in range(0, len(checked), HUNTER_DB_CHUNK):
+                    stmt = sqlite_insert(EmailVerification).values(checked[start:start + HUNTER_DB_CHUNK])
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=['email'],
+                        set_={name: stmt.excluded[name] for name in ('valid', 'score', 'checked_at')}
+                    )
+                    session.execute(stmt)
+        return results
+
+    def verify(self, email):
+        return self.verify_many([email]).get(email.strip().lower(), False) if email else False
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service():
+    """
+    Returns the process-wide VerificationService, created on first use.
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = VerificationService()
+        return _service
+
+
+def set_backend(backend):
+    """
+    Replaces the backend of the process-wide service, e.g. with a FakeBackend in tests.
+    """
+    global _service
+    with _service_lock:
+        _service = VerificationService(backend=backend)
+    return _service
+
 
 def verify(email):
     # Just to Check If the email is valid  Returns A TRue or False Boolean Value
+    return get_service().verify(email)
 
-    try:
-        url = f"https://api.hunter.io/v2/email-verifier?email={email}&api_key={HUNT_IO_KEY}"
-
-        response = requests.get(url)
-        
-        if response.status_code==200 and response.json()['data']['score'] > 60:
-            print("dctfvygbuhinjmk")
-            return True
-        return False
-    except Exception as e:
-        print(f"Error verifying email: {e}")
-        return False
 
+def verify_many(emails):
+    return get_service().verify_many(emails)
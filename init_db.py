@@ -1,8 +1,11 @@
 from database import engine
 from models import Base
+from migrate import upgrade
 
 def init():
     Base.metadata.create_all(bind=engine)
+    # Add indexes (and later schema changes) to tables that already existed
+    upgrade(engine)
     print("DB INIT TB CRT")
 
 
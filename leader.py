@@ -0,0 +1,185 @@
+# leader.py
+"""
+Leader election over a lease row in the database.
+
+Every process that wants to run the scheduler starts a LeaderElection. A
+background thread tries to take or renew the lease every lease_seconds / 3;
+taking it is one conditional UPDATE (or the first INSERT), so at most one
+holder exists at a time. The holder runs on_elected() when it gets the
+lease and on_demoted() as soon as a renewal fails. When the leader dies its
+lease expires and a standby takes over within about 4/3 * lease_seconds.
+
+Lease times are naive UTC, so a DST change on a host neither stretches
+nor cuts short a lease. They are still read from each host's clock, so
+hosts sharing a database need their clocks in sync (NTP) to well under the
+lease length.
+
+Leadership is not fenced. on_demoted() stops new jobs from starting, but
+a job already running when the lease is lost runs to the end, possibly
+next to the new leader's first run of the same job. Jobs that claim their
+rows (outbox, reminders) are safe; any other job has to tolerate one
+overlapping run or re-check the lease before committing.
+"""
+
+import os
+import uuid
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import update, or_, case
+from sqlalchemy.exc import IntegrityError
+from database import session_scope
+from models import SchedulerLease
+
+SCHEDULER_LEASE_SECONDS = int(os.getenv('SCHEDULER_LEASE_SECONDS', 30))
+
+logger = logging.getLogger('leader')
+
+
+def utcnow():
+    """
+    The current time as a naive UTC datetime, the form lease times are stored in.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def default_holder():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def acquire(session, name, holder, lease_seconds=SCHEDULER_LEASE_SECONDS, now=None):
+    """
+    Takes the lease if it is free or expired, or renews it if `holder` has it.
+
+    Returns:
+        bool: True if `holder` holds the lease until now + lease_seconds.
+    """
+    now = now or utcnow()
+    expires_at = now + timedelta(seconds=lease_seconds)
+    result = session.execute(
+        update(SchedulerLease)
+        .where(
+            SchedulerLease.name == name,
+            or_(SchedulerLease.holder == holder, SchedulerLease.expires_at < now)
+        )
+        .values(
+            acquired_at=case((SchedulerLease.holder == holder, SchedulerLease.acquired_at), else_=now),
+            holder=holder,
+            renewed_at=now,
+            expires_at=expires_at
+        )
+    )
+    if result.rowcount:
+        return True
+    try:
+        # First run: nobody has ever held this lease
+        with session.begin_nested():
+            session.add(SchedulerLease(name=name, holder=holder, acquired_at=now, renewed_at=now, expires_at=expires_at))
+        return True
+    except IntegrityError:
+        return False
+
+
+def release(session, name, holder):
+    """
+    Gives the lease up so a standby can take it without waiting for it to expire.
+    """
+    session.execute(
+        update(SchedulerLease)
+        .where(SchedulerLease.name == name, SchedulerLease.holder == holder)
+        .values(expires_at=datetime.min)
+    )
+
+
+def current_leader(session, name):
+    """
+    Returns the SchedulerLease row for `name`, or None if it was never taken.
+    """
+    return session.get(SchedulerLease, name)
+
+
+class LeaderElection:
+    """
+    Keeps trying to hold the lease `name` and reports changes in leadership.
+
+    Parameters:
+        name (str): Lease to compete for.
+        on_elected (callable): Called when this process becomes the leader.
+        on_demoted (callable): Called when it stops being the leader.
+        lease_seconds (int): How long a lease lasts without renewal.
+        holder (str): Identity of this process, host:pid:nonce by default.
+    """
+
+    def __init__(self, name, on_elected, on_demoted, lease_seconds=SCHEDULER_LEASE_SECONDS, holder=None):
+        self.name = name
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.lease_seconds = lease_seconds
+        self.holder = holder or default_holder()
+        self.is_leader = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def tick(self):
+        """
+        Takes or renews the lease once and fires the callbacks on a change.
+
+        A callback that raises is logged and never stops the election. If
+        on_elected() fails, the lease is released so a standby, or this
+        process on a later tick, can try again.
+        """
+        try:
+            with session_scope() as session:
+                held = acquire(session, self.name, self.holder, self.lease_seconds)
+        except Exception as e:
+            logger.error(f"Lease '{self.name}' renewal failed: {e}")
+            held = False
+        if held and not self.is_leader:
+            logger.info(f"{self.holder} is now the '{self.name}' leader.")
+            self.is_leader = True
+            try:
+                self.on_elected()
+            except Exception as e:
+                logger.error(f"{self.holder} could not take over as '{self.name}' leader: {e}")
+                self.is_leader = False
+                self._demote()
+                self._release()
+        elif not held and self.is_leader:
+            logger.warning(f"{self.holder} lost the '{self.name}' lease.")
+            self.is_leader = False
+            self._demote()
+
+    def _demote(self):
+        try:
+            self.on_demoted()
+        except Exception as e:
+            logger.error(f"Stepping down as '{self.name}' leader failed: {e}")
+
+    def _release(self):
+        try:
+            with session_scope() as session:
+                release(session, self.name, self.holder)
+        except Exception as e:
+            logger.error(f"Releasing lease '{self.name}' failed: {e}")
+
+    def run(self):
+        while not self._stop.is_set():
+            self.tick()
+            self._stop.wait(self.lease_seconds / 3)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name=f"lease-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops competing and releases the lease if this process holds it.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.is_leader:
+            self.is_leader = False
+            self._demote()
+            self._release()
@@ -0,0 +1,292 @@
+# metrics.py
+"""
+Per-job metrics for the scheduler jobs and the outbox worker.
+
+Jobs are wrapped with @job(name). While a wrapped job runs, a context
+variable holds its counters, so the SQLAlchemy cursor hook and count()
+calls deeper down (e.g. outbox.enqueue) are attributed to it without
+passing anything around. APScheduler's event listeners add what only the
+scheduler knows: misfires, runs skipped because the previous one was still
+going, and errors of jobs that are not wrapped.
+
+Metrics are kept in process and exported in the Prometheus text format:
+
+- to METRICS_FILE after every job event (node_exporter textfile collector style),
+- over HTTP on METRICS_PORT when it is set (GET /metrics).
+
+The Streamlit "System" tab reads the exported files back with read_textfile().
+"""
+
+import os
+import time
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from sqlalchemy import event
+from database import engine
+import query_stats
+
+METRICS_FILE = os.getenv('METRICS_FILE', 'logs/metrics.prom')
+# Port of the /metrics endpoint, unset or 0 disables it
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+
+# Counters a job can collect while it runs
+COUNTERS = ('rows', 'queries', 'emails_queued', 'emails_attempted', 'emails_failed')
+
+# name -> (type, help) of every exported series, in output order
+SERIES = {
+    'runs_total': ('counter', "Finished runs of the job."),
+    'failures_total': ('counter', "Runs that raised or reported a failure."),
+    'misfires_total': ('counter', "Runs APScheduler skipped because they were past their misfire grace time."),
+    'skipped_total': ('counter', "Runs skipped because the previous run was still going."),
+    'running': ('gauge', "1 while the job is running."),
+    'duration_seconds_sum': ('counter', "Total run time."),
+    'last_duration_seconds': ('gauge', "Run time of the last run."),
+    'last_success_timestamp_seconds': ('gauge', "Unix time the last successful run finished."),
+    'last_failure_timestamp_seconds': ('gauge', "Unix time the last failed run finished."),
+    'rows_total': ('counter', "Rows processed, as reported by the job."),
+    'last_rows': ('gauge', "Rows processed by the last run."),
+    'queries_total': ('counter', "SQL statements executed."),
+    'last_queries': ('gauge', "SQL statements executed by the last run."),
+    'emails_queued_total': ('counter', "Emails added to the outbox."),
+    'emails_attempted_total': ('counter', "Emails handed to the mail backend."),
+    'emails_failed_total': ('counter', "Emails the mail backend did not accept."),
+}
+PREFIX = 'scheduler_job_'
+
+_current = contextvars.ContextVar('metrics_job', default=None)
+_lock = threading.Lock()
+_jobs = {}  # job name -> {series name: value}
+_last_errors = {}  # job name -> text of the last error
+
+
+def _stats(name):
+    stats = _jobs.get(name)
+    if stats is None:
+        stats = _jobs[name] = dict.fromkeys(SERIES, 0)
+    return stats
+
+
+def count(counter, amount=1):
+    """
+    Adds to a counter of the job running in this context; a no-op outside jobs.
+
+    Parameters:
+        counter (str): One of COUNTERS.
+        amount (int): Value to add.
+    """
+    counters = _current.get()
+    if counters is not None:
+        with _lock:
+            counters[counter] += amount
+
+
+@contextmanager
+def collect():
+    """
+    Gathers the counters of the work inside the block into a fresh dict
+    instead of the running job, e.g. in a worker process; the caller merges
+    them back with count().
+    """
+    counters = dict.fromkeys(COUNTERS, 0)
+    counters['failed'] = None
+    token = _current.set(counters)
+    try:
+        yield counters
+    finally:
+        _current.reset(token)
+
+
+def record_failure(error):
+    """
+    Marks the current run as failed, for jobs that catch and log their own errors.
+    """
+    counters = _current.get()
+    if counters is not None:
+        counters['failed'] = str(error)
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    counters = _current.get()
+    if counters is not None:
+        counters['queries'] += 1
+
+
+def job(name):
+    """
+    Decorator recording duration, outcome and counters of every run.
+
+    An int returned by the job is recorded as the number of rows it processed.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            counters = dict.fromkeys(COUNTERS, 0)
+            counters['failed'] = None
+            token = _current.set(counters)
+            with _lock:
+                _stats(name)['running'] = 1
+            started = time.perf_counter()
+            try:
+                with query_stats.label(name):
+                    result = fn(*args, **kwargs)
+            except Exception as e:
+                counters['failed'] = f"{type(e).__name__}: {e}"
+                raise
+            else:
+                if isinstance(result, int) and not isinstance(result, bool):
+                    counters['rows'] += result
+                return result
+            finally:
+                _current.reset(token)
+                finish(name, time.perf_counter() - started, counters)
+        wrapper.metrics_name = name
+        return wrapper
+    return decorator
+
+
+def finish(name, duration, counters):
+    with _lock:
+        stats = _stats(name)
+        stats['running'] = 0
+        stats['runs_total'] += 1
+        stats['duration_seconds_sum'] += duration
+        stats['last_duration_seconds'] = duration
+        stats['last_rows'] = counters['rows']
+        stats['last_queries'] = counters['queries']
+        for counter in COUNTERS:
+            stats[f"{counter}_total"] += counters[counter]
+        if counters['failed']:
+            stats['failures_total'] += 1
+            stats['last_failure_timestamp_seconds'] = time.time()
+            _last_errors[name] = counters['failed']
+        else:
+            stats['last_success_timestamp_seconds'] = time.time()
+
+
+def snapshot():
+    """
+    Returns a copy of the metrics: {job name: {series: value, 'last_error': text}}.
+    """
+    with _lock:
+        return {name: dict(stats, last_error=_last_errors.get(name)) for name, stats in _jobs.items()}
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(jobs=None):
+    """
+    Formats the metrics in the Prometheus text exposition format.
+    """
+    jobs = snapshot() if jobs is None else jobs
+    lines = []
+    for series, (kind, description) in SERIES.items():
+        lines.append(f"# HELP {PREFIX}{series} {description}")
+        lines.append(f"# TYPE {PREFIX}{series} {kind}")
+        for name in sorted(jobs):
+            lines.append(f'{PREFIX}{series}{{job="{name}"}} {format_value(jobs[name][series])}')
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path=METRICS_FILE):
+    """
+    Writes the metrics to `path`, replacing it atomically so readers never see a partial file.
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as file:
+        file.write(render())
+    os.replace(tmp, path)
+
+
+def read_textfile(path=METRICS_FILE):
+    """
+    Parses a file written by write_textfile().
+
+    Returns:
+        dict: {job name: {series: value}}, empty if the file does not exist.
+    """
+    jobs = {}
+    try:
+        with open(path) as file:
+            for line in file:
+                if not line.startswith(PREFIX):
+                    continue
+                key, value = line.rsplit(' ', 1)
+                series, label = key[len(PREFIX):].split('{', 1)
+                name = label.split('"')[1]
+                jobs.setdefault(name, {})[series] = float(value)
+    except FileNotFoundError:
+        pass
+    return jobs
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=METRICS_PORT):
+    """
+    Serves /metrics on a daemon thread.
+
+    Returns:
+        ThreadingHTTPServer: The running server.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+
+def attach(scheduler, path=METRICS_FILE, port=METRICS_PORT):
+    """
+    Hooks the metrics into a scheduler: records misfires, skipped runs and
+    errors of unwrapped jobs, rewrites `path` after every job event and
+    starts the HTTP endpoint when `port` is set.
+    """
+    # Imported here: the Streamlit app reads the metric files without loading APScheduler
+    from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES
+
+    def on_event(evt):
+        job = scheduler.get_job(evt.job_id)
+        name = getattr(job.func, 'metrics_name', evt.job_id) if job else evt.job_id
+        # Wrapped jobs record their own runs in finish(); one-off jobs are gone by now
+        untracked = job is not None and not hasattr(job.func, 'metrics_name')
+        with _lock:
+            if evt.code == EVENT_JOB_MISSED:
+                _stats(name)['misfires_total'] += 1
+            elif evt.code == EVENT_JOB_MAX_INSTANCES:
+                _stats(name)['skipped_total'] += 1
+            elif untracked:
+                stats = _stats(name)
+                stats['runs_total'] += 1
+                if evt.code == EVENT_JOB_ERROR:
+                    stats['failures_total'] += 1
+                    stats['last_failure_timestamp_seconds'] = time.time()
+                    _last_errors[name] = f"{type(evt.exception).__name__}: {evt.exception}"
+                else:
+                    stats['last_success_timestamp_seconds'] = time.time()
+        if path:
+            try:
+                write_textfile(path)
+            except OSError as e:
+                print(f"Failed to write metrics to {path}: {e}")
+
+    scheduler.add_listener(on_event, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
+    if port:
+        serve(port)
@@ -0,0 +1,168 @@
+# migrate.py
+
+from datetime import datetime
+from sqlalchemy import text, inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateTable
+from database import engine
+from models import Base
+import reminders
+import adherence_rollup
+import archive
+
+
+def upgrade(bind=engine):
+    """
+    Brings an existing database up to date with models.py.
+
+    Base.metadata.create_all only creates missing tables, it never adds columns
+    or indexes to tables that already exist. This creates any missing tables,
+    adds missing nullable columns and then every declared index with CREATE
+    INDEX IF NOT EXISTS semantics, so it is safe to run repeatedly against
+    data/medical_scheduler.db. Tables that gained AUTOINCREMENT are rebuilt
+    once, see add_autoincrement().
+    """
+    Base.metadata.create_all(bind=bind)
+    added = add_missing_columns(bind)
+    if ('appointments', 'updated_at') in added:
+        # Existing appointments count as changed, so the first calendar sync pushes them
+        with bind.begin() as conn:
+            conn.execute(text("UPDATE appointments SET updated_at = :now WHERE updated_at IS NULL"),
+                         {'now': datetime.now()})
+    add_autoincrement(bind)
+    if archive.is_ready(bind):
+        archive.reserve_archived_ids(bind)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+    # Upcoming appointments booked before the reminder schedule existed
+    with Session(bind=bind) as session:
+        reminders.backfill(session)
+        # Follow-ups recorded before the adherence rollup existed
+        adherence_rollup.rebuild_if_empty(session)
+    print("DB MIGRATED")
+
+
+def add_missing_columns(bind=engine):
+    """
+    Adds columns declared in models.py that an existing table lacks.
+
+    Only columns SQLite can add in place are handled: nullable ones without
+    a server default. Python-side defaults apply to rows written afterwards.
+
+    Returns:
+        list: (table, column) pairs that were added.
+    """
+    inspector = inspect(bind)
+    added = []
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=bind.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                added.append((table.name, column.name))
+                print(f"Added column {table.name}.{column.name}")
+    return added
+
+
+def add_autoincrement(bind=engine):
+    """
+    Rebuilds the tables declared with sqlite_autoincrement that were created
+    without it, since SQLite cannot add AUTOINCREMENT to an existing table.
+
+    Follows SQLite's procedure for schema changes: with foreign keys off,
+    in one transaction, each table is created under a new name, filled,
+    dropped and the new one renamed, then the foreign keys are checked.
+    Indexes are recreated afterwards by upgrade(). This rewrites the tables,
+    so run it during a quiet period.
+
+    Returns:
+        list: Names of the rebuilt tables.
+    """
+    rebuilt = []
+    conn = bind.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA foreign_keys = OFF")
+        cursor.execute("BEGIN IMMEDIATE")
+        for table in Base.metadata.sorted_tables:
+            if not table.dialect_options['sqlite']['autoincrement']:
+                continue
+            row = cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                 (table.name,)).fetchone()
+            if row is None or 'AUTOINCREMENT' in row[0].upper():
+                continue
+            create = str(CreateTable(table).compile(dialect=bind.dialect)).strip()
+            cursor.execute(create.replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE new_{table.name} ", 1))
+            columns = ', '.join(column.name for column in table.columns)
+            cursor.execute(f"INSERT INTO new_{table.name} ({columns}) SELECT {columns} FROM {table.name}")
+            cursor.execute(f"DROP TABLE {table.name}")
+            cursor.execute(f"ALTER TABLE new_{table.name} RENAME TO {table.name}")
+            rebuilt.append(table.name)
+        problems = cursor.execute("PRAGMA foreign_key_check").fetchall()
+        if problems:
+            raise RuntimeError(f"Rebuilding {rebuilt} would break foreign keys: {problems[:10]}")
+        conn.commit()
+    finally:
+        # Undoes the rebuild if it failed; the pooled connection gets its foreign keys back either way
+        conn.rollback()
+        conn.cursor().execute("PRAGMA foreign_keys = ON")
+        conn.close()
+    for name in rebuilt:
+        print(f"Rebuilt {name} with AUTOINCREMENT")
+    return rebuilt
+
+
+# Representative shapes of the queries issued by the scheduler jobs
+JOB_QUERIES = {
+    'send_reminders / generate_daily_summary': (
+        "SELECT id FROM appointments WHERE status = 'Scheduled' "
+        "AND appointment_datetime >= :start AND appointment_datetime < :end"
+    ),
+    'send_reminders claim': (
+        "UPDATE reminder_schedule SET claimed_at = :end, claim_token = 'x' "
+        "WHERE claimed_at IS NULL AND due_at <= :end"
+    ),
+    'outbox claim': (
+        "SELECT id FROM outbox WHERE status = 'Pending' AND next_attempt_at <= :end "
+        "ORDER BY next_attempt_at, id LIMIT 100"
+    ),
+    'calendar push': (
+        "SELECT id FROM appointments WHERE updated_at > :start ORDER BY updated_at, id LIMIT 500"
+    ),
+    'monitor_cancellations': "SELECT id FROM appointments WHERE status = 'Cancelled'",
+    'prioritize_waitlist': (
+        "SELECT id FROM waitlist WHERE requested_datetime = :start "
+        "ORDER BY priority ASC, added_at ASC LIMIT 1"
+    ),
+    'pending follow-ups': (
+        "SELECT id FROM followups WHERE status = 'Pending' AND due_date <= :end"
+    ),
+    'reminders by appointment': "SELECT id FROM reminders WHERE appointment_id = :id",
+    'adherence by follow-up': "SELECT id FROM followup_adherence WHERE followup_id = :id",
+}
+
+
+def explain(bind=engine):
+    """
+    Prints the SQLite EXPLAIN QUERY PLAN for each job query.
+    """
+    params = {'start': '2025-01-01 00:00:00', 'end': '2025-01-02 00:00:00', 'id': 1}
+    with bind.connect() as conn:
+        for name, sql in JOB_QUERIES.items():
+            print(f"{name}:")
+            for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params):
+                print(f"    {row[-1]}")
+
+
+if __name__ == "__main__":
+    import sys
+    upgrade()
+    if "--explain" in sys.argv:
+        explain()
@@ -1,10 +1,14 @@
-from sqlalchemy import Column,Integer,String,DateTime,Boolean,ForeignKey
+from sqlalchemy import Column,Integer,String,Text,LargeBinary,DateTime,Date,Boolean,ForeignKey,Index,UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 import datetime
 
 Base =declarative_base()
 
+# Tables archive.py moves rows out of: AUTOINCREMENT keeps SQLite from handing
+# out the id of an archived row again once it is the highest one
+NO_ID_REUSE = {'sqlite_autoincrement': True}
+
 class User(Base):
     __tablename__ = 'users'
 
@@ -26,6 +30,11 @@ class Patient(Base):
 
     appointments = relationship("Appointment",back_populates="patient")
 
+    __table_args__ = (
+        # bulk_import matches patients on email
+        Index('ix_patients_email', 'email'),
+    )
+
     
 class Appointment(Base):
     __tablename__= 'appointments'
@@ -35,11 +44,22 @@ class Appointment(Base):
     user_id = Column(Integer,ForeignKey('users.id'),nullable=False)
     appointment_datetime = Column(DateTime, nullable=False)
     status = Column(String,default="Scheduled")
+    # Bumped on every ORM insert/update; calendar_sync pushes rows changed since its watermark
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
 
     patient = relationship("Patient",back_populates="appointments")
     user = relationship("User",back_populates="appointments")
     reminders = relationship("Reminder",back_populates="appointments")
 
+    __table_args__ = (
+        # send_reminders, generate_daily_summary and monitor_cancellations
+        Index('ix_appointments_status_datetime', 'status', 'appointment_datetime'),
+        # slots.booking_conflict: a practitioner's scheduled appointments around a slot
+        Index('ix_appointments_user_status_datetime', 'user_id', 'status', 'appointment_datetime'),
+        Index('ix_appointments_updated_at', 'updated_at'),
+        NO_ID_REUSE,
+    )
+
 
 
 
@@ -53,6 +73,33 @@ class Reminder(Base):
 
     appointments = relationship("Appointment",back_populates="reminders")
 
+    __table_args__ = (
+        Index('ix_reminders_appointment_id', 'appointment_id'),
+        NO_ID_REUSE,
+    )
+
+
+
+class ReminderSchedule(Base):
+    __tablename__ = 'reminder_schedule'
+
+    id = Column(Integer,primary_key=True,index=True)
+    appointment_id = Column(Integer,ForeignKey('appointments.id'),nullable=False)
+    offset_minutes = Column(Integer,nullable=False)  # Minutes before the appointment
+    due_at = Column(DateTime,nullable=False)
+    claimed_at = Column(DateTime,nullable=True)  # Set atomically by the job that sends it
+    claim_token = Column(String,nullable=True)
+    sent_at = Column(DateTime,nullable=True)
+
+    appointment = relationship("Appointment")
+
+    __table_args__ = (
+        # send_reminders: claimed_at IS NULL AND due_at <= now
+        Index('ix_reminder_schedule_claimed_due', 'claimed_at', 'due_at'),
+        Index('ix_reminder_schedule_appointment_id', 'appointment_id'),
+        Index('ix_reminder_schedule_claim_token', 'claim_token'),
+        NO_ID_REUSE,
+    )
 
 
 class Waitlist(Base):
@@ -66,6 +113,12 @@ class Waitlist(Base):
     
     patient = relationship("Patient")
 
+    __table_args__ = (
+        # utils.prioritize_waitlist: equality on the slot, then ordered by priority and age
+        Index('ix_waitlist_slot_priority', 'requested_datetime', 'priority', 'added_at'),
+        NO_ID_REUSE,
+    )
+
 
 class FollowUp(Base):
     __tablename__ = 'followups'
@@ -80,6 +133,13 @@ class FollowUp(Base):
     
     adherence = relationship("FollowUpAdherence", back_populates="followup", uselist=False)
 
+    __table_args__ = (
+        Index('ix_followups_status_due_date', 'status', 'due_date'),
+        # archive.py: pending follow-ups of an appointment, and the FK check when one is deleted
+        Index('ix_followups_appointment_id', 'appointment_id'),
+        NO_ID_REUSE,
+    )
+
 class FollowUpAdherence(Base):
     __tablename__ = 'followup_adherence'
     
@@ -88,4 +148,113 @@ class FollowUpAdherence(Base):
     completed = Column(Boolean, default=False)
     completed_at = Column(DateTime, nullable=True)
     
-    followup = relationship("FollowUp", back_populates="adherence")
\ No newline at end of file
+    followup = relationship("FollowUp", back_populates="adherence")
+
+    __table_args__ = (
+        Index('ix_followup_adherence_followup_id', 'followup_id'),
+        NO_ID_REUSE,
+    )
+
+
+class AdherenceRollup(Base):
+    __tablename__ = 'adherence_rollup'
+
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(Date, nullable=False)  # Due date of the follow-ups counted here
+    followup_type = Column(String, nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)  # Practitioner of the appointment
+    due = Column(Integer, nullable=False, default=0)
+    completed = Column(Integer, nullable=False, default=0)
+    on_time = Column(Integer, nullable=False, default=0)  # Completed on or before the due date
+    overdue = Column(Integer, nullable=False, default=0)  # Completed after the due date; summary() adds the open ones past due
+
+    user = relationship("User")
+
+    __table_args__ = (
+        UniqueConstraint('day', 'followup_type', 'user_id', name='uq_adherence_rollup_key'),
+    )
+
+
+class OutboxMessage(Base):
+    __tablename__ = 'outbox'
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False, default='email')  # 'reminder' also records a Reminder once sent
+    appointment_id = Column(Integer, ForeignKey('appointments.id'), nullable=True)
+    to_email = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+    attachment_name = Column(String, nullable=True)
+    attachment = Column(LargeBinary, nullable=True)
+    status = Column(String, nullable=False, default='Pending')  # Pending, Sending, Sent or Dead
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    claimed_at = Column(DateTime, nullable=True)
+    claim_token = Column(String, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    sent_at = Column(DateTime, nullable=True)
+
+    appointment = relationship("Appointment")
+
+    __table_args__ = (
+        # outbox worker: status = 'Pending' AND next_attempt_at <= now
+        Index('ix_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+        Index('ix_outbox_claim_token', 'claim_token'),
+        # archive.py: unsent emails of an appointment, and the FK check when one is deleted
+        Index('ix_outbox_appointment_id', 'appointment_id'),
+        NO_ID_REUSE,
+    )
+
+
+class EmailVerification(Base):
+    __tablename__ = 'email_verifications'
+
+    id = Column(Integer, primary_key=True, index=True)
+    email = Column(String, nullable=False, unique=True)  # Lower-cased address
+    valid = Column(Boolean, nullable=False)
+    score = Column(Integer, nullable=True)  # Hunter.io confidence score, 0-100
+    checked_at = Column(DateTime, nullable=False)
+
+
+class CalendarEvent(Base):
+    __tablename__ = 'calendar_events'
+
+    id = Column(Integer, primary_key=True, index=True)
+    appointment_id = Column(Integer, ForeignKey('appointments.id'), nullable=False, unique=True)
+    calendar_id = Column(String, nullable=False)
+    event_id = Column(String, nullable=False, unique=True)
+    synced_at = Column(DateTime, nullable=False)  # Appointment changes up to here are in the event
+
+    appointment = relationship("Appointment")
+
+    __table_args__ = (NO_ID_REUSE,)
+
+
+class CalendarSyncFailure(Base):
+    __tablename__ = 'calendar_sync_failures'
+
+    appointment_id = Column(Integer, ForeignKey('appointments.id'), primary_key=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    failed_at = Column(DateTime, nullable=False)
+    next_attempt_at = Column(DateTime, nullable=True, index=True)  # None once given up on
+
+
+class SyncState(Base):
+    __tablename__ = 'sync_state'
+
+    key = Column(String, primary_key=True)  # e.g. 'calendar.sync_token'
+    value = Column(String, nullable=True)
+    updated_at = Column(DateTime, nullable=False, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+
+class SchedulerLease(Base):
+    __tablename__ = 'scheduler_leases'
+
+    name = Column(String, primary_key=True)  # e.g. 'scheduler'
+    holder = Column(String, nullable=False)  # host:pid:nonce of the process holding it
+    # Naive UTC, see leader.utcnow()
+    acquired_at = Column(DateTime, nullable=False)
+    renewed_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)  # Free for anyone to take after this
@@ -1,12 +1,17 @@
 import os
+import time
+import uuid
+import queue
+import socket
 import smtplib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 from dotenv import load_dotenv
-from hunterIo import verify
-from database import session
-from models import Reminder
+from database import session_scope
 from datetime import datetime
 
 load_dotenv()
@@ -16,6 +21,292 @@ SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
 SMTP_SERVER = 'smtp.gmail.com'
 SMTP_PORT = 587
 
+# Connection pool tuning
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', 4))
+SMTP_TIMEOUT = float(os.getenv('SMTP_TIMEOUT', 30))
+SMTP_MAX_IDLE = float(os.getenv('SMTP_MAX_IDLE', 60))
+SMTP_MAX_RETRIES = int(os.getenv('SMTP_MAX_RETRIES', 2))
+
+# Where mail goes: 'smtp' (default), or 'file' / 'memory' to run without a mail server
+MAIL_BACKEND = os.getenv('MAIL_BACKEND', 'smtp')
+MAIL_FILE_DIR = os.getenv('MAIL_FILE_DIR', 'logs/mail')
+
+# Errors after which the connection is assumed dead and is re-opened
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, socket.timeout, ConnectionError)
+
+
+class TrackingSMTP(smtplib.SMTP):
+    """
+    smtplib.SMTP that records whether the DATA command of the current
+    message was issued, i.e. whether the server may already have it.
+    """
+
+    data_started = False
+
+    def data(self, msg):
+        self.data_started = True
+        return super().data(msg)
+
+
+class SMTPSession:
+    """
+    A single authenticated SMTP connection that is kept open across many messages.
+
+    The connection is opened lazily on the first send. If the server drops it
+    (421 "service not available", a timeout or a closed socket) before the
+    message was handed over, it is re-opened and the message is retried up to
+    SMTP_MAX_RETRIES times. Once DATA was sent the server may have accepted
+    the message, so a failure from then on is raised instead of sending it
+    twice; the outbox retries it later.
+    """
+
+    def __init__(self, server=SMTP_SERVER, port=SMTP_PORT, user=SMTP_USER,
+                 password=SMTP_PASSWORD, timeout=SMTP_TIMEOUT):
+        self.server = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.timeout = timeout
+        self.conn = None
+        self.last_used = 0.0
+        self.logins = 0
+
+    def _connect(self):
+        self.close()
+        conn = TrackingSMTP(self.server, self.port, timeout=self.timeout)
+        conn.starttls()
+        conn.login(self.user, self.password)
+        self.conn = conn
+        self.logins += 1
+
+    def _ensure_connected(self):
+        if self.conn is None:
+            self._connect()
+        elif time.monotonic() - self.last_used > SMTP_MAX_IDLE:
+            # Idle connections are often closed server side, probe before reuse
+            try:
+                if self.conn.noop()[0] != 250:
+                    self._connect()
+            except (smtplib.SMTPException,) + RECONNECT_ERRORS:
+                self._connect()
+
+    def send(self, msg):
+        """
+        Sends a prepared email message over the open connection.
+
+        Parameters:
+            msg (email.message.Message): Message with 'From' and 'To' headers set.
+
+        Raises the last SMTP error if the message could not be delivered.
+        """
+        attempt = 0
+        while True:
+            try:
+                self._ensure_connected()
+                self.conn.data_started = False
+                self.conn.send_message(msg)
+                self.last_used = time.monotonic()
+                return
+            except (smtplib.SMTPResponseException,) + RECONNECT_ERRORS as e:
+                handed_over = self.conn is not None and self.conn.data_started
+                dropped = not isinstance(e, smtplib.SMTPResponseException) or e.smtp_code == 421
+                if handed_over or not dropped or attempt >= SMTP_MAX_RETRIES:
+                    if dropped:
+                        self.close()
+                    raise
+            attempt += 1
+            self.close()
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class SMTPPool:
+    """
+    Thread-safe pool of SMTPSession objects.
+
+    At most `size` connections are open at once; callers borrow one with
+    `with smtp_pool.session() as smtp:` and block while all are in use.
+    """
+
+    def __init__(self, size=SMTP_POOL_SIZE, factory=SMTPSession):
+        self.size = size
+        self.factory = factory
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def session(self):
+        self._slots.acquire()
+        try:
+            try:
+                smtp = self._idle.get_nowait()
+            except queue.Empty:
+                smtp = self.factory()
+            try:
+                yield smtp
+            finally:
+                self._idle.put(smtp)
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class FileMailSession:
+    """
+    Offline stand-in for SMTPSession that writes every message to
+    MAIL_FILE_DIR as an .eml file instead of sending it.
+    """
+
+    def __init__(self, directory=MAIL_FILE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def send(self, msg):
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.eml"
+        with open(os.path.join(self.directory, filename), 'wb') as file:
+            file.write(msg.as_bytes())
+
+    def close(self):
+        pass
+
+
+class MemoryMailSession:
+    """
+    Offline stand-in for SMTPSession that keeps sent messages in
+    MemoryMailSession.sent. Recipients listed in fail_addresses are refused,
+    which lets tests exercise retries and dead-lettering.
+    """
+
+    sent = []
+    fail_addresses = set()
+    _lock = threading.Lock()
+
+    def send(self, msg):
+        if msg['To'] in self.fail_addresses:
+            raise smtplib.SMTPRecipientsRefused({msg['To']: (550, b'Recipient refused')})
+        with self._lock:
+            self.sent.append(msg)
+
+    def close(self):
+        pass
+
+
+MAIL_BACKENDS = {
+    'smtp': SMTPSession,
+    'file': FileMailSession,
+    'memory': MemoryMailSession,
+}
+
+smtp_pool = SMTPPool(factory=MAIL_BACKENDS[MAIL_BACKEND])
+
+
+def build_message(to_email, subject, body, attachment=None):
+    """
+    Builds an email message.
+
+    Parameters:
+        to_email (str): Recipient address.
+        subject (str): Subject line.
+        body (str): Plain text body.
+        attachment (tuple): Optional (filename, bytes) pair to attach.
+    """
+    if attachment is None:
+        msg = MIMEText(body)
+    else:
+        filename, data = attachment
+        msg = MIMEMultipart()
+        msg.attach(MIMEText(body, 'plain'))
+        part = MIMEApplication(data, Name=filename)
+        part['Content-Disposition'] = f'attachment; filename="{filename}"'
+        msg.attach(part)
+    msg['Subject'] = subject
+    msg['From'] = SMTP_USER
+    msg['To'] = to_email
+    return msg
+
+
+def send_many_detailed(messages):
+    """
+    Sends a batch of emails through one pooled, already authenticated connection.
+
+    Parameters:
+        messages (iterable): Email messages, or (to_email, subject, body) tuples.
+
+    Returns:
+        list: One entry per message, None if it was accepted by the server,
+        otherwise the error text.
+    """
+    errors = []
+    with smtp_pool.session() as smtp:
+        for msg in messages:
+            if isinstance(msg, tuple):
+                msg = build_message(*msg)
+            try:
+                smtp.send(msg)
+                errors.append(None)
+            except Exception as e:
+                print(f"Failed to send email to {msg['To']}: {e}")
+                errors.append(f"{type(e).__name__}: {e}")
+    return errors
+
+
+def send_many(messages):
+    """
+    Like send_many_detailed, but returns one boolean per message, True if it was sent.
+    """
+    return [error is None for error in send_many_detailed(messages)]
+
+
+def deliver_concurrently(items, render, workers=SMTP_POOL_SIZE, send=send_many):
+    """
+    Renders and sends emails on a bounded pool of worker threads.
+
+    Each worker borrows one pooled connection and sends its share of the
+    batch through it, so at most `workers` SMTP logins are used.
+
+    Parameters:
+        items (list): Plain data to build messages from (no ORM objects).
+        render (callable): Turns one item into a message or (to_email, subject, body) tuple.
+        workers (int): Maximum number of concurrent connections.
+        send (callable): send_many, or send_many_detailed to get the error text.
+
+    Returns:
+        list: One result of `send` per item, in the same order as `items`.
+    """
+    if not items:
+        return []
+    workers = max(1, min(workers, len(items)))
+    chunks = [items[i::workers] for i in range(workers)]
+
+    def deliver(chunk):
+        return send([render(item) for item in chunk])
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        chunk_results = list(executor.map(deliver, chunks))
+
+    results = [None] * len(items)
+    for i, chunk_result in enumerate(chunk_results):
+        results[i::workers] = chunk_result
+    return results
+
 
 def send_mail(to_email,subject,body):
     """
@@ -23,65 +314,52 @@ def send_mail(to_email,subject,body):
     """
 
     try:
-        msg = MIMEText(body)
-        msg['Subject'] = subject
-        msg['From'] = SMTP_USER
-        msg['To'] = to_email
-        
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(SMTP_USER, SMTP_PASSWORD)
-        server.sendmail(SMTP_USER, to_email, msg.as_string())
-        server.quit()
+        with smtp_pool.session() as smtp:
+            smtp.send(build_message(to_email, subject, body))
         return True
     except smtplib.SMTPAuthenticationError as e:
         print(f"SMTP Authentication Error: {e}")
     except Exception as e:
         print(f"Failed to send test email: {e}")
+    return False
 
     
+def render_reminder(patient_name, patient_email, appointment_datetime):
+    """
+    Returns the (to_email, subject, body) tuple for an appointment reminder.
+    """
+    appointment_time = appointment_datetime.strftime("%Y-%m-%d %H:%M")
+    subject= 'Appointment Reminder'
+    body = f"Dear {patient_name},\n\nThis is a reminder for your appointment on {appointment_time}.\n\nThank you."
+    return patient_email, subject, body
+
+
 def send_remainder(appointment):
+    """
+    Queues a reminder email for the appointment. The outbox worker sends it
+    and records the Reminder row once it has been delivered.
+    """
+    # Imported here because outbox uses this module to deliver
+    from outbox import enqueue
+
     patient = appointment.patient
-    appointment_time = appointment.appointment_datetime.strftime("%Y-%m-%d %H:%M")
-    subject= 'Appointment Reminder'
-    body = f"Dear {patient.name},\n\nThis is a reminder for your appointment on {appointment_time}.\n\nThank you."
+    to_email, subject, body = render_reminder(patient.name, patient.email, appointment.appointment_datetime)
+    with session_scope() as session:
+        enqueue(session, to_email, subject, body, kind='reminder', appointment_id=appointment.id)
+    return True
 
-    
-    if send_mail(patient.email,subject=subject,body=body):
-        reminder = Reminder(
-                appointment_id=appointment.id,
-                sent=datetime.now(),
-                
-        )
-        session.add(reminder)
-        session.commit()
-        return True
-    
 def send_email_with_attachment(to_email, subject, body, attachment_path):
-    # Create a multipart message
-    msg = MIMEMultipart()
-    msg['Subject'] = subject
-    msg['From'] = SMTP_USER
-    msg['To'] = to_email
-    
-    # Attach the body text
-    msg.attach(MIMEText(body, 'plain'))
-    
-    # Attach the file
+    # Read the file and build a multipart message
     with open(attachment_path, 'rb') as file:
-        part = MIMEApplication(file.read(), Name=os.path.basename(attachment_path))
-    part['Content-Disposition'] = f'attachment; filename="{os.path.basename(attachment_path)}"'
-    msg.attach(part)
+        attachment = (os.path.basename(attachment_path), file.read())
+    msg = build_message(to_email, subject, body, attachment=attachment)
     
     try:
-        # Connect to the SMTP server
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()  # Secure the connection
-        server.login(SMTP_USER, SMTP_PASSWORD)  # Login to SMTP server
-        server.send_message(msg)  # Send the email
-        server.quit()  # Disconnect from the server
+        # Reuse a pooled connection instead of logging in for every recipient
+        with smtp_pool.session() as smtp:
+            smtp.send(msg)
         print(f"Email with attachment sent to {to_email}")
         return True
     except Exception as e:
         print(f"Failed to send email with attachment to {to_email}: {e}")
-        return False
\ No newline at end of file
+        return False
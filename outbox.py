@@ -0,0 +1,280 @@
+# outbox.py
+"""
+Durable email outbox.
+
+Code that changes state queues its emails with enqueue() inside the same
+transaction, so a message is stored exactly when the change commits and no
+SMTP round trip happens while a transaction or a Streamlit request is open.
+A separate worker process delivers them:
+
+    python outbox.py              # run the delivery worker
+    python outbox.py --once       # deliver one batch and exit
+    python outbox.py --status     # number of messages per status
+    python outbox.py --retry-dead # queue dead-lettered messages again
+
+Failed messages are retried with exponential backoff and moved to 'Dead'
+after OUTBOX_MAX_ATTEMPTS. Set MAIL_BACKEND=file or MAIL_BACKEND=memory to
+run the worker without a mail server.
+"""
+
+import os
+import time
+import uuid
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, or_, and_
+from database import session_scope
+from models import OutboxMessage, Reminder
+from notif import build_message, deliver_concurrently, send_many_detailed, smtp_pool
+import metrics
+
+# Messages claimed per batch and the connections used to send them
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 100))
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', 4))
+
+# Retry policy: 1, 2, 4, 8, ... minutes apart, capped, then dead-lettered
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 6))
+OUTBOX_BACKOFF_SECONDS = int(os.getenv('OUTBOX_BACKOFF_SECONDS', 60))
+OUTBOX_MAX_BACKOFF_SECONDS = int(os.getenv('OUTBOX_MAX_BACKOFF_SECONDS', 6 * 3600))
+
+# Idle wait between polls, and how long a claim may stay 'Sending' before
+# the message is assumed lost with a crashed worker and claimed again
+OUTBOX_POLL_SECONDS = float(os.getenv('OUTBOX_POLL_SECONDS', 5))
+OUTBOX_CLAIM_TIMEOUT_SECONDS = int(os.getenv('OUTBOX_CLAIM_TIMEOUT_SECONDS', 600))
+
+# The worker's metrics, kept apart from the scheduler's METRICS_FILE
+OUTBOX_METRICS_FILE = os.getenv('OUTBOX_METRICS_FILE', 'logs/outbox_metrics.prom')
+
+logger = logging.getLogger('outbox')
+
+
+def enqueue(session, to_email, subject, body, attachment=None, kind='email', appointment_id=None):
+    """
+    Queues one email in the caller's transaction. Nothing is sent until the
+    transaction commits and the worker picks the message up.
+
+    Parameters:
+        session (Session): Session of the state change the email belongs to.
+        to_email (str): Recipient address.
+        subject (str): Subject line.
+        body (str): Plain text body.
+        attachment (tuple): Optional (filename, bytes) pair to attach.
+        kind (str): 'reminder' makes the worker record a Reminder row once sent.
+        appointment_id (int): Appointment the email is about, if any.
+
+    Returns:
+        OutboxMessage: The pending message.
+    """
+    now = datetime.now()
+    attachment_name, attachment_data = attachment if attachment else (None, None)
+    message = OutboxMessage(
+        kind=kind,
+        appointment_id=appointment_id,
+        to_email=to_email,
+        subject=subject,
+        body=body,
+        attachment_name=attachment_name,
+        attachment=attachment_data,
+        status='Pending',
+        attempts=0,
+        next_attempt_at=now,
+        created_at=now
+    )
+    session.add(message)
+    metrics.count('emails_queued')
+    return message
+
+
+def enqueue_many(session, messages, **options):
+    """
+    Queues several (to_email, subject, body) tuples that share the same
+    enqueue() options, e.g. one report attachment for every recipient.
+    """
+    return [enqueue(session, *message, **options) for message in messages]
+
+
+def claim_batch(session, limit=OUTBOX_BATCH_SIZE, now=None):
+    """
+    Atomically claims up to `limit` messages that are ready to be sent.
+
+    The claim is a single UPDATE, so concurrent workers never send the same
+    message. Claiming counts as an attempt, which keeps a message that
+    crashes the worker from being retried forever. The caller commits.
+
+    Returns:
+        list: Rows with the columns needed to build and record each message.
+    """
+    now = now or datetime.now()
+    token = uuid.uuid4().hex
+    stale = now - timedelta(seconds=OUTBOX_CLAIM_TIMEOUT_SECONDS)
+    ready = or_(
+        and_(OutboxMessage.status == 'Pending', OutboxMessage.next_attempt_at <= now),
+        and_(OutboxMessage.status == 'Sending', OutboxMessage.claimed_at < stale)
+    )
+    batch = select(OutboxMessage.id).where(ready) \
+        .order_by(OutboxMessage.next_attempt_at, OutboxMessage.id) \
+        .limit(limit)
+
+    claimed = session.query(OutboxMessage).filter(
+        OutboxMessage.id.in_(batch.scalar_subquery()),
+        ready
+    ).update({
+        OutboxMessage.status: 'Sending',
+        OutboxMessage.claimed_at: now,
+        OutboxMessage.claim_token: token,
+        OutboxMessage.attempts: OutboxMessage.attempts + 1
+    }, synchronize_session=False)
+    if not claimed:
+        return []
+
+    return session.query(
+        OutboxMessage.id,
+        OutboxMessage.kind,
+        OutboxMessage.appointment_id,
+        OutboxMessage.to_email,
+        OutboxMessage.subject,
+        OutboxMessage.body,
+        OutboxMessage.attachment_name,
+        OutboxMessage.attachment,
+        OutboxMessage.attempts
+    ).filter(OutboxMessage.claim_token == token).order_by(OutboxMessage.id).all()
+
+
+def backoff(attempts):
+    """
+    Returns the delay before retrying a message that has failed `attempts` times.
+    """
+    return timedelta(seconds=min(OUTBOX_BACKOFF_SECONDS * 2 ** (attempts - 1), OUTBOX_MAX_BACKOFF_SECONDS))
+
+
+def render_outbox_message(row):
+    attachment = (row.attachment_name, row.attachment) if row.attachment_name else None
+    return build_message(row.to_email, row.subject, row.body, attachment=attachment)
+
+
+def drain(batch_size=OUTBOX_BATCH_SIZE, workers=OUTBOX_WORKERS):
+    """
+    Claims one batch, sends it over up to `workers` pooled connections and
+    records the outcome of every message in one transaction.
+
+    Returns:
+        dict: Number of messages 'sent', 'retried' and 'dead' in this batch.
+    """
+    with session_scope() as session:
+        batch = claim_batch(session, batch_size)
+    result = {'sent': 0, 'retried': 0, 'dead': 0}
+    if not batch:
+        return result
+
+    errors = deliver_concurrently(batch, render_outbox_message, workers=workers, send=send_many_detailed)
+
+    finished = datetime.now()
+    updates = []
+    reminders = []
+    for row, error in zip(batch, errors):
+        if error is None:
+            updates.append({'id': row.id, 'status': 'Sent', 'sent_at': finished, 'last_error': None})
+            if row.kind == 'reminder' and row.appointment_id is not None:
+                reminders.append({'appointment_id': row.appointment_id, 'sent': finished})
+            result['sent'] += 1
+        elif row.attempts >= OUTBOX_MAX_ATTEMPTS:
+            updates.append({'id': row.id, 'status': 'Dead', 'last_error': error})
+            logger.error(f"Message {row.id} to {row.to_email} dead after {row.attempts} attempts: {error}")
+            result['dead'] += 1
+        else:
+            updates.append({
+                'id': row.id,
+                'status': 'Pending',
+                'next_attempt_at': finished + backoff(row.attempts),
+                'last_error': error
+            })
+            logger.warning(f"Message {row.id} to {row.to_email} failed (attempt {row.attempts}): {error}")
+            result['retried'] += 1
+
+    with session_scope() as session:
+        session.bulk_update_mappings(OutboxMessage, updates)
+        if reminders:
+            session.bulk_insert_mappings(Reminder, reminders)
+
+    metrics.count('emails_attempted', len(batch))
+    metrics.count('emails_failed', result['retried'] + result['dead'])
+    logger.info(f"Outbox batch: {result['sent']} sent, {result['retried']} retried, {result['dead']} dead.")
+    return result
+
+
+def status_counts(session):
+    """
+    Returns the number of outbox messages per status.
+    """
+    rows = session.query(OutboxMessage.status, func.count(OutboxMessage.id)) \
+        .group_by(OutboxMessage.status).all()
+    return dict(rows)
+
+
+def retry_dead(session, ids=None):
+    """
+    Queues dead-lettered messages again with a fresh attempt budget. The caller commits.
+
+    Parameters:
+        ids (list): Only these messages, defaults to every dead message.
+
+    Returns:
+        int: Number of messages re-queued.
+    """
+    query = session.query(OutboxMessage).filter(OutboxMessage.status == 'Dead')
+    if ids is not None:
+        query = query.filter(OutboxMessage.id.in_(ids))
+    return query.update({
+        OutboxMessage.status: 'Pending',
+        OutboxMessage.attempts: 0,
+        OutboxMessage.next_attempt_at: datetime.now()
+    }, synchronize_session=False)
+
+
+def run_worker(batch_size=OUTBOX_BATCH_SIZE, workers=OUTBOX_WORKERS, poll_seconds=OUTBOX_POLL_SECONDS):
+    """
+    Drains the outbox until interrupted. Full batches are followed by the
+    next one straight away; otherwise the worker waits `poll_seconds`.
+    """
+    print("Outbox worker started.")
+    timed_drain = metrics.job('outbox_drain')(drain)
+    try:
+        while True:
+            try:
+                result = timed_drain(batch_size, workers)
+            except Exception as e:
+                logger.error(f"Outbox batch failed: {e}")
+                result = None
+            if result is None or sum(result.values()):
+                try:
+                    metrics.write_textfile(OUTBOX_METRICS_FILE)
+                except OSError as e:
+                    logger.error(f"Failed to write metrics to {OUTBOX_METRICS_FILE}: {e}")
+            if not result or sum(result.values()) < batch_size:
+                time.sleep(poll_seconds)
+    except KeyboardInterrupt:
+        print("Outbox worker stopped.")
+    finally:
+        smtp_pool.close_all()
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(
+        filename='logs/outbox.log',
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)s:%(message)s'
+    )
+    if "--status" in sys.argv:
+        with session_scope() as session:
+            for status, count in sorted(status_counts(session).items()):
+                print(f"{status}: {count}")
+    elif "--retry-dead" in sys.argv:
+        with session_scope() as session:
+            print(f"Re-queued {retry_dead(session)} dead messages.")
+    elif "--once" in sys.argv:
+        print(drain())
+        smtp_pool.close_all()
+    else:
+        run_worker()
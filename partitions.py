@@ -0,0 +1,183 @@
+# partitions.py
+"""
+Partitioned execution of scheduler jobs.
+
+A job's work is split into PARTITION_COUNT disjoint shards by a key column
+(in_partition()), e.g. the appointment id for reminders and follow-ups or
+the slot time for the cancellation backfill, so shards never touch the same
+rows. run() executes one task per shard on a pool of PARTITION_WORKERS
+processes, each with its own database connections, and merges the results
+into one RunReport.
+
+With PARTITION_WORKERS=1 (the default) the shards run in this process one
+after another and nothing is spawned.
+"""
+
+import os
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from sqlalchemy import Integer, cast, func, true
+import metrics
+
+PARTITION_WORKERS = int(os.getenv('PARTITION_WORKERS', 1))
+PARTITION_COUNT = int(os.getenv('PARTITION_COUNT', PARTITION_WORKERS))
+
+# DateTime keys are hashed per quarter hour, with Knuth's multiplicative constant
+SLOT_SECONDS = 900
+HASH_MULTIPLIER = 2654435761
+
+logger = logging.getLogger('partitions')
+
+_pool = None
+
+
+def in_partition(column, partition):
+    """
+    SQL condition selecting the rows of `column` that belong to `partition`.
+
+    A DateTime is sharded by a multiplicative hash of its quarter hour:
+    slot times are whole quarter hours or hours, so their Unix time, or even
+    the quarter hour itself, modulo a small count would send every slot to
+    the same partition.
+
+    Parameters:
+        column: Integer column, or DateTime column.
+        partition (tuple): (index, count), or None for every row.
+    """
+    if partition is None or partition[1] <= 1:
+        return true()
+    index, count = partition
+    if isinstance(column.type, Integer):
+        return column % count == index
+    quarter = cast(func.strftime('%s', column), Integer) // SLOT_SECONDS
+    return (quarter * HASH_MULTIPLIER % 2 ** 32) // 2 ** 16 % count == index
+
+
+class RunReport:
+    """
+    Merged outcome of one partitioned run.
+
+    Attributes:
+        job (str): Job name.
+        rows (int): Rows processed by all partitions.
+        seconds (float): Wall time of the whole run.
+        partitions (list): One dict per partition with index, rows, seconds and error.
+    """
+
+    def __init__(self, job, count, workers):
+        self.job = job
+        self.count = count
+        self.workers = workers
+        self.rows = 0
+        self.seconds = 0.0
+        self.partitions = []
+
+    def add(self, index, rows, seconds, error=None):
+        self.partitions.append({'index': index, 'rows': rows, 'seconds': round(seconds, 3), 'error': error})
+        self.rows += rows
+
+    @property
+    def errors(self):
+        return [part for part in self.partitions if part['error']]
+
+    def summary(self):
+        slowest = max((part['seconds'] for part in self.partitions), default=0)
+        return (f"{self.job}: {self.rows} rows in {self.seconds:.2f}s over {self.count} partitions "
+                f"on {self.workers} workers (slowest partition {slowest:.2f}s, {len(self.errors)} failed)")
+
+
+def init_worker():
+    # Connections inherited from the parent must not be reused in the child
+    from database import engine
+    engine.dispose(close=False)
+
+
+def get_pool(workers):
+    """
+    Returns the process pool, started on first use and kept for later runs
+    so each run does not pay for starting interpreters.
+    """
+    global _pool
+    if _pool is None or _pool._max_workers != workers:
+        if _pool is not None:
+            _pool.shutdown()
+        # spawn: the scheduler process has threads, which fork does not copy safely
+        _pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker
+        )
+    return _pool
+
+
+def run_partition(task, partition, kwargs):
+    """
+    Runs one shard and returns (rows, seconds, counters, error).
+    """
+    started = time.perf_counter()
+    with metrics.collect() as counters:
+        try:
+            rows = task(partition=partition, **kwargs) or 0
+            error = None
+        except Exception as e:
+            rows = 0
+            error = f"{type(e).__name__}: {e}"
+    return rows, time.perf_counter() - started, counters, error
+
+
+def partition_result(future):
+    """
+    Returns the result of a submitted run_partition(), or an error result
+    when it never ran to the end, e.g. because its worker process died.
+    """
+    global _pool
+    try:
+        return future.result()
+    except Exception as e:
+        if isinstance(e, BrokenProcessPool) and _pool is not None:
+            # Every pending task of a broken pool fails, start a new one next run
+            _pool.shutdown(wait=False)
+            _pool = None
+        return 0, 0.0, dict.fromkeys(metrics.COUNTERS, 0), f"{type(e).__name__}: {e}"
+
+
+def run(job, task, count=PARTITION_COUNT, workers=PARTITION_WORKERS, **kwargs):
+    """
+    Runs task(partition=(index, count), **kwargs) for every partition.
+
+    The task must be a module-level function returning the number of rows
+    it processed. A failed partition, or one whose worker process died,
+    does not stop the others; it is reported in RunReport.errors and marks
+    the running job as failed.
+
+    Returns:
+        RunReport: The merged result.
+    """
+    count = max(1, count)
+    workers = max(1, min(workers, count))
+    report = RunReport(job, count, workers)
+    started = time.perf_counter()
+
+    partitions = [(index, count) for index in range(count)]
+    if workers == 1:
+        results = [run_partition(task, partition, kwargs) for partition in partitions]
+    else:
+        pool = get_pool(workers)
+        futures = [pool.submit(run_partition, task, partition, kwargs) for partition in partitions]
+        results = [partition_result(future) for future in futures]
+
+    for (index, _), (rows, seconds, counters, error) in zip(partitions, results):
+        report.add(index, rows, seconds, error)
+        for counter in metrics.COUNTERS:
+            if counter != 'rows':
+                metrics.count(counter, counters[counter])
+        if error:
+            logger.error(f"{job} partition {index}/{count} failed: {error}")
+    report.seconds = time.perf_counter() - started
+    if report.errors:
+        metrics.record_failure(f"{len(report.errors)} of {count} partitions failed")
+    logger.info(report.summary())
+    return report
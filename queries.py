@@ -0,0 +1,189 @@
+# queries.py
+"""
+Read-only query builders shared by the Streamlit app and the scheduler jobs.
+
+They return plain rows or dicts rather than ORM objects, so the results can be
+cached, handed to other threads and used after the session is closed.
+"""
+
+from sqlalchemy import select, func, or_, and_
+from sqlalchemy.orm import contains_eager
+from models import User, Patient, Appointment, Waitlist, FollowUp
+
+
+def appointments_with_people(session):
+    """
+    Query for Appointment objects with their patient and practitioner loaded
+    by the same JOINed SELECT, so reading appt.patient.name or appt.user.name
+    in a loop does not issue one extra query per row.
+    """
+    return session.query(Appointment) \
+        .join(Appointment.patient) \
+        .join(Appointment.user) \
+        .options(contains_eager(Appointment.patient), contains_eager(Appointment.user))
+
+
+def dashboard_counts(session):
+    """
+    Fetches every Dashboard counter in a single round trip.
+
+    Returns:
+        dict: total_patients, total_appointments, pending_cancellations,
+        waitlist_count and followups_pending.
+    """
+    query = select(
+        select(func.count(Patient.id)).scalar_subquery().label('total_patients'),
+        select(func.count(Appointment.id)).scalar_subquery().label('total_appointments'),
+        select(func.count(Appointment.id)).where(
+            Appointment.status == 'Cancelled'
+        ).scalar_subquery().label('pending_cancellations'),
+        select(func.count(Waitlist.id)).scalar_subquery().label('waitlist_count'),
+        select(func.count(FollowUp.id)).where(
+            FollowUp.status == 'Pending'
+        ).scalar_subquery().label('followups_pending'),
+    )
+    return dict(session.execute(query).one()._mapping)
+
+
+def cancelled_appointments(session):
+    """
+    Returns the cancelled appointments waiting to be processed, oldest slot first.
+
+    Returns:
+        list: (id, patient name, appointment_datetime) tuples.
+    """
+    return [
+        (appt.id, appt.patient.name, appt.appointment_datetime)
+        for appt in appointments_with_people(session)
+            .filter(Appointment.status == "Cancelled")
+            .order_by(Appointment.appointment_datetime)
+            .all()
+    ]
+
+
+def recent_appointments(session, limit=5):
+    """
+    Returns the latest appointments with the patient name joined in.
+
+    Returns:
+        list: dicts with id, patient_name, appointment_datetime and status.
+    """
+    query = select(
+        Appointment.id,
+        Patient.name.label('patient_name'),
+        Appointment.appointment_datetime,
+        Appointment.status
+    ).join(Patient, Patient.id == Appointment.patient_id) \
+     .order_by(Appointment.appointment_datetime.desc()) \
+     .limit(limit)
+    return [dict(row._mapping) for row in session.execute(query)]
+
+
+# Keyset ("seek") pagination: each page starts strictly after the sort key of the
+# previous page's last row, so a page costs the same no matter how deep it is.
+
+def page_patients(session, after=None, limit=50, search=None):
+    """
+    Returns one page of patients ordered by id.
+
+    Parameters:
+        after (int): id of the last patient on the previous page.
+        limit (int): Page size.
+        search (str): Optional case-insensitive match on name or email.
+    """
+    query = select(Patient.id, Patient.name, Patient.email).order_by(Patient.id).limit(limit)
+    if search:
+        pattern = f"%{search}%"
+        query = query.where(or_(Patient.name.ilike(pattern), Patient.email.ilike(pattern)))
+    if after is not None:
+        query = query.where(Patient.id > after)
+    return [dict(row._mapping) for row in session.execute(query)]
+
+
+def page_appointments(session, status='Scheduled', after=None, limit=50, search=None):
+    """
+    Returns one page of appointments with the given status ordered by time.
+
+    Parameters:
+        after (tuple): (appointment_datetime, id) of the last row on the previous page.
+        search (str): Optional case-insensitive match on the patient name.
+    """
+    query = select(
+        Appointment.id,
+        Patient.name.label('patient'),
+        User.name.label('practitioner'),
+        Appointment.appointment_datetime,
+        Appointment.status
+    ).join(Patient, Patient.id == Appointment.patient_id) \
+     .join(User, User.id == Appointment.user_id) \
+     .where(Appointment.status == status) \
+     .order_by(Appointment.appointment_datetime, Appointment.id) \
+     .limit(limit)
+    if search:
+        query = query.where(Patient.name.ilike(f"%{search}%"))
+    if after is not None:
+        after_datetime, after_id = after
+        query = query.where(or_(
+            Appointment.appointment_datetime > after_datetime,
+            and_(Appointment.appointment_datetime == after_datetime, Appointment.id > after_id)
+        ))
+    return [dict(row._mapping) for row in session.execute(query)]
+
+
+def page_followups(session, after=None, limit=50, search=None):
+    """
+    Returns one page of pending follow-ups ordered by due date.
+
+    Parameters:
+        after (tuple): (due_date, id) of the last row on the previous page.
+        search (str): Optional case-insensitive match on the follow-up type.
+    """
+    query = select(
+        FollowUp.id,
+        FollowUp.appointment_id,
+        FollowUp.followup_type,
+        FollowUp.due_date
+    ).where(FollowUp.status == 'Pending') \
+     .order_by(FollowUp.due_date, FollowUp.id) \
+     .limit(limit)
+    if search:
+        query = query.where(FollowUp.followup_type.ilike(f"%{search}%"))
+    if after is not None:
+        after_due, after_id = after
+        query = query.where(or_(
+            FollowUp.due_date > after_due,
+            and_(FollowUp.due_date == after_due, FollowUp.id > after_id)
+        ))
+    return [dict(row._mapping) for row in session.execute(query)]
+
+
+def page_waitlist(session, after=None, limit=50, search=None):
+    """
+    Returns one page of the waitlist, highest priority score first, then oldest.
+
+    Parameters:
+        after (tuple): (priority, added_at, id) of the last row on the previous page.
+        search (str): Optional case-insensitive match on the patient name.
+    """
+    query = select(
+        Waitlist.id,
+        Waitlist.patient_id,
+        Patient.name.label('patient'),
+        Waitlist.priority,
+        Waitlist.requested_datetime,
+        Waitlist.added_at
+    ).join(Patient, Patient.id == Waitlist.patient_id) \
+     .order_by(Waitlist.priority.desc(), Waitlist.added_at, Waitlist.id) \
+     .limit(limit)
+    if search:
+        query = query.where(Patient.name.ilike(f"%{search}%"))
+    if after is not None:
+        after_priority, after_added, after_id = after
+        query = query.where(or_(
+            Waitlist.priority < after_priority,
+            and_(Waitlist.priority == after_priority, or_(
+                Waitlist.added_at > after_added,
+                and_(Waitlist.added_at == after_added, Waitlist.id > after_id)
+            ))
+        ))
+    return [dict(row._mapping) for row in session.execute(query)]
@@ -0,0 +1,182 @@
+# query_stats.py
+"""
+SQL statement statistics, slow-query log and per-unit-of-work query budget.
+
+Enabled with DB_QUERY_STATS=true; when disabled no engine events are
+registered and session_scope() skips the bookkeeping, so it costs nothing.
+When enabled:
+
+- every statement is reduced to a fingerprint (literals, parameter lists
+  and multi-row VALUES collapsed) and its count, total time and recent
+  latencies are kept, see report();
+- statements slower than DB_SLOW_QUERY_MS are written to the
+  'database.slow' logger (logs/slow_queries.log) with the scheduler job or
+  Streamlit tab that ran them;
+- every session_scope() counts its statements, and one that runs more than
+  DB_QUERY_BUDGET is logged with its most repeated statement, which is
+  usually an N+1 loop over a relationship.
+
+Jobs are labelled by metrics.job(), Streamlit tabs by set_label().
+
+This aggregates; to see individual statements with their parameters, use
+the sampled 'database.sql' log (DB_SQL_LOG_SAMPLE in database.py) as well.
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import Counter, deque
+from functools import lru_cache
+from sqlalchemy import event
+
+DB_QUERY_STATS = os.getenv('DB_QUERY_STATS', 'false').lower() == 'true'
+DB_SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', 200))
+DB_SLOW_QUERY_LOG = os.getenv('DB_SLOW_QUERY_LOG', 'logs/slow_queries.log')
+# Statements one session_scope() may run before it is reported as a likely N+1
+DB_QUERY_BUDGET = int(os.getenv('DB_QUERY_BUDGET', 100))
+# Latest durations kept per fingerprint for the p95
+QUERY_SAMPLE_SIZE = 500
+
+slow_logger = logging.getLogger('database.slow')
+
+_label = contextvars.ContextVar('query_label', default=None)
+_unit = contextvars.ContextVar('query_unit', default=None)
+_lock = threading.Lock()
+_stats = {}  # fingerprint -> {'count', 'total', 'max', 'samples'}
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_REPEATED_ROWS = re.compile(r"(\([^()]*\))(?:\s*,\s*\1)+")
+_SPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(statement):
+    """
+    Normalizes a statement so executions that differ only in literal values,
+    IN list length or number of VALUES rows share one entry.
+    """
+    statement = _STRING.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    statement = _PARAM_LIST.sub('(?, ...)', statement)
+    statement = _REPEATED_ROWS.sub(r'\1, ...', statement)
+    return _SPACE.sub(' ', statement).strip()
+
+
+def set_label(name):
+    """
+    Names what is running in this context, e.g. the current Streamlit tab.
+    """
+    _label.set(name)
+
+
+@contextmanager
+def label(name):
+    """
+    Names what runs inside the block, e.g. a scheduler job.
+    """
+    token = _label.set(name)
+    try:
+        yield
+    finally:
+        _label.reset(token)
+
+
+def begin_unit():
+    """
+    Starts counting statements for a unit of work; pass the result to end_unit().
+    """
+    return _unit.set(Counter())
+
+
+def end_unit(token):
+    """
+    Stops counting and reports the unit if it went over DB_QUERY_BUDGET.
+    """
+    statements = _unit.get()
+    _unit.reset(token)
+    total = sum(statements.values())
+    if total > DB_QUERY_BUDGET:
+        statement, repeats = statements.most_common(1)[0]
+        slow_logger.warning(
+            f"[{_label.get() or 'unlabelled'}] unit of work ran {total} statements "
+            f"(budget {DB_QUERY_BUDGET}), {repeats}x: {statement}"
+        )
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    key = fingerprint(statement)
+    with _lock:
+        stats = _stats.get(key)
+        if stats is None:
+            stats = _stats[key] = {'count': 0, 'total': 0.0, 'max': 0.0, 'samples': deque(maxlen=QUERY_SAMPLE_SIZE)}
+        stats['count'] += 1
+        stats['total'] += elapsed
+        stats['max'] = max(stats['max'], elapsed)
+        stats['samples'].append(elapsed)
+    statements = _unit.get()
+    if statements is not None:
+        statements[key] += 1
+    if elapsed * 1000 >= DB_SLOW_QUERY_MS:
+        slow_logger.warning(
+            f"[{_label.get() or 'unlabelled'}] {elapsed * 1000:.1f} ms: {key} {parameters!r:.200}"
+        )
+
+
+def handle_error(context):
+    # after_cursor_execute does not run for a failed statement
+    if context.connection is not None and context.connection.info.get('query_started'):
+        context.connection.info['query_started'].pop()
+
+
+def install(engine):
+    """
+    Registers the cursor hooks on `engine` and sends the slow-query log to DB_SLOW_QUERY_LOG.
+    """
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(engine, 'handle_error', handle_error)
+    if DB_SLOW_QUERY_LOG and not slow_logger.handlers:
+        handler = logging.FileHandler(DB_SLOW_QUERY_LOG)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s:%(message)s'))
+        slow_logger.addHandler(handler)
+        slow_logger.setLevel(logging.INFO)
+
+
+def report(limit=20):
+    """
+    Returns the statements that took the most time in this process.
+
+    Returns:
+        list: dicts with statement, count, total_ms, mean_ms, p95_ms and max_ms,
+        by descending total time.
+    """
+    with _lock:
+        items = [(key, dict(stats, samples=sorted(stats['samples']))) for key, stats in _stats.items()]
+    rows = []
+    for key, stats in sorted(items, key=lambda item: item[1]['total'], reverse=True)[:limit]:
+        samples = stats['samples']
+        rows.append({
+            'statement': key,
+            'count': stats['count'],
+            'total_ms': round(stats['total'] * 1000, 2),
+            'mean_ms': round(stats['total'] * 1000 / stats['count'], 3),
+            'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+            'max_ms': round(stats['max'] * 1000, 3),
+        })
+    return rows
+
+
+def reset():
+    with _lock:
+        _stats.clear()
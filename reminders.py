@@ -0,0 +1,132 @@
+# reminders.py
+
+import os
+import uuid
+from datetime import datetime, timedelta
+from models import Appointment, Patient, ReminderSchedule
+from partitions import in_partition
+
+# Minutes before the appointment at which a reminder is due (T-24h and T-30m by default)
+REMINDER_OFFSETS = [int(m) for m in os.getenv('REMINDER_OFFSETS', '1440,30').split(',')]
+
+
+def schedule_reminders(session, appointments, now=None):
+    """
+    (Re)computes the reminder due times for the given appointments.
+
+    Call this whenever an appointment is created or its time or status changes.
+    Unclaimed rows for the appointments are replaced; rows already claimed or
+    sent are left alone so a reminder is never sent twice. The caller commits.
+
+    Parameters:
+        session (Session): Session the appointments belong to.
+        appointments (list): Flushed Appointment objects.
+        now (datetime): Current time, defaults to datetime.now().
+    """
+    now = now or datetime.now()
+    appointments = [appt for appt in appointments if appt.id is not None]
+    if not appointments:
+        return
+
+    session.query(ReminderSchedule).filter(
+        ReminderSchedule.appointment_id.in_([appt.id for appt in appointments]),
+        ReminderSchedule.claimed_at.is_(None)
+    ).delete(synchronize_session=False)
+
+    rows = []
+    for appt in appointments:
+        if appt.status != 'Scheduled':
+            continue
+        for offset in REMINDER_OFFSETS:
+            due_at = appt.appointment_datetime - timedelta(minutes=offset)
+            if due_at > now:
+                rows.append({
+                    'appointment_id': appt.id,
+                    'offset_minutes': offset,
+                    'due_at': due_at,
+                })
+    if rows:
+        session.bulk_insert_mappings(ReminderSchedule, rows)
+
+
+def claim_due_reminders(session, now=None, partition=None):
+    """
+    Atomically claims every reminder that is due and not yet claimed.
+
+    The claim is a single UPDATE, so two concurrent runs can never claim the
+    same row. Reminders whose appointment is no longer 'Scheduled' or already
+    started stay claimed but are not returned, which retires them. The caller
+    queues the emails and commits in the same transaction, so a claimed
+    reminder is never lost between the claim and the outbox.
+
+    Parameters:
+        partition (tuple): (index, count) to claim only that share of the
+                           appointments, see partitions.in_partition().
+
+    Returns:
+        list: Rows with schedule_id, appointment_id, appointment_datetime, name and email.
+    """
+    now = now or datetime.now()
+    token = uuid.uuid4().hex
+
+    claimed = session.query(ReminderSchedule).filter(
+        ReminderSchedule.claimed_at.is_(None),
+        ReminderSchedule.due_at <= now,
+        in_partition(ReminderSchedule.appointment_id, partition)
+    ).update(
+        {ReminderSchedule.claimed_at: now, ReminderSchedule.claim_token: token},
+        synchronize_session=False
+    )
+    if not claimed:
+        return []
+
+    return session.query(
+        ReminderSchedule.id.label('schedule_id'),
+        Appointment.id.label('appointment_id'),
+        Appointment.appointment_datetime,
+        Patient.name,
+        Patient.email
+    ).join(Appointment, Appointment.id == ReminderSchedule.appointment_id) \
+     .join(Patient, Patient.id == Appointment.patient_id) \
+     .filter(
+        ReminderSchedule.claim_token == token,
+        Appointment.status == 'Scheduled',
+        Appointment.appointment_datetime > now
+    ).all()
+
+
+def complete_reminders(session, sent_ids, sent_at=None):
+    """
+    Marks reminders as sent, i.e. queued in the outbox. The caller commits.
+
+    Claiming, queueing and completing happen in one transaction, so there
+    is nothing to release on failure: a rollback leaves the reminders
+    unclaimed, and failed deliveries are retried by the outbox.
+    """
+    sent_at = sent_at or datetime.now()
+    if sent_ids:
+        session.bulk_update_mappings(
+            ReminderSchedule, [{'id': schedule_id, 'sent_at': sent_at} for schedule_id in sent_ids]
+        )
+
+
+def backfill(session):
+    """
+    Creates reminder schedule rows for upcoming appointments that have none,
+    e.g. appointments booked before the schedule table existed.
+    """
+    scheduled = session.query(ReminderSchedule.appointment_id)
+    appointments = session.query(Appointment).filter(
+        Appointment.status == 'Scheduled',
+        Appointment.appointment_datetime > datetime.now(),
+        ~Appointment.id.in_(scheduled)
+    ).all()
+    schedule_reminders(session, appointments)
+    session.commit()
+    print(f"Reminder schedule backfilled for {len(appointments)} appointments.")
+
+
+if __name__ == "__main__":
+    from database import session_scope
+    with session_scope() as session:
+        backfill(session)
@@ -1,20 +1,31 @@
 # scheduler.py
 
 import os
+import time
 import logging
 from datetime import datetime, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from dotenv import load_dotenv
 
-from database import session
-from models import Appointment, User, Waitlist, FollowUp, FollowUpAdherence,Patient
-from notif import send_remainder, send_mail, send_email_with_attachment
+from database import engine, session_scope
+from models import Appointment, User, Waitlist, FollowUp, FollowUpAdherence,Patient,Reminder
+from notif import send_remainder, send_mail, render_reminder
+from outbox import enqueue, enqueue_many
 # from gcalender import add_event_to_calendar
-from waitlist import process_cancellation, add_to_waitlist
-from follow_up import *
+from waitlist import process_cancellation, add_to_waitlist, backfill_cancellations
+import follow_up
+from follow_up import generate_adherence_report, adherence_report_filename
 from utils import prioritize_waitlist
+from reminders import claim_due_reminders, complete_reminders
+from queries import appointments_with_people
+import calendar_sync
+import archive
+import metrics
+import partitions
+from leader import LeaderElection
 
 # Load environment variables from .env file
 load_dotenv()
@@ -26,89 +37,85 @@ logging.basicConfig(
     format='%(asctime)s %(levelname)s:%(message)s'
 )
 
+# Gzip the emailed adherence report
+ADHERENCE_REPORT_GZIP = os.getenv('ADHERENCE_REPORT_GZIP', 'false').lower() == 'true'
+
+# How often the reminder schedule is scanned; bounds how late a reminder can be
+REMINDER_SCAN_MINUTES = int(os.getenv('REMINDER_SCAN_MINUTES', 5))
+
+# Minutes between Google Calendar syncs, 0 disables the job (it needs token.pickle)
+CALENDAR_SYNC_MINUTES = int(os.getenv('CALENDAR_SYNC_MINUTES', 0))
+
+# Runs missed while no scheduler was up are caught up once if they are at most this late
+SCHEDULER_MISFIRE_GRACE_SECONDS = int(os.getenv('SCHEDULER_MISFIRE_GRACE_SECONDS', 3600))
+
 
 def start_scheduler():
     """
     Starts the background scheduler and adds scheduled jobs.
+
+    Kept for callers of the old name; see schedule_jobs().
     """
-    # Initialize the BackgroundScheduler
-    scheduler = BackgroundScheduler()
-    
-    # Schedule send_reminders to run every hour
-    scheduler.add_job(send_reminders, 'interval', hours=1)
-    
-    # Schedule generate_daily_summary to run daily at 6 PM
-    scheduler.add_job(generate_daily_summary, 'cron', hour=18, minute=0)
-    
-    # Schedule monitor_cancellations to run every 10 minutes
-    scheduler.add_job(monitor_cancellations, 'interval', minutes=10)
-    
-    # Schedule follow-up reminders to run daily at 9 AM
-    scheduler.add_job(send_followup_reminders, 'cron', hour=9, minute=0)
-    
-    # Schedule adherence report to run daily at 7 PM
-    scheduler.add_job(send_adherence_report, 'cron', hour=19, minute=0)
-    
-    # Start the scheduler
-    scheduler.start()
-    print("Scheduler started.")
+    return schedule_jobs()
 
 
+@metrics.job('send_adherence_report')
 def send_adherence_report():
-    # Generate the report
-    report_df = generate_adherence_report()
-    
-    if report_df.empty:
-        print("No adherence data to report.")
-        return
+    # Generate the report straight into a spooled buffer
+    report, rows = generate_adherence_report(compress=ADHERENCE_REPORT_GZIP)
     
-    # Convert DataFrame to CSV
-    report_csv = report_df.to_csv(index=False)
+    with report:
+        if not rows:
+            print("No adherence data to report.")
+            return 0
+        # The outbox stores the attachment in one BLOB and smtplib sends the
+        # whole message at once, so the report is read into memory here; set
+        # ADHERENCE_REPORT_GZIP to keep it small
+        attachment = (adherence_report_filename(ADHERENCE_REPORT_GZIP), report.read())
     
     # Define email parameters
     subject = f"Daily Follow-Up Adherence Report - {datetime.now().strftime('%Y-%m-%d')}"
     body = "Please find attached the daily follow-up adherence report."
     
-    # Save CSV to a temporary file
-    report_filename = f"adherence_report_{datetime.now().strftime('%Y%m%d')}.csv"
-    report_df.to_csv(report_filename, index=False)
-    
-    recipients = session.query(User).filter_by(role='Front Desk Medical Assistant').all()
-    
-    for user in recipients:
-        # Send the report as an email attachment
-        send_email_with_attachment(user.email, subject, body, report_filename)
-        print(f"Adherence report sent to {user.email}")
-    
+    # Queue the report for everyone; the outbox worker delivers it
+    with session_scope() as session:
+        recipients = session.query(User.email).filter_by(role='Front Desk Medical Assistant').all()
+        enqueue_many(session, [(user.email, subject, body) for user in recipients], attachment=attachment)
+    print(f"Adherence report queued for {len(recipients)} recipients.")
+    return rows
 
-    os.remove(report_filename)
 
 
+def send_reminders_partition(partition=None, now=None):
+    """
+    Claims and queues the due reminders of one partition of the appointments.
+    """
+    now = now or datetime.now()
+    
+    # Claim every reminder that has come due (T-24h, T-30m, ...) since the last run
+    # and queue its email in the same transaction. The claim is atomic, so
+    # overlapping runs never queue the same reminder twice.
+    with session_scope() as session:
+        due = claim_due_reminders(session, now, partition)
+        for row in due:
+            enqueue(
+                session,
+                *render_reminder(row.name, row.email, row.appointment_datetime),
+                kind='reminder',
+                appointment_id=row.appointment_id
+            )
+        complete_reminders(session, [row.schedule_id for row in due], now)
+    return len(due)
 
+
+@metrics.job('send_reminders')
 def send_reminders():
     logging.info("Starting send_reminders job.")
-    now = datetime.now()
-    reminder_time = now + timedelta(hours=24)
-    
-    # Fetch appointments scheduled for the next 24 hours with status 'Scheduled'
-    appointments = session.query(Appointment).join(User).join(Patient).filter(
-        Appointment.appointment_datetime >= reminder_time,
-        Appointment.appointment_datetime < reminder_time + timedelta(minutes=30),
-        Appointment.status == 'Scheduled'
-    ).all()
-    
-    logging.info(f"Found {len(appointments)} appointments to send reminders for.")
-    
-    for appt in appointments:
-        patient = appt.patient
-        subject = "Appointment Reminder"
-        body = f"Dear {patient.name},\n\nThis is a reminder for your appointment on {appt.appointment_datetime.strftime('%Y-%m-%d %H:%M')}.\n\nThank you."
-        
-        if send_remainder(patient.email, subject, body):
-            logging.info(f"Reminder sent to {patient.email} for appointment ID {appt.id}.")
-        else:
-            logging.error(f"Failed to send reminder to {patient.email} for appointment ID {appt.id}.")
+    report = partitions.run('send_reminders', send_reminders_partition, now=datetime.now())
+    logging.info(f"Queued {report.rows} due reminders. {report.summary()}")
+    return report.rows
 
+@metrics.job('generate_daily_summary')
 def generate_daily_summary():
     """
     Generates and sends a daily summary of scheduled appointments to General Practitioners.
@@ -116,130 +123,211 @@ def generate_daily_summary():
     logging.info("Starting generate_daily_summary job.")
     today = datetime.now().date()
     
-    # Fetch appointments for today with status 'Scheduled'
-    appointments = session.query(Appointment).join(User).join(Patient).filter(
-        Appointment.appointment_datetime >= datetime.combine(today, datetime.min.time()),
-        Appointment.appointment_datetime < datetime.combine(today, datetime.max.time()),
-        Appointment.status == 'Scheduled'
-    ).all()
-    
-    if not appointments:
-        logging.info("No appointments scheduled for today.")
-        return
-    
-    summary = "Daily Appointment Summary:\n\n"
-    for appt in appointments:
-        summary += f"Time: {appt.appointment_datetime.strftime('%H:%M')}, Patient: {appt.patient.name}, Practitioner: {appt.user.name}\n"
-    
-    # Fetch all General Practitioners
-    practitioners = session.query(User).filter_by(role='General Practitioner').all()
-    
-    logging.info(f"Sending daily summary to {len(practitioners)} practitioners.")
-    
-    for practitioner in practitioners:
-        subject = f"Daily Appointment Summary for {today.strftime('%Y-%m-%d')}"
-        body = summary
+    with session_scope() as session:
+        # Fetch appointments for today with status 'Scheduled'
+        appointments = appointments_with_people(session).filter(
+            Appointment.appointment_datetime >= datetime.combine(today, datetime.min.time()),
+            Appointment.appointment_datetime < datetime.combine(today, datetime.max.time()),
+            Appointment.status == 'Scheduled'
+        ).order_by(Appointment.appointment_datetime).all()
+        
+        if not appointments:
+            logging.info("No appointments scheduled for today.")
+            return 0
+        
+        summary = "Daily Appointment Summary:\n\n"
+        for appt in appointments:
+            summary += f"Time: {appt.appointment_datetime.strftime('%H:%M')}, Patient: {appt.patient.name}, Practitioner: {appt.user.name}\n"
         
-        if send_mail(practitioner.email, subject, body):
-            logging.info(f"Daily summary sent to {practitioner.email}.")
-        else:
-            logging.error(f"Failed to send daily summary to {practitioner.email}.")
+        # Fetch all General Practitioners
+        practitioners = session.query(User).filter_by(role='General Practitioner').all()
+        
+        subject = f"Daily Appointment Summary for {today.strftime('%Y-%m-%d')}"
+        enqueue_many(session, [(practitioner.email, subject, summary) for practitioner in practitioners])
+    
+    logging.info(f"Queued daily summary for {len(practitioners)} practitioners.")
+    return len(appointments)
 
+@metrics.job('monitor_cancellations')
 def monitor_cancellations():
     """
     Monitors canceled appointments and backfills them using the waitlist.
     """
     logging.info("Starting monitor_cancellations job.")
     
-    # Fetch appointments with status 'Cancelled'
-    canceled_appointments = session.query(Appointment).filter_by(status='Cancelled').all()
-    logging.info(f"Found {len(canceled_appointments)} canceled appointments to process.")
-    
-    for appt in canceled_appointments:
-        try:
-            process_cancellation(appt.id)
-            # Update appointment status to 'Processed' to avoid re-processing
-            appt.status = 'Processed'
-            session.commit()
-            logging.info(f"Processed cancellation for appointment ID {appt.id}.")
-        except Exception as e:
-            logging.error(f"Error processing cancellation for appointment ID {appt.id}: {e}")
+    # Each partition of slot times is matched, reassigned and notified in one
+    # query and one transaction; a failed partition is reported, not raised
+    report = partitions.run('monitor_cancellations', backfill_partition)
+    for failed in report.errors:
+        logging.error(f"Error backfilling cancellations: {failed['error']}")
+    logging.info(f"Reassigned {report.rows} canceled appointments from the waitlist. {report.summary()}")
+    return report.rows
 
+def backfill_partition(partition=None):
+    """
+    Backfills the cancelled slots of one partition of slot times.
+    """
+    with session_scope() as session:
+        return len(backfill_cancellations(session, partition))
+
+@metrics.job('send_followup_reminders')
 def send_followup_reminders():
     """
     Sends follow-up reminders to patients based on their scheduled follow-up tasks.
     """
     logging.info("Starting send_followup_reminders job.")
-    send_followup_reminders()
+    report = partitions.run('send_followup_reminders', follow_up.send_followup_reminders)
+    logging.info(f"Processed {report.rows} follow-up reminders. {report.summary()}")
+    return report.rows
+
+@metrics.job('sync_calendar')
+def sync_calendar():
+    """
+    Pushes changed appointments to Google Calendar and pulls remote edits back.
+    """
+    logging.info("Starting sync_calendar job.")
+    try:
+        pushed, pulled = calendar_sync.sync()
+    except Exception as e:
+        logging.error(f"Calendar sync failed: {e}")
+        metrics.record_failure(e)
+        return 0
+    logging.info(f"Calendar sync pushed {pushed} and pulled {pulled}.")
+    return sum(pushed.values()) + sum(pulled.values())
+
+@metrics.job('archive_old_rows')
+def archive_old_rows():
+    """
+    Moves appointments older than ARCHIVE_RETENTION_DAYS, with their reminders
+    and follow-ups, to the archive database.
+    """
+    logging.info("Starting archive_old_rows job.")
+    try:
+        moved = archive.archive_old_rows()
+    except Exception as e:
+        logging.error(f"Archiving failed: {e}")
+        metrics.record_failure(e)
+        return 0
+    logging.info(f"Archived {moved}.")
+    return sum(count for table, count in moved.items() if table in archive.TABLE_NAMES)
 
 def send_adherence_report_job():
     """
     Generates and sends adherence reports on patient follow-ups.
     """
     logging.info("Starting send_adherence_report_job.")
-    send_adherence_report()
+    return send_adherence_report()
+
+def job_definitions():
+    """
+    Returns the jobs as (id, function reference, trigger, name) tuples.
+
+    Functions are referenced as 'module:function' text so the persistent
+    job store can load them in any process.
+    """
+    jobs = [
+        # Scan for due reminders every few minutes
+        ('send_reminders', 'scheduler:send_reminders',
+         IntervalTrigger(minutes=REMINDER_SCAN_MINUTES), 'Send due appointment reminders'),
+        # Daily summary at 6 PM
+        ('generate_daily_summary', 'scheduler:generate_daily_summary',
+         CronTrigger(hour=18, minute=0), 'Generate daily appointment summary at 6 PM'),
+        # Backfill cancellations every 10 minutes
+        ('monitor_cancellations', 'scheduler:monitor_cancellations',
+         IntervalTrigger(minutes=10), 'Monitor and process appointment cancellations every 10 minutes'),
+        # Follow-up reminders at 9 AM
+        ('send_followup_reminders', 'scheduler:send_followup_reminders',
+         CronTrigger(hour=9, minute=0), 'Send follow-up reminders at 9 AM daily'),
+        # Adherence report at 7 PM
+        ('send_adherence_report', 'scheduler:send_adherence_report_job',
+         CronTrigger(hour=19, minute=0), 'Generate and send adherence reports at 7 PM daily'),
+    ]
+    # Push and pull only what changed in Google Calendar since the last run
+    if CALENDAR_SYNC_MINUTES:
+        jobs.append(('sync_calendar', 'scheduler:sync_calendar',
+                     IntervalTrigger(minutes=CALENDAR_SYNC_MINUTES), 'Sync appointments with Google Calendar'))
+    # Move old rows to the archive database at 2 AM, when nothing else runs
+    if archive.ARCHIVE_RETENTION_DAYS:
+        jobs.append(('archive_old_rows', 'scheduler:archive_old_rows',
+                     CronTrigger(hour=2, minute=0), 'Archive old appointments, reminders and follow-ups'))
+    return jobs
+
+
+def register_jobs(scheduler):
+    """
+    Brings the job store in line with job_definitions().
+
+    Jobs whose trigger did not change are left alone, so a run that was due
+    while no scheduler was up keeps its next_run_time and is caught up
+    (coalesced into one run) within SCHEDULER_MISFIRE_GRACE_SECONDS.
+    """
+    wanted = job_definitions()
+    for job_id, func, trigger, name in wanted:
+        existing = scheduler.get_job(job_id)
+        if existing is not None and existing.func_ref == func and str(existing.trigger) == str(trigger):
+            continue
+        scheduler.add_job(func, trigger=trigger, id=job_id, name=name, replace_existing=True)
+    for job in scheduler.get_jobs():
+        if job.id not in {job_id for job_id, _, _, _ in wanted}:
+            scheduler.remove_job(job.id)
+
 
 def schedule_jobs():
     """
     Initializes the scheduler and schedules all the necessary jobs.
+
+    Jobs live in the database (apscheduler_jobs) and every process that
+    calls this competes for the 'scheduler' lease. Only the leader's
+    scheduler runs jobs; the others stay paused and take over within about
+    SCHEDULER_LEASE_SECONDS if the leader stops renewing its lease.
+
+    Returns:
+        tuple: (BackgroundScheduler, LeaderElection).
     """
-    scheduler = BackgroundScheduler(timezone=os.getenv('TIMEZONE'))
-    
-    # Schedule send_reminders to run every hour
-    scheduler.add_job(
-        send_reminders,
-        trigger=IntervalTrigger(hours=1),
-        id='send_reminders',
-        name='Send appointment reminders every hour',
-        replace_existing=True
+    scheduler = BackgroundScheduler(
+        jobstores={'default': SQLAlchemyJobStore(engine=engine, tablename='apscheduler_jobs')},
+        job_defaults={
+            'coalesce': True,
+            'max_instances': 1,
+            'misfire_grace_time': SCHEDULER_MISFIRE_GRACE_SECONDS,
+        },
+        timezone=os.getenv('TIMEZONE')
     )
     
-    # Schedule generate_daily_summary to run daily at 6 PM
-    scheduler.add_job(
-        generate_daily_summary,
-        trigger=CronTrigger(hour=18, minute=0),
-        id='generate_daily_summary',
-        name='Generate daily appointment summary at 6 PM',
-        replace_existing=True
-    )
+    # Record misfires and export the job metrics after every run
+    metrics.attach(scheduler)
     
-    # Schedule monitor_cancellations to run every 10 minutes
-    scheduler.add_job(
-        monitor_cancellations,
-        trigger=IntervalTrigger(minutes=10),
-        id='monitor_cancellations',
-        name='Monitor and process appointment cancellations every 10 minutes',
-        replace_existing=True
-    )
+    # Start paused; the scheduler only runs jobs while this process holds the lease
+    scheduler.start(paused=True)
     
-    # Schedule send_followup_reminders to run daily at 9 AM
-    scheduler.add_job(
-        send_followup_reminders,
-        trigger=CronTrigger(hour=9, minute=0),
-        id='send_followup_reminders',
-        name='Send follow-up reminders at 9 AM daily',
-        replace_existing=True
-    )
+    def on_elected():
+        register_jobs(scheduler)
+        scheduler.resume()
+        logging.info("Elected scheduler leader, jobs resumed.")
     
-    # Schedule send_adherence_report to run daily at 7 PM
-    scheduler.add_job(
-        send_adherence_report_job,
-        trigger=CronTrigger(hour=19, minute=0),
-        id='send_adherence_report',
-        name='Generate and send adherence reports at 7 PM daily',
-        replace_existing=True
-    )
+    def on_demoted():
+        # Stops new runs only; a job already running finishes (see leader.py)
+        scheduler.pause()
+        logging.warning("No longer the scheduler leader, jobs paused.")
     
-    # Start the scheduler
-    scheduler.start()
-    logging.info("Scheduler started and all jobs have been scheduled.")
+    election = LeaderElection('scheduler', on_elected, on_demoted)
+    election.start()
+    logging.info(f"Scheduler started as {election.holder}, waiting for the lease.")
+    return scheduler, election
 
 def main():
     """
     Main function to start the scheduler.
     """
     logging.info("Initializing scheduler.")
-    schedule_jobs()
+    scheduler, election = schedule_jobs()
+    try:
+        while True:
+            time.sleep(1)
+    except (KeyboardInterrupt, SystemExit):
+        # Hand the lease over straight away instead of letting it expire
+        election.stop()
+        scheduler.shutdown()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,207 @@
+# seed_data.py
+"""
+Reproducible synthetic data for benchmarks and local testing.
+
+The same size and seed always produce the same rows (relative to `now`):
+practitioners and front desk staff, patients, appointments spread over the
+last and next 30 days, cancelled slots with matching waitlist entries,
+follow-ups with adherence records, the reminder schedule and the adherence
+rollup.
+
+Usage:
+    python seed_data.py 10000 [--seed 42] [--force]
+
+The size is the number of appointments; the other tables scale with it.
+Rows go into the database configured by DB_URL.
+"""
+
+import sys
+import random
+import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+from models import (
+    User, Patient, Appointment, Waitlist, FollowUp, FollowUpAdherence, ReminderSchedule
+)
+from reminders import REMINDER_OFFSETS
+import adherence_rollup
+
+SEED_CHUNK_SIZE = 10000
+FOLLOWUP_TYPES = ['Prescription Refill', 'Lab Results Review', 'Physical Therapy', 'Check-Up Call']
+
+
+def volumes(size):
+    """
+    Returns the number of rows per table for `size` appointments.
+    """
+    return {
+        'practitioners': max(5, size // 1000),
+        'front_desk': max(2, size // 5000),
+        'patients': max(10, size // 2),
+        'appointments': size,
+        'waitlist': max(5, size // 10),
+        'followups': max(5, size // 4),
+    }
+
+
+def insert_chunked(session, model, rows):
+    for start in range(0, len(rows), SEED_CHUNK_SIZE):
+        session.bulk_insert_mappings(model, rows[start:start + SEED_CHUNK_SIZE])
+
+
+def next_id(session, model):
+    used = session.query(func.max(model.id)).scalar() or 0
+    if model.__table__.dialect_options['sqlite']['autoincrement'] and session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'")).first():
+        # Ids handed out before, including those of archived rows
+        sequence = session.execute(text("SELECT seq FROM sqlite_sequence WHERE name = :name"),
+                                   {'name': model.__tablename__}).scalar()
+        used = max(used, sequence or 0)
+    return used + 1
+
+
+def seed(bind, size, seed=42, now=None):
+    """
+    Inserts a synthetic data set of `size` appointments and commits it.
+
+    Parameters:
+        bind (Engine): Database to fill.
+        size (int): Number of appointments.
+        seed (int): Random seed; the same seed gives the same data.
+        now (datetime): Reference time, defaults to datetime.now().
+
+    Returns:
+        dict: Number of rows inserted per table.
+    """
+    rng = random.Random(seed)
+    now = (now or datetime.now()).replace(second=0, microsecond=0)
+    counts = volumes(size)
+
+    def slot(days_before, days_after):
+        # A quarter-hour slot during clinic hours
+        day = now.date() + timedelta(days=rng.randint(-days_before, days_after))
+        return datetime.combine(day, datetime.min.time()) + timedelta(hours=9, minutes=15 * rng.randrange(32))
+
+    with Session(bind=bind) as session:
+        user_id = next_id(session, User)
+        practitioners = list(range(user_id, user_id + counts['practitioners']))
+        users = [
+            {'id': uid, 'name': f"Dr. Practitioner {uid}", 'role': 'General Practitioner',
+             'email': f"practitioner{uid}@clinic.example"}
+            for uid in practitioners
+        ]
+        users += [
+            {'id': uid, 'name': f"Front Desk {uid}", 'role': 'Front Desk Medical Assistant',
+             'email': f"frontdesk{uid}@clinic.example"}
+            for uid in range(practitioners[-1] + 1, practitioners[-1] + 1 + counts['front_desk'])
+        ]
+        insert_chunked(session, User, users)
+
+        patient_id = next_id(session, Patient)
+        patients = list(range(patient_id, patient_id + counts['patients']))
+        insert_chunked(session, Patient, [
+            {'id': pid, 'name': f"Patient {pid}", 'email': f"patient{pid}@mail.example",
+             'phone_number': f"555-{pid:07d}", 'email_verified': rng.random() < 0.8}
+            for pid in patients
+        ])
+
+        # Appointments and their reminder schedule are generated and written one
+        # chunk at a time so a million-row seed does not hold every row in memory
+        appointment_id = next_id(session, Appointment)
+        cancelled = []
+        completed = []
+        scheduled = 0
+        for chunk_start in range(0, counts['appointments'], SEED_CHUNK_SIZE):
+            appointments = []
+            schedule = []
+            first = appointment_id + chunk_start
+            for aid in range(first, first + min(SEED_CHUNK_SIZE, counts['appointments'] - chunk_start)):
+                start = slot(30, 30)
+                if start < now:
+                    status = 'Completed' if rng.random() < 0.9 else 'Processed'
+                else:
+                    status = 'Scheduled' if rng.random() < 0.95 else 'Cancelled'
+                appointments.append({
+                    'id': aid,
+                    'patient_id': rng.choice(patients),
+                    'user_id': rng.choice(practitioners),
+                    'appointment_datetime': start,
+                    'status': status,
+                    'updated_at': now,
+                })
+                if status == 'Scheduled':
+                    schedule += [
+                        {'appointment_id': aid, 'offset_minutes': offset,
+                         'due_at': start - timedelta(minutes=offset)}
+                        for offset in REMINDER_OFFSETS
+                    ]
+                elif status == 'Cancelled':
+                    cancelled.append(start)
+                elif status == 'Completed':
+                    completed.append((aid, start))
+            session.bulk_insert_mappings(Appointment, appointments)
+            session.bulk_insert_mappings(ReminderSchedule, schedule)
+            scheduled += len(schedule)
+            session.commit()
+
+        # Half of the waitlist asks for a cancelled slot, the rest for any future slot
+        waitlist = []
+        for _ in range(counts['waitlist']):
+            requested = rng.choice(cancelled) if cancelled and rng.random() < 0.5 else slot(0, 30)
+            waitlist.append({
+                'patient_id': rng.choice(patients),
+                'requested_datetime': requested,
+                'added_at': now - timedelta(minutes=rng.randint(1, 30 * 24 * 60)),
+                'priority': rng.randint(1, 100),
+            })
+        insert_chunked(session, Waitlist, waitlist)
+
+        followup_id = next_id(session, FollowUp)
+        followups = []
+        adherence = []
+        for fid in range(followup_id, followup_id + (counts['followups'] if completed else 0)):
+            aid, appointment_datetime = rng.choice(completed)
+            due = appointment_datetime + timedelta(days=rng.randint(0, 14))
+            done = due < now and rng.random() < 0.7
+            completed_at = due + timedelta(hours=rng.randint(-48, 72)) if done else None
+            followups.append({
+                'id': fid,
+                'appointment_id': aid,
+                'followup_type': rng.choice(FOLLOWUP_TYPES),
+                'due_date': due,
+                'status': 'Completed' if done else 'Pending',
+            })
+            adherence.append({'followup_id': fid, 'completed': done, 'completed_at': completed_at})
+        insert_chunked(session, FollowUp, followups)
+        insert_chunked(session, FollowUpAdherence, adherence)
+
+        adherence_rollup.rebuild(session)
+        session.commit()
+
+    return {
+        'users': len(users),
+        'patients': len(patients),
+        'appointments': counts['appointments'],
+        'reminder_schedule': scheduled,
+        'waitlist': len(waitlist),
+        'followups': len(followups),
+    }
+
+
+if __name__ == "__main__":
+    from database import engine
+    from models import Base
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('size', type=int, help="Number of appointments")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--force', action='store_true', help="Add to a database that already has patients")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    with Session(bind=engine) as session:
+        if session.query(Patient.id).first() is not None and not args.force:
+            print("The database already has patients; use --force to add synthetic data anyway.")
+            sys.exit(1)
+    print(seed(engine, args.size, args.seed))
@@ -0,0 +1,265 @@
+# slots.py
+"""
+In-memory availability index for practitioners.
+
+Each practitioner's upcoming 'Scheduled' appointments are kept as a sorted
+list of start times. Every appointment lasts APPOINTMENT_MINUTES, so a new
+booking [t, t + d) conflicts exactly when some start lies in
+(t - APPOINTMENT_MINUTES, t + d), which is one binary search.
+
+The index is built once per process and kept current in two ways. The
+app's own writers update it as soon as they commit: booking calls add(),
+the manual cancel form remove(), and process_cancellation() apply() with
+the slot's new status. Everything else, such as the scheduler's
+cancellation backfill and appointments moved by the calendar sync, is
+picked up by get_index(), which re-reads appointments whose updated_at
+moved past the last refresh at most every SLOT_REFRESH_SECONDS.
+
+The index can therefore be a moment behind other processes, so it only
+answers the fast questions (is this slot free, which one is next). The
+booking itself is checked with booking_conflict() against the database,
+in the transaction that inserts it.
+"""
+
+import os
+import time
+import threading
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from database import session_scope
+from models import Appointment, User
+
+APPOINTMENT_MINUTES = int(os.getenv('APPOINTMENT_MINUTES', 60))
+CLINIC_OPEN = datetime.strptime(os.getenv('CLINIC_OPEN', '09:00'), '%H:%M').time()
+CLINIC_CLOSE = datetime.strptime(os.getenv('CLINIC_CLOSE', '17:00'), '%H:%M').time()
+# next_available gives up after this many days
+SLOT_SEARCH_DAYS = int(os.getenv('SLOT_SEARCH_DAYS', 90))
+SLOT_REFRESH_SECONDS = float(os.getenv('SLOT_REFRESH_SECONDS', 5))
+
+_LAST = float('inf')  # sorts after every appointment id in (start, id) keys
+
+
+class SlotIndex:
+    """
+    Sorted booked intervals per practitioner (user id).
+    """
+
+    def __init__(self, duration=APPOINTMENT_MINUTES):
+        self.length = timedelta(minutes=duration)
+        self.practitioners = set()
+        self._starts = {}  # user_id -> sorted [(start, appointment_id)]
+        self._booked = {}  # appointment_id -> (user_id, start)
+        self._lock = threading.RLock()
+        self.refreshed_at = None  # updated_at watermark of the last load
+        self.checked = 0.0
+
+    def add(self, appointment_id, user_id, start):
+        """
+        Records a booked appointment, replacing its previous slot if it moved.
+        """
+        with self._lock:
+            self.remove(appointment_id)
+            insort(self._starts.setdefault(user_id, []), (start, appointment_id))
+            self._booked[appointment_id] = (user_id, start)
+
+    def remove(self, appointment_id):
+        """
+        Frees the slot of a cancelled, moved or finished appointment.
+        """
+        with self._lock:
+            booked = self._booked.pop(appointment_id, None)
+            if booked is None:
+                return
+            user_id, start = booked
+            starts = self._starts[user_id]
+            del starts[bisect_left(starts, (start, appointment_id))]
+
+    def apply(self, appointment_id, user_id, start, status):
+        if status == 'Scheduled':
+            self.add(appointment_id, user_id, start)
+        else:
+            self.remove(appointment_id)
+
+    def _conflict(self, user_id, start, length, ignore=None):
+        """
+        Returns the start of the first booking overlapping [start, start + length), or None.
+        """
+        starts = self._starts.get(user_id, ())
+        i = bisect_right(starts, (start - self.length, _LAST))
+        while i < len(starts) and starts[i][0] < start + length:
+            if starts[i][1] != ignore:
+                return starts[i][0]
+            i += 1
+        return None
+
+    def is_free(self, user_id, start, duration=None, ignore=None):
+        """
+        Returns True if the practitioner has no booking overlapping the slot.
+
+        Parameters:
+            user_id (int): Practitioner.
+            start (datetime): Start of the slot.
+            duration (int): Length in minutes, defaults to APPOINTMENT_MINUTES.
+            ignore (int): Appointment id to disregard, e.g. the one being moved.
+        """
+        length = timedelta(minutes=duration) if duration else self.length
+        with self._lock:
+            return self._conflict(user_id, start, length, ignore) is None
+
+    def next_available(self, user_id, after, duration=None):
+        """
+        Returns the earliest start at or after `after` within clinic hours
+        where the practitioner is free, or None within SLOT_SEARCH_DAYS.
+        """
+        length = timedelta(minutes=duration) if duration else self.length
+        limit = after + timedelta(days=SLOT_SEARCH_DAYS)
+        candidate = after
+        with self._lock:
+            while candidate < limit:
+                day_open = datetime.combine(candidate.date(), CLINIC_OPEN)
+                day_close = datetime.combine(candidate.date(), CLINIC_CLOSE)
+                if candidate < day_open:
+                    candidate = day_open
+                if candidate + length > day_close:
+                    candidate = day_open + timedelta(days=1)
+                    continue
+                booked = self._conflict(user_id, candidate, length)
+                if booked is None:
+                    return candidate
+                # Jump to the end of the booking in the way
+                candidate = booked + self.length
+        return None
+
+    def free_slots(self, day, user_id=None, duration=None):
+        """
+        Lists the free gaps of at least `duration` minutes within clinic hours on `day`.
+
+        Returns:
+            dict: {user_id: [(start, end), ...]} for every known practitioner,
+            or just the list when `user_id` is given.
+        """
+        length = timedelta(minutes=duration) if duration else self.length
+        day_open = datetime.combine(day, CLINIC_OPEN)
+        day_close = datetime.combine(day, CLINIC_CLOSE)
+        with self._lock:
+            user_ids = [user_id] if user_id is not None else sorted(self.practitioners | set(self._starts))
+            result = {}
+            for uid in user_ids:
+                starts = self._starts.get(uid, ())
+                i = bisect_right(starts, (day_open - self.length, _LAST))
+                gaps = []
+                cursor = day_open
+                while i < len(starts) and starts[i][0] < day_close:
+                    booked = starts[i][0]
+                    if booked - cursor >= length:
+                        gaps.append((cursor, booked))
+                    cursor = max(cursor, booked + self.length)
+                    i += 1
+                if day_close - cursor >= length:
+                    gaps.append((cursor, day_close))
+                result[uid] = gaps
+        return result if user_id is None else result[user_id]
+
+    def load(self, session, now=None):
+        """
+        (Re)builds the index from the practitioners and upcoming scheduled appointments.
+        """
+        now = now or datetime.now()
+        rows = session.query(
+            Appointment.id,
+            Appointment.user_id,
+            Appointment.appointment_datetime,
+            Appointment.updated_at
+        ).filter(
+            Appointment.status == 'Scheduled',
+            Appointment.appointment_datetime > now - self.length
+        ).all()
+        practitioners = session.query(User.id).filter_by(role='General Practitioner').all()
+        with self._lock:
+            self._starts = {}
+            self._booked = {}
+            self.practitioners = {row.id for row in practitioners}
+            for row in sorted(rows, key=lambda row: (row.appointment_datetime, row.id)):
+                self._starts.setdefault(row.user_id, []).append((row.appointment_datetime, row.id))
+                self._booked[row.id] = (row.user_id, row.appointment_datetime)
+            self.refreshed_at = session.query(func.max(Appointment.updated_at)).scalar()
+            self.checked = time.monotonic()
+
+    def refresh(self, session, now=None):
+        """
+        Applies appointments changed since the last load or refresh.
+        """
+        now = now or datetime.now()
+        query = session.query(
+            Appointment.id,
+            Appointment.user_id,
+            Appointment.appointment_datetime,
+            Appointment.status,
+            Appointment.updated_at
+        ).filter(Appointment.updated_at.isnot(None))
+        if self.refreshed_at is not None:
+            # >= so rows sharing the watermark's timestamp are not missed; applying is idempotent
+            query = query.filter(Appointment.updated_at >= self.refreshed_at)
+        rows = query.all()
+        practitioners = session.query(User.id).filter_by(role='General Practitioner').all()
+        with self._lock:
+            self.practitioners = {row.id for row in practitioners}
+            for row in rows:
+                # Appointments that are already over no longer occupy a slot
+                status = row.status if row.appointment_datetime > now - self.length else 'Past'
+                self.apply(row.id, row.user_id, row.appointment_datetime, status)
+                if self.refreshed_at is None or row.updated_at > self.refreshed_at:
+                    self.refreshed_at = row.updated_at
+            self.checked = time.monotonic()
+        return len(rows)
+
+
+def booking_conflict(session, user_id, start, duration=None, ignore=None):
+    """
+    Returns the start of a scheduled appointment in the database that
+    overlaps the slot, or None.
+
+    Run it after inserting the booking, in the same transaction: the insert
+    takes SQLite's write lock, so a concurrent booking of the same slot is
+    either already committed and found here, or waits for this one and
+    finds it in turn.
+
+    Parameters:
+        user_id (int): Practitioner.
+        start (datetime): Start of the slot.
+        duration (int): Length in minutes, defaults to APPOINTMENT_MINUTES.
+        ignore (int): Appointment id to disregard, i.e. the one just inserted.
+    """
+    length = timedelta(minutes=duration or APPOINTMENT_MINUTES)
+    query = session.query(Appointment.appointment_datetime).filter(
+        Appointment.user_id == user_id,
+        Appointment.status == 'Scheduled',
+        Appointment.appointment_datetime > start - timedelta(minutes=APPOINTMENT_MINUTES),
+        Appointment.appointment_datetime < start + length
+    )
+    if ignore is not None:
+        query = query.filter(Appointment.id != ignore)
+    return query.order_by(Appointment.appointment_datetime).limit(1).scalar()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Returns the process-wide SlotIndex, built on first use and refreshed
+    from the database at most every SLOT_REFRESH_SECONDS.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            index = SlotIndex()
+            with session_scope() as session:
+                index.load(session)
+            _index = index
+        elif time.monotonic() - _index.checked > SLOT_REFRESH_SECONDS:
+            with session_scope() as session:
+                _index.refresh(session)
+        return _index
@@ -0,0 +1,164 @@
+# test_calendar_sync.py
+"""
+Push and pull between appointments and the calendar, against FakeCalendarAPI.
+
+Runs against the throwaway database set up in conftest.py:
+    python -m pytest -q test_calendar_sync.py
+"""
+
+from datetime import datetime, timedelta
+import pytest
+from database import session_scope
+from models import User, Patient, Appointment, CalendarEvent, CalendarSyncFailure
+import calendar_sync
+from calendar_sync import FakeCalendarAPI, push_changes, pull_changes
+
+START = datetime(2026, 3, 2, 9, 0)
+
+
+@pytest.fixture
+def api(empty_db):
+    return FakeCalendarAPI()
+
+
+def seed(count, updated_at=START):
+    """
+    Adds `count` scheduled appointments, all changed at `updated_at`, and returns their ids.
+    """
+    with session_scope() as session:
+        practitioner = User(name="Dr Sync", role='General Practitioner', email="gp@example.com")
+        session.add(practitioner)
+        session.flush()
+        appointments = []
+        for i in range(count):
+            patient = Patient(name=f"Patient {i}", email=f"patient{i}@example.com")
+            session.add(patient)
+            session.flush()
+            appointments.append(Appointment(
+                patient_id=patient.id,
+                user_id=practitioner.id,
+                appointment_datetime=START + timedelta(days=1, minutes=15 * i),
+                status='Scheduled',
+                updated_at=updated_at
+            ))
+        session.add_all(appointments)
+        session.flush()
+        return [appt.id for appt in appointments]
+
+
+def change(appointment_id, updated_at, **values):
+    with session_scope() as session:
+        appt = session.get(Appointment, appointment_id)
+        for name, value in values.items():
+            setattr(appt, name, value)
+        appt.updated_at = updated_at
+
+
+def event_id(appointment_id):
+    with session_scope() as session:
+        mapping = session.query(CalendarEvent).filter_by(appointment_id=appointment_id).first()
+        return mapping and mapping.event_id
+
+
+def failure(appointment_id):
+    with session_scope() as session:
+        row = session.get(CalendarSyncFailure, appointment_id)
+        return row and (row.attempts, row.next_attempt_at)
+
+
+def test_push_inserts_updates_and_deletes(api):
+    first, second, third = seed(3)
+    now = START + timedelta(minutes=1)
+    assert push_changes(api, now) == {'inserted': 3, 'updated': 0, 'deleted': 0, 'failed': 0}
+    assert len(api.events) == 3
+
+    later = now + timedelta(minutes=1)
+    change(first, later, appointment_datetime=START + timedelta(days=2))
+    change(second, later, status='Cancelled')
+    assert push_changes(api, later + timedelta(minutes=1)) == {'inserted': 0, 'updated': 1, 'deleted': 1, 'failed': 0}
+    assert api.events[event_id(first)]['start']['dateTime'] == (START + timedelta(days=2)).isoformat()
+    assert event_id(second) is None
+    assert event_id(third) in api.events
+
+
+def test_watermark_resumes_among_shared_updated_at(api, monkeypatch):
+    ids = seed(5)
+    monkeypatch.setattr(calendar_sync, 'CALENDAR_SYNC_LIMIT', 2)
+    inserted = [push_changes(api, START + timedelta(minutes=run))['inserted'] for run in range(1, 5)]
+    assert inserted == [2, 2, 1, 0]
+    assert all(event_id(appointment_id) for appointment_id in ids)
+
+
+def test_permanent_failure_does_not_hold_back_the_rest(api, monkeypatch):
+    monkeypatch.setattr(calendar_sync, 'CALENDAR_SYNC_LIMIT', 2)
+    bad, *rest = seed(4)
+    api.errors[bad] = 400
+    now = START + timedelta(minutes=1)
+    assert push_changes(api, now)['failed'] == 1
+    assert failure(bad) == (1, None)
+
+    # The watermark moved past it and it is not retried on its own
+    assert push_changes(api, now + timedelta(minutes=1))['inserted'] == 2
+    assert push_changes(api, now + timedelta(days=1))['inserted'] == 0
+    assert all(event_id(appointment_id) for appointment_id in rest)
+
+    # Until the appointment changes again
+    del api.errors[bad]
+    change(bad, now + timedelta(days=1), appointment_datetime=START + timedelta(days=3))
+    assert push_changes(api, now + timedelta(days=1, minutes=1))['inserted'] == 1
+    assert event_id(bad) and failure(bad) is None
+
+
+def test_transient_failure_is_retried_with_backoff(api):
+    flaky, other = seed(2)
+    api.errors[flaky] = 503
+    now = START + timedelta(minutes=1)
+    assert push_changes(api, now) == {'inserted': 1, 'updated': 0, 'deleted': 0, 'failed': 1}
+    assert failure(flaky) == (1, now + timedelta(minutes=calendar_sync.CALENDAR_RETRY_MINUTES))
+
+    # Not due yet, and the watermark is past it
+    calls = api.calls
+    assert push_changes(api, now + timedelta(minutes=1))['failed'] == 0
+    assert api.calls == calls
+
+    assert push_changes(api, now + timedelta(minutes=calendar_sync.CALENDAR_RETRY_MINUTES))['failed'] == 1
+    assert failure(flaky)[0] == 2
+
+    del api.errors[flaky]
+    assert push_changes(api, now + timedelta(hours=1))['inserted'] == 1
+    assert event_id(flaky) and failure(flaky) is None
+
+
+def test_update_of_an_event_deleted_in_the_calendar_inserts_a_new_one(api):
+    (appointment_id,) = seed(1)
+    now = START + timedelta(minutes=1)
+    push_changes(api, now)
+    old_event = event_id(appointment_id)
+    api.events.pop(old_event)
+
+    change(appointment_id, now + timedelta(minutes=1), appointment_datetime=START + timedelta(days=2))
+    assert push_changes(api, now + timedelta(minutes=2))['failed'] == 1
+    assert event_id(appointment_id) is None
+
+    assert push_changes(api, now + timedelta(hours=1))['inserted'] == 1
+    assert event_id(appointment_id) not in (None, old_event)
+
+
+def test_pull_moves_and_cancels_appointments(api):
+    moved, cancelled = seed(2)
+    now = START + timedelta(minutes=1)
+    push_changes(api, now)
+    new_start = START + timedelta(days=5)
+    api.remote_update(event_id(moved), new_start)
+    api.remote_cancel(event_id(cancelled))
+
+    later = now + timedelta(minutes=1)
+    assert pull_changes(api, later) == {'moved': 1, 'cancelled': 1}
+    with session_scope() as session:
+        assert session.get(Appointment, moved).appointment_datetime == new_start
+        assert session.get(Appointment, cancelled).status == 'Cancelled'
+    assert event_id(cancelled) is None
+
+    # Nothing pulled is pushed back, and the sync token skips seen changes
+    assert push_changes(api, later + timedelta(minutes=1)) == {'inserted': 0, 'updated': 0, 'deleted': 0, 'failed': 0}
+    assert pull_changes(api, later + timedelta(minutes=2)) == {'moved': 0, 'cancelled': 0}
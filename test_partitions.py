@@ -0,0 +1,58 @@
+# test_partitions.py
+"""
+Sharding by slot time must spread seeded appointments over every
+partition, and a worker process that dies must be reported as a failed
+partition instead of failing the run.
+
+Runs against the throwaway database set up in conftest.py:
+    python -m pytest -q test_partitions.py
+"""
+
+import os
+from sqlalchemy import func
+from database import session_scope
+from models import Appointment
+from partitions import in_partition
+import partitions
+import seed_data
+
+
+def partition_sizes(count, *conditions):
+    column = Appointment.appointment_datetime
+    with session_scope() as session:
+        return [
+            session.query(func.count(Appointment.id)).filter(in_partition(column, (index, count)), *conditions).scalar()
+            for index in range(count)
+        ]
+
+
+def test_slot_times_spread_over_all_partitions(empty_db):
+    seed_data.seed(empty_db, 2000)
+    total = 2000
+    on_the_hour = func.strftime('%M', Appointment.appointment_datetime) == '00'
+    with session_scope() as session:
+        hourly = session.query(func.count(Appointment.id)).filter(on_the_hour).scalar()
+    for count in (2, 3, 4, 8):
+        sizes = partition_sizes(count)
+        assert sum(sizes) == total
+        assert min(sizes) > total / count / 2, (count, sizes)
+        # Hourly slots alone are a multiple of four quarter hours apart
+        sizes = partition_sizes(count, on_the_hour)
+        assert sum(sizes) == hourly
+        assert min(sizes) > hourly / count / 2, (count, sizes)
+
+
+def exit_in_partition(partition):
+    if partition[0] == 1:
+        os._exit(1)
+    return 1
+
+
+def test_dead_worker_is_reported_as_a_failed_partition():
+    report = partitions.run('test', exit_in_partition, count=2, workers=2)
+    assert report.errors
+    assert all(part['error'] is None or 'BrokenProcessPool' in part['error'] for part in report.partitions)
+
+    # The broken pool is replaced on the next run
+    report = partitions.run('test', exit_in_partition, count=1, workers=1)
+    assert report.rows == 1 and not report.errors
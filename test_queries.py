@@ -0,0 +1,71 @@
+# test_queries.py
+"""
+The appointment read paths must run a fixed number of statements, however
+many appointments they return (no N+1 over patient or practitioner).
+
+Runs against the throwaway database set up in conftest.py:
+    python -m pytest -q test_queries.py
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from sqlalchemy import event
+from database import session_scope
+from models import User, Patient, Appointment, OutboxMessage
+from queries import cancelled_appointments
+import scheduler
+
+
+@contextmanager
+def count_statements(engine):
+    counter = {'statements': 0}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter['statements'] += 1
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def seed_today(count):
+    """
+    Replaces all appointments with `count` scheduled and `count` cancelled
+    ones for today, each with its own patient.
+    """
+    start = datetime.combine(datetime.now().date(), time(8, 0))
+    with session_scope() as session:
+        for model in (OutboxMessage, Appointment, Patient, User):
+            session.query(model).delete()
+        practitioners = [
+            User(name=f"Dr {i}", role='General Practitioner', email=f"gp{i}@example.com") for i in range(2)
+        ]
+        session.add_all(practitioners)
+        session.flush()
+        for i in range(2 * count):
+            patient = Patient(name=f"Patient {i}", email=f"patient{i}@example.com")
+            session.add(patient)
+            session.flush()
+            session.add(Appointment(
+                patient_id=patient.id,
+                user_id=practitioners[i % 2].id,
+                appointment_datetime=start + timedelta(minutes=5 * i),
+                status='Scheduled' if i < count else 'Cancelled'
+            ))
+
+
+def statements_for(engine, count):
+    seed_today(count)
+    with count_statements(engine) as counter:
+        summarized = scheduler.generate_daily_summary()
+        with session_scope() as session:
+            cancelled = cancelled_appointments(session)
+    assert summarized == count
+    assert len(cancelled) == count
+    return counter['statements']
+
+
+def test_query_count_is_independent_of_row_count(engine):
+    assert statements_for(engine, 3) == statements_for(engine, 30)
@@ -0,0 +1,55 @@
+# test_slots.py
+"""
+Two bookings of the same slot racing each other: the SlotIndex of both
+says the slot is free, so booking_conflict() has to catch the second one.
+
+Runs against the throwaway database set up in conftest.py:
+    python -m pytest -q test_slots.py
+"""
+
+import threading
+from datetime import datetime, timedelta
+from database import session_scope
+from models import User, Patient, Appointment
+from slots import SlotIndex, booking_conflict
+
+START = datetime(2026, 3, 2, 10, 0)
+
+
+def test_concurrent_bookings_of_one_slot(empty_db):
+    with session_scope() as session:
+        practitioner = User(name="Dr Race", role='General Practitioner', email="race@example.com")
+        patients = [Patient(name=f"Patient {i}", email=f"race{i}@example.com") for i in range(2)]
+        session.add_all([practitioner, *patients])
+        session.flush()
+        user_id, patient_ids = practitioner.id, [patient.id for patient in patients]
+        index = SlotIndex()
+        index.load(session, now=START - timedelta(days=1))
+    assert index.is_free(user_id, START)
+
+    first_inserted = threading.Event()
+    results = {}
+
+    def book(name, patient_id, start, hold=0.0):
+        with session_scope() as session:
+            appt = Appointment(patient_id=patient_id, user_id=user_id, appointment_datetime=start, status='Scheduled')
+            session.add(appt)
+            session.flush()
+            results[name] = booking_conflict(session, user_id, start, ignore=appt.id)
+            if results[name] is not None:
+                session.rollback()
+            if hold:
+                first_inserted.set()
+                threading.Event().wait(hold)
+
+    first = threading.Thread(target=book, args=('first', patient_ids[0], START, 0.3))
+    first.start()
+    first_inserted.wait()
+    # Overlaps the first booking by half an hour, and waits for its commit
+    book('second', patient_ids[1], START + timedelta(minutes=30))
+    first.join()
+
+    assert results == {'first': None, 'second': START}
+    with session_scope() as session:
+        assert session.query(Appointment).count() == 1
+        assert booking_conflict(session, user_id, START + timedelta(minutes=60)) is None
@@ -1,6 +1,5 @@
 import logging
 import os
-from database import session
 from models import Waitlist
 from datetime import datetime
 
@@ -14,20 +13,23 @@ def setup_logging():
         format='%(asctime)s:%(levelname)s:%(message)s'
     )
 
-def prioritize_waitlist(requested_datetime):
+def prioritize_waitlist(session, requested_datetime=None):
     """
     Prioritizes the waitlist and returns the next patient to assign the open slot.
     
     Parameters:
+        session (Session): Session of the calling unit of work.
         requested_datetime (datetime): The datetime of the open appointment slot.
+            If omitted, the next patient across the whole waitlist is returned.
         
     Returns:
         Waitlist: The selected waitlist entry or None if waitlist is empty.
     """
     # Fetch waitlist entries matching the requested_datetime, ordered by priority and added_at
-    waitlist_entry = session.query(Waitlist).filter_by(
-        requested_datetime=requested_datetime
-    ).order_by(
+    query = session.query(Waitlist)
+    if requested_datetime is not None:
+        query = query.filter_by(requested_datetime=requested_datetime)
+    waitlist_entry = query.order_by(
         Waitlist.priority.asc(),
         Waitlist.added_at.asc()
     ).first()
@@ -1,11 +1,13 @@
 # waitlist.py (Modify add_to_waitlist to include urgency)
 
-from database import session
+from sqlalchemy import select, func, and_
+from database import session_scope
 from models import Waitlist, Patient, Appointment
 from datetime import datetime
 from utils import prioritize_waitlist
-from hunterIo import verify
-from notif import send_mail
+from outbox import enqueue
+from reminders import schedule_reminders
+from partitions import in_partition
 
 def add_to_waitlist(patient_id, requested_datetime, urgency=1):
     # Create a new Waitlist entry with priority
@@ -15,39 +17,172 @@ def add_to_waitlist(patient_id, requested_datetime, urgency=1):
         added_at=datetime.now(),
         priority=urgency
     )
-    # Add to session and commit to save in the database
-    session.add(waitlist_entry)
-    session.commit()
+    # Add to its own unit of work, committed when the scope closes
+    with session_scope() as session:
+        session.add(waitlist_entry)
     print(f"Patient ID {patient_id} added to waitlist for {requested_datetime} with priority {urgency}")
+    return True
 
-def process_cancellation(appointment_id):
-    # Fetch the canceled appointment
-    appointment = session.query(Appointment).filter_by(id=appointment_id).first()
-    if not appointment:
-        print("Appointment not found.")
-        return
-    
-    # Update the appointment status to 'Cancelled'
-    appointment.status = 'Cancelled'
-    session.commit()
-    
-    # Find the next patient in the waitlist using prioritization
-    waitlist_entry = prioritize_waitlist(appointment.appointment_datetime)
-    
-    if waitlist_entry:
-        # Assign the appointment to the waitlisted patient
-        appointment.patient_id = waitlist_entry.patient_id
-        appointment.status = 'Scheduled'
-        session.commit()
+def process_cancellation(appointment_id, slot_index=None):
+    """
+    Offers a cancelled slot to the next patient on the waitlist, or marks it
+    'Processed' when nobody is waiting.
+
+    Parameters:
+        appointment_id (int): The cancelled appointment.
+        slot_index (slots.SlotIndex): Availability index of this process,
+                                      updated once the change is committed.
+    """
+    with session_scope() as session:
+        # Fetch the canceled appointment
+        appointment = session.query(Appointment).filter_by(id=appointment_id).first()
+        if not appointment:
+            print("Appointment not found.")
+            return False
         
-        # Remove the patient from the waitlist
-        session.delete(waitlist_entry)
-        session.commit()
+        # Find the next patient in the waitlist using prioritization
+        waitlist_entry = prioritize_waitlist(session, appointment.appointment_datetime)
         
-        # Notify the patient via email
-        patient = session.query(Patient).filter_by(id=waitlist_entry.patient_id).first()
-        if patient:
-            subject = "Your Appointment Slot is Confirmed"
-            body = f"Dear {patient.name},\n\nGood news! An open appointment slot has become available and has been scheduled for you on {appointment.appointment_datetime.strftime('%Y-%m-%d %H:%M')}.\n\nThank you."
-            send_mail(patient.email, subject, body)
-            print(f"Patient {patient.email} notified of their new appointment.")
+        if not waitlist_entry:
+            # Nobody is waiting for this slot
+            appointment.status = 'Processed'
+        else:
+            # Assign the appointment to the waitlisted patient
+            appointment.patient_id = waitlist_entry.patient_id
+            appointment.status = 'Scheduled'
+            # The slot is live again, so its reminders need to be scheduled for the new patient
+            schedule_reminders(session, [appointment])
+            
+            # Remove the patient from the waitlist
+            session.delete(waitlist_entry)
+            
+            # Queue the patient's notification in the same transaction as the assignment
+            patient = session.query(Patient).filter_by(id=waitlist_entry.patient_id).first()
+            if patient:
+                enqueue(
+                    session,
+                    *render_slot_confirmation(patient.name, patient.email, appointment.appointment_datetime),
+                    appointment_id=appointment.id
+                )
+                print(f"Patient {patient.email} will be notified of their new appointment.")
+        slot = (appointment.id, appointment.user_id, appointment.appointment_datetime, appointment.status)
+    if slot_index is not None:
+        slot_index.apply(*slot)
+    return True
+
+def render_slot_confirmation(patient_name, patient_email, appointment_datetime):
+    """
+    Returns the (to_email, subject, body) tuple telling a waitlisted patient they got a slot.
+    """
+    subject = "Your Appointment Slot is Confirmed"
+    body = f"Dear {patient_name},\n\nGood news! An open appointment slot has become available and has been scheduled for you on {appointment_datetime.strftime('%Y-%m-%d %H:%M')}.\n\nThank you."
+    return patient_email, subject, body
+
+
+def match_cancellations(session, partition=None):
+    """
+    Matches every cancelled slot against the waitlist in one query.
+
+    The n-th cancelled appointment at a given time is paired with the n-th
+    waitlist entry for that time, ordered the same way as prioritize_waitlist
+    (priority, then added_at).
+
+    Parameters:
+        partition (tuple): (index, count) to match only that share of the
+                           slot times. Slots and waitlist entries are split by
+                           time, so every pairing stays within one partition.
+
+    Returns:
+        list: Rows of appointment_id, appointment_datetime, waitlist_id,
+        patient_id, name and email. The waitlist columns are None when
+        nobody is waiting for that slot.
+    """
+    cancelled = select(Appointment.appointment_datetime).where(
+        Appointment.status == 'Cancelled',
+        in_partition(Appointment.appointment_datetime, partition)
+    )
+
+    slots = select(
+        Appointment.id.label('appointment_id'),
+        Appointment.appointment_datetime,
+        func.row_number().over(
+            partition_by=Appointment.appointment_datetime,
+            order_by=Appointment.id
+        ).label('rank')
+    ).where(
+        Appointment.status == 'Cancelled',
+        in_partition(Appointment.appointment_datetime, partition)
+    ).subquery()
+
+    entries = select(
+        Waitlist.id.label('waitlist_id'),
+        Waitlist.patient_id,
+        Waitlist.requested_datetime,
+        func.row_number().over(
+            partition_by=Waitlist.requested_datetime,
+            order_by=(Waitlist.priority.asc(), Waitlist.added_at.asc(), Waitlist.id.asc())
+        ).label('rank')
+    ).where(Waitlist.requested_datetime.in_(cancelled)).subquery()
+
+    query = select(
+        slots.c.appointment_id,
+        slots.c.appointment_datetime,
+        entries.c.waitlist_id,
+        entries.c.patient_id,
+        Patient.name,
+        Patient.email
+    ).select_from(slots).outerjoin(
+        entries,
+        and_(
+            entries.c.requested_datetime == slots.c.appointment_datetime,
+            entries.c.rank == slots.c.rank
+        )
+    ).outerjoin(Patient, Patient.id == entries.c.patient_id)
+
+    return session.execute(query).all()
+
+
+def backfill_cancellations(session, partition=None):
+    """
+    Backfills all cancelled appointments from the waitlist in a single transaction.
+
+    Matched slots are reassigned and set back to 'Scheduled', their waitlist
+    entries are removed, their reminders rescheduled and the patients'
+    notifications queued in the outbox. Slots nobody is waiting for are
+    marked 'Processed'. Nothing is committed here; the caller commits.
+    `partition` restricts the work as in match_cancellations().
+
+    Returns:
+        list: (patient_name, patient_email, appointment_datetime) for every reassigned slot.
+    """
+    matches = match_cancellations(session, partition)
+    if not matches:
+        return []
+
+    assigned = [row for row in matches if row.waitlist_id is not None]
+    unmatched_ids = [row.appointment_id for row in matches if row.waitlist_id is None]
+
+    if assigned:
+        session.bulk_update_mappings(Appointment, [
+            {'id': row.appointment_id, 'patient_id': row.patient_id, 'status': 'Scheduled'}
+            for row in assigned
+        ])
+        session.query(Waitlist).filter(
+            Waitlist.id.in_([row.waitlist_id for row in assigned])
+        ).delete(synchronize_session=False)
+        appointments = session.query(Appointment).filter(
+            Appointment.id.in_([row.appointment_id for row in assigned])
+        ).all()
+        schedule_reminders(session, appointments)
+        for row in assigned:
+            enqueue(
+                session,
+                *render_slot_confirmation(row.name, row.email, row.appointment_datetime),
+                appointment_id=row.appointment_id
+            )
+    if unmatched_ids:
+        session.query(Appointment).filter(
+            Appointment.id.in_(unmatched_ids)
+        ).update({Appointment.status: 'Processed'}, synchronize_session=False)
+
+    return [(row.name, row.email, row.appointment_datetime) for row in assigned]